@@ -1,38 +1,261 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Header, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.datastructures import MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, UpdateOne, ReturnDocument, ASCENDING, DESCENDING, monitoring
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
 import os
+import asyncio
+import contextvars
+import threading
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Set, Tuple
 import uuid
+import time
+import bisect
+import heapq
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager, nullcontext
 from datetime import datetime, timezone, timedelta
 import jwt
 import json
 import hashlib
+import base64
+import csv
+import itertools
+import secrets
+import string
+import unicodedata
+import random
 import re
+import statistics
+import math
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
-from openpyxl import Workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment
-from io import BytesIO
-import base64
+from io import TextIOWrapper
+import numpy as np
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ==================== INSTRUMENTATION DES REQUÊTES ====================
+# Chaque commande MongoDB est attribuée à la requête HTTP en cours (contextvar, que Motor
+# propage à ses threads d'exécution). Le middleware agrège ensuite par endpoint.
+REQUETE_LENTE_SECONDES = float(os.environ.get("REQUETE_LENTE_SECONDES", "2"))
+METRIQUES_TOKEN = os.environ.get("METRIQUES_TOKEN", "")
+HISTOGRAMME_DUREES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HISTOGRAMME_ALLERS_RETOURS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+class MesuresRequete:
+    """Accès base de données d'une requête HTTP"""
+    __slots__ = ("allers_retours", "documents", "duree_db")
+    
+    def __init__(self):
+        self.allers_retours = 0
+        self.documents = 0
+        self.duree_db = 0.0
+
+requete_courante: contextvars.ContextVar[Optional[MesuresRequete]] = contextvars.ContextVar("requete_courante", default=None)
+
+class Histogramme:
+    def __init__(self, bornes: tuple):
+        self.bornes = bornes
+        self.comptes = [0] * (len(bornes) + 1)
+        self.somme = 0.0
+        self.total = 0
+    
+    def observer(self, valeur: float):
+        for i, borne in enumerate(self.bornes):
+            if valeur <= borne:
+                self.comptes[i] += 1
+                break
+        else:
+            self.comptes[-1] += 1
+        self.somme += valeur
+        self.total += 1
+
+def _labels(**labels) -> str:
+    valeurs = ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels.items())
+    return "{" + valeurs + "}"
+
+class MetriquesEndpoints:
+    """Compteurs et histogrammes par endpoint, rendus au format texte Prometheus"""
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self.requetes: Dict[tuple, int] = {}
+        self.durees: Dict[tuple, Histogramme] = {}
+        self.allers_retours: Dict[tuple, Histogramme] = {}
+        self.duree_db: Dict[tuple, float] = {}
+        self.documents: Dict[tuple, int] = {}
+        self.flux: Dict[tuple, int] = {}
+        self.duree_flux: Dict[tuple, float] = {}
+        self.commandes: Dict[str, int] = {}
+        self.erreurs_commandes: Dict[str, int] = {}
+        self.duree_commandes: Dict[str, float] = {}
+    
+    def observer_commande(self, commande: str, duree: float, documents: int, erreur: bool = False):
+        mesures = requete_courante.get()
+        # Appelé depuis les threads de Motor : plusieurs commandes peuvent finir en même temps
+        with self._verrou:
+            self.commandes[commande] = self.commandes.get(commande, 0) + 1
+            self.duree_commandes[commande] = self.duree_commandes.get(commande, 0.0) + duree
+            if erreur:
+                self.erreurs_commandes[commande] = self.erreurs_commandes.get(commande, 0) + 1
+            if mesures is not None:
+                mesures.allers_retours += 1
+                mesures.documents += documents
+                mesures.duree_db += duree
+    
+    def observer_requete(self, methode: str, route: str, statut: int, duree: float, mesures: MesuresRequete):
+        cle = (methode, route)
+        with self._verrou:
+            self.requetes[cle + (statut,)] = self.requetes.get(cle + (statut,), 0) + 1
+            self.durees.setdefault(cle, Histogramme(HISTOGRAMME_DUREES)).observer(duree)
+            self.allers_retours.setdefault(cle, Histogramme(HISTOGRAMME_ALLERS_RETOURS)).observer(mesures.allers_retours)
+            self.duree_db[cle] = self.duree_db.get(cle, 0.0) + mesures.duree_db
+            self.documents[cle] = self.documents.get(cle, 0) + mesures.documents
+    
+    def observer_flux(self, methode: str, route: str, duree: float):
+        # Un flux d'événements reste ouvert par nature : hors des histogrammes de latence
+        cle = (methode, route)
+        with self._verrou:
+            self.flux[cle] = self.flux.get(cle, 0) + 1
+            self.duree_flux[cle] = self.duree_flux.get(cle, 0.0) + duree
+    
+    def exposer(self) -> List[str]:
+        lignes = []
+        
+        def entete(nom: str, type_metrique: str, aide: str):
+            lignes.append(f"# HELP {nom} {aide}")
+            lignes.append(f"# TYPE {nom} {type_metrique}")
+        
+        def histogramme(nom: str, valeurs: Dict[tuple, Histogramme]):
+            for (methode, route), h in sorted(valeurs.items()):
+                cumul = 0
+                for borne, compte in zip(h.bornes + ("+Inf",), h.comptes):
+                    cumul += compte
+                    lignes.append(f"{nom}_bucket{_labels(methode=methode, route=route, le=borne)} {cumul}")
+                lignes.append(f"{nom}_sum{_labels(methode=methode, route=route)} {h.somme}")
+                lignes.append(f"{nom}_count{_labels(methode=methode, route=route)} {h.total}")
+        
+        with self._verrou:
+            entete("profiremanager_requetes_total", "counter", "Requêtes HTTP par endpoint et code de statut")
+            for (methode, route, statut), n in sorted(self.requetes.items()):
+                lignes.append(f"profiremanager_requetes_total{_labels(methode=methode, route=route, statut=statut)} {n}")
+            entete("profiremanager_requete_duree_secondes", "histogram", "Latence totale des requêtes HTTP")
+            histogramme("profiremanager_requete_duree_secondes", self.durees)
+            entete("profiremanager_requete_db_allers_retours", "histogram", "Commandes MongoDB par requête HTTP")
+            histogramme("profiremanager_requete_db_allers_retours", self.allers_retours)
+            entete("profiremanager_requete_db_duree_secondes_total", "counter", "Temps passé en base par endpoint")
+            for (methode, route), v in sorted(self.duree_db.items()):
+                lignes.append(f"profiremanager_requete_db_duree_secondes_total{_labels(methode=methode, route=route)} {v}")
+            entete("profiremanager_requete_db_documents_total", "counter", "Documents renvoyés par la base par endpoint")
+            for (methode, route), v in sorted(self.documents.items()):
+                lignes.append(f"profiremanager_requete_db_documents_total{_labels(methode=methode, route=route)} {v}")
+            entete("profiremanager_flux_total", "counter", "Flux d'événements (SSE) fermés par endpoint")
+            for (methode, route), n in sorted(self.flux.items()):
+                lignes.append(f"profiremanager_flux_total{_labels(methode=methode, route=route)} {n}")
+            entete("profiremanager_flux_duree_secondes_total", "counter", "Durée cumulée d'ouverture des flux d'événements")
+            for (methode, route), v in sorted(self.duree_flux.items()):
+                lignes.append(f"profiremanager_flux_duree_secondes_total{_labels(methode=methode, route=route)} {v}")
+            entete("profiremanager_db_commandes_total", "counter", "Commandes MongoDB (requêtes et tâches de fond)")
+            for commande, n in sorted(self.commandes.items()):
+                lignes.append(f"profiremanager_db_commandes_total{_labels(commande=commande)} {n}")
+            entete("profiremanager_db_commandes_duree_secondes_total", "counter", "Durée cumulée des commandes MongoDB")
+            for commande, v in sorted(self.duree_commandes.items()):
+                lignes.append(f"profiremanager_db_commandes_duree_secondes_total{_labels(commande=commande)} {v}")
+            entete("profiremanager_db_commandes_erreurs_total", "counter", "Commandes MongoDB en échec")
+            for commande, n in sorted(self.erreurs_commandes.items()):
+                lignes.append(f"profiremanager_db_commandes_erreurs_total{_labels(commande=commande)} {n}")
+        return lignes
+
+metriques = MetriquesEndpoints()
+
+class EcouteurCommandes(monitoring.CommandListener):
+    def started(self, event):
+        pass
+    
+    def succeeded(self, event):
+        documents = 0
+        reply = event.reply
+        if isinstance(reply, dict):
+            curseur = reply.get("cursor")
+            if isinstance(curseur, dict):
+                documents = len(curseur.get("firstBatch") or curseur.get("nextBatch") or [])
+            elif reply.get("value") is not None:
+                documents = 1
+        metriques.observer_commande(event.command_name, event.duration_micros / 1e6, documents)
+    
+    def failed(self, event):
+        metriques.observer_commande(event.command_name, event.duration_micros / 1e6, 0, erreur=True)
+
+class MiddlewareMetriques:
+    """Middleware ASGI : mesure chaque requête et l'agrège sous le chemin de sa route (/api/users/{user_id})"""
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        mesures = MesuresRequete()
+        jeton = requete_courante.set(mesures)
+        debut = time.perf_counter()
+        statut = 500
+        flux = False
+        
+        async def envoyer(message):
+            nonlocal statut, flux
+            if message["type"] == "http.response.start":
+                statut = message["status"]
+                flux = any(nom == b"content-type" and valeur.startswith(b"text/event-stream") for nom, valeur in message.get("headers", []))
+                MutableHeaders(scope=message).append(
+                    "Server-Timing", f'db;dur={mesures.duree_db * 1000:.1f};desc="{mesures.allers_retours} commandes"'
+                )
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, envoyer)
+        finally:
+            requete_courante.reset(jeton)
+            duree = time.perf_counter() - debut
+            route = scope.get("route")
+            chemin = getattr(route, "path", None) or "(non routée)"
+            if flux:
+                metriques.observer_flux(scope["method"], chemin, duree)
+            else:
+                metriques.observer_requete(scope["method"], chemin, statut, duree, mesures)
+            if duree >= REQUETE_LENTE_SECONDES and not flux:
+                logger.warning(
+                    f"Requête lente {scope['method']} {scope['path']}: {duree:.2f}s, "
+                    f"{mesures.allers_retours} commandes MongoDB, {mesures.documents} documents, {mesures.duree_db:.2f}s en base"
+                )
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[EcouteurCommandes()])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
@@ -46,6 +269,13 @@ SECRET_KEY = os.environ.get("JWT_SECRET", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 24 * 60  # 24 hours
 
+# Cache des utilisateurs authentifiés
+USER_CACHE_MAX_SIZE = int(os.environ.get("USER_CACHE_MAX_SIZE", "2000"))
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+
+# Cache du tableau de bord (/statistiques)
+STATISTIQUES_CACHE_TTL_SECONDS = float(os.environ.get("STATISTIQUES_CACHE_TTL_SECONDS", "300"))
+
 # Simplified password hashing
 
 # Helper functions
@@ -66,150 +296,512 @@ def validate_complex_password(password: str) -> bool:
     
     return has_uppercase and has_digit and has_special
 
-def send_welcome_email(user_email: str, user_name: str, user_role: str, temp_password: str):
+def construire_email_bienvenue(user_email: str, user_name: str, user_role: str, temp_password: str) -> Dict[str, str]:
     """
-    Envoie un email de bienvenue avec les informations de connexion
+    Construit l'email de bienvenue avec les informations de connexion (envoyé via la file d'envoi)
     """
-    try:
-        # Définir les modules selon le rôle
-        modules_by_role = {
-            'admin': [
-                "📊 Tableau de bord - Vue d'ensemble et statistiques",
-                "👥 Personnel - Gestion complète des pompiers", 
-                "📅 Planning - Attribution automatique et manuelle",
-                "🔄 Remplacements - Validation des demandes",
-                "📚 Formations - Inscription et gestion",
-                "📈 Rapports - Analyses et exports",
-                "⚙️ Paramètres - Configuration système",
-                "👤 Mon profil - Informations personnelles"
-            ],
-            'superviseur': [
-                "📊 Tableau de bord - Vue d'ensemble et statistiques",
-                "👥 Personnel - Consultation des pompiers",
-                "📅 Planning - Gestion et validation", 
-                "🔄 Remplacements - Approbation des demandes",
-                "📚 Formations - Inscription et gestion",
-                "👤 Mon profil - Informations personnelles"
-            ],
-            'employe': [
-                "📊 Tableau de bord - Vue d'ensemble personnalisée",
-                "📅 Planning - Consultation de votre planning",
-                "🔄 Remplacements - Demandes de remplacement",
-                "📚 Formations - Inscription aux formations",
-                "👤 Mon profil - Informations et disponibilités"
-            ]
-        }
-        
-        role_name = {
-            'admin': 'Administrateur',
-            'superviseur': 'Superviseur', 
-            'employe': 'Employé'
-        }.get(user_role, 'Utilisateur')
-        
-        user_modules = modules_by_role.get(user_role, modules_by_role['employe'])
-        modules_html = ''.join([f'<li style="margin-bottom: 8px;">{module}</li>' for module in user_modules])
-        
-        subject = f"Bienvenue dans ProFireManager v2.0 - Votre compte {role_name}"
-        
-        html_content = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <div style="text-align: center; margin-bottom: 30px;">
-                    <img src="https://customer-assets.emergentagent.com/job_fireshift-manager/artifacts/6vh2i9cz_05_Icone_Flamme_Rouge_Bordure_D9072B_VISIBLE.png" 
-                         alt="ProFireManager" 
-                         style="width: 100px; height: 100px; margin-bottom: 15px;">
-                    <h1 style="color: #dc2626; margin: 0;">ProFireManager v2.0</h1>
-                    <p style="color: #666; margin: 5px 0;">Système de gestion des services d'incendie</p>
-                </div>
-                
-                <h2 style="color: #1e293b;">Bonjour {user_name},</h2>
-                
-                <p>Votre compte <strong>{role_name}</strong> a été créé avec succès dans ProFireManager v2.0, le système de gestion des horaires et remplacements automatisés pour les services d'incendie du Canada.</p>
-                
-                <div style="background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 8px; padding: 20px; margin: 20px 0;">
-                    <h3 style="color: #dc2626; margin-top: 0;">🔑 Informations de connexion :</h3>
-                    <p><strong>Email :</strong> {user_email}</p>
-                    <p><strong>Mot de passe temporaire :</strong> {temp_password}</p>
-                    <p style="color: #dc2626; font-weight: bold;">⚠️ Veuillez modifier votre mot de passe lors de votre première connexion</p>
-                </div>
-                
-                <div style="text-align: center; margin: 30px 0;">
-                    <a href="{os.environ.get('FRONTEND_URL', 'https://fire-personnel.preview.emergentagent.com')}" 
-                       style="background: #dc2626; color: white; padding: 12px 24px; text-decoration: none; border-radius: 8px; font-weight: bold; display: inline-block;">
-                        🚒 Accéder à ProFireManager
-                    </a>
-                    <p style="font-size: 12px; color: #666; margin-top: 10px;">
-                        💡 Conseil : Ajoutez ce lien à vos favoris pour un accès rapide
-                    </p>
-                </div>
-                
-                <h3 style="color: #1e293b;">📋 Modules disponibles pour votre rôle ({role_name}) :</h3>
-                <ul style="background: #f0fdf4; border-left: 4px solid #10b981; padding: 15px 20px; margin: 15px 0;">
-                    {modules_html}
+    # Définir les modules selon le rôle
+    modules_by_role = {
+        'admin': [
+            "📊 Tableau de bord - Vue d'ensemble et statistiques",
+            "👥 Personnel - Gestion complète des pompiers", 
+            "📅 Planning - Attribution automatique et manuelle",
+            "🔄 Remplacements - Validation des demandes",
+            "📚 Formations - Inscription et gestion",
+            "📈 Rapports - Analyses et exports",
+            "⚙️ Paramètres - Configuration système",
+            "👤 Mon profil - Informations personnelles"
+        ],
+        'superviseur': [
+            "📊 Tableau de bord - Vue d'ensemble et statistiques",
+            "👥 Personnel - Consultation des pompiers",
+            "📅 Planning - Gestion et validation", 
+            "🔄 Remplacements - Approbation des demandes",
+            "📚 Formations - Inscription et gestion",
+            "👤 Mon profil - Informations personnelles"
+        ],
+        'employe': [
+            "📊 Tableau de bord - Vue d'ensemble personnalisée",
+            "📅 Planning - Consultation de votre planning",
+            "🔄 Remplacements - Demandes de remplacement",
+            "📚 Formations - Inscription aux formations",
+            "👤 Mon profil - Informations et disponibilités"
+        ]
+    }
+    
+    role_name = {
+        'admin': 'Administrateur',
+        'superviseur': 'Superviseur', 
+        'employe': 'Employé'
+    }.get(user_role, 'Utilisateur')
+    
+    user_modules = modules_by_role.get(user_role, modules_by_role['employe'])
+    modules_html = ''.join([f'<li style="margin-bottom: 8px;">{module}</li>' for module in user_modules])
+    
+    subject = f"Bienvenue dans ProFireManager v2.0 - Votre compte {role_name}"
+    
+    html_content = f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+            <div style="text-align: center; margin-bottom: 30px;">
+                <img src="https://customer-assets.emergentagent.com/job_fireshift-manager/artifacts/6vh2i9cz_05_Icone_Flamme_Rouge_Bordure_D9072B_VISIBLE.png" 
+                     alt="ProFireManager" 
+                     style="width: 100px; height: 100px; margin-bottom: 15px;">
+                <h1 style="color: #dc2626; margin: 0;">ProFireManager v2.0</h1>
+                <p style="color: #666; margin: 5px 0;">Système de gestion des services d'incendie</p>
+            </div>
+            
+            <h2 style="color: #1e293b;">Bonjour {user_name},</h2>
+            
+            <p>Votre compte <strong>{role_name}</strong> a été créé avec succès dans ProFireManager v2.0, le système de gestion des horaires et remplacements automatisés pour les services d'incendie du Canada.</p>
+            
+            <div style="background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 8px; padding: 20px; margin: 20px 0;">
+                <h3 style="color: #dc2626; margin-top: 0;">🔑 Informations de connexion :</h3>
+                <p><strong>Email :</strong> {user_email}</p>
+                <p><strong>Mot de passe temporaire :</strong> {temp_password}</p>
+                <p style="color: #dc2626; font-weight: bold;">⚠️ Veuillez modifier votre mot de passe lors de votre première connexion</p>
+            </div>
+            
+            <div style="text-align: center; margin: 30px 0;">
+                <a href="{os.environ.get('FRONTEND_URL', 'https://fire-personnel.preview.emergentagent.com')}" 
+                   style="background: #dc2626; color: white; padding: 12px 24px; text-decoration: none; border-radius: 8px; font-weight: bold; display: inline-block;">
+                    🚒 Accéder à ProFireManager
+                </a>
+                <p style="font-size: 12px; color: #666; margin-top: 10px;">
+                    💡 Conseil : Ajoutez ce lien à vos favoris pour un accès rapide
+                </p>
+            </div>
+            
+            <h3 style="color: #1e293b;">📋 Modules disponibles pour votre rôle ({role_name}) :</h3>
+            <ul style="background: #f0fdf4; border-left: 4px solid #10b981; padding: 15px 20px; margin: 15px 0;">
+                {modules_html}
+            </ul>
+            
+            <div style="background: #fef3c7; border: 1px solid #fcd34d; border-radius: 8px; padding: 15px; margin: 20px 0;">
+                <h4 style="color: #92400e; margin-top: 0;">🔒 Sécurité de votre compte :</h4>
+                <ul style="color: #78350f; margin: 10px 0;">
+                    <li>Modifiez votre mot de passe temporaire dès votre première connexion</li>
+                    <li>Utilisez un mot de passe complexe (8 caractères, majuscule, chiffre, caractère spécial)</li>
+                    <li>Ne partagez jamais vos identifiants</li>
+                    <li>Déconnectez-vous après chaque session</li>
                 </ul>
-                
-                <div style="background: #fef3c7; border: 1px solid #fcd34d; border-radius: 8px; padding: 15px; margin: 20px 0;">
-                    <h4 style="color: #92400e; margin-top: 0;">🔒 Sécurité de votre compte :</h4>
-                    <ul style="color: #78350f; margin: 10px 0;">
-                        <li>Modifiez votre mot de passe temporaire dès votre première connexion</li>
-                        <li>Utilisez un mot de passe complexe (8 caractères, majuscule, chiffre, caractère spécial)</li>
-                        <li>Ne partagez jamais vos identifiants</li>
-                        <li>Déconnectez-vous après chaque session</li>
-                    </ul>
-                </div>
-                
-                <hr style="border: none; border-top: 1px solid #e2e8f0; margin: 30px 0;">
-                
-                <p style="color: #666; font-size: 14px; text-align: center;">
-                    Cet email a été envoyé automatiquement par ProFireManager v2.0.<br>
-                    Si vous avez des questions, contactez votre administrateur système.
+            </div>
+            
+            <hr style="border: none; border-top: 1px solid #e2e8f0; margin: 30px 0;">
+            
+            <p style="color: #666; font-size: 14px; text-align: center;">
+                Cet email a été envoyé automatiquement par ProFireManager v2.0.<br>
+                Si vous avez des questions, contactez votre administrateur système.
+            </p>
+            
+            <div style="text-align: center; margin-top: 20px;">
+                <p style="color: #999; font-size: 12px;">
+                    ProFireManager v2.0 - Système de gestion des services d'incendie du Canada<br>
+                    Développé pour optimiser la gestion des horaires et remplacements automatisés
                 </p>
-                
-                <div style="text-align: center; margin-top: 20px;">
-                    <p style="color: #999; font-size: 12px;">
-                        ProFireManager v2.0 - Système de gestion des services d'incendie du Canada<br>
-                        Développé pour optimiser la gestion des horaires et remplacements automatisés
-                    </p>
-                </div>
             </div>
-        </body>
-        </html>
-        """
-        
-        # Envoyer l'email via SendGrid
+        </div>
+    </body>
+    </html>
+    """
+    
+    return {
+        "destinataire": user_email,
+        "sujet": subject,
+        "contenu_html": html_content
+    }
+
+# ==================== WORKERS D'ARRIÈRE-PLAN ====================
+
+class WorkerArrierePlan(ABC):
+    """
+    Boucle asyncio d'un worker adossé à une collection : traiter() est appelé au démarrage,
+    à chaque réveil (nouvelle entrée) et au plus tard toutes les `intervalle` secondes.
+    """
+    nom = "worker"
+    
+    def __init__(self, intervalle: float):
+        self.intervalle = intervalle
+        self._reveil = asyncio.Event()
+        self._tache: Optional[asyncio.Task] = None
+    
+    @abstractmethod
+    async def traiter(self) -> int:
+        ...
+    
+    def reveiller(self):
+        self._reveil.set()
+    
+    async def _boucle(self):
+        while True:
+            try:
+                await self.traiter()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erreur du {self.nom}: {str(e)}")
+            try:
+                await asyncio.wait_for(self._reveil.wait(), timeout=self.intervalle)
+            except asyncio.TimeoutError:
+                pass
+            self._reveil.clear()
+    
+    def demarrer(self):
+        if self._tache is None or self._tache.done():
+            self._tache = asyncio.create_task(self._boucle())
+    
+    async def arreter(self):
+        if self._tache is not None:
+            self._tache.cancel()
+            try:
+                await self._tache
+            except asyncio.CancelledError:
+                pass
+            self._tache = None
+
+# ==================== FILE D'ENVOI DES EMAILS ====================
+
+# Collection emails_sortants : les emails sont mis en file et envoyés par un worker asyncio,
+# par lots, avec reprises (backoff exponentiel) et état abandonné (dead-letter).
+EMAIL_TRANSPORT = os.environ.get("EMAIL_TRANSPORT", "sendgrid")  # sendgrid, fichier
+EMAIL_DOSSIER_FICHIER = os.environ.get("EMAIL_DOSSIER_FICHIER", str(ROOT_DIR / "emails_sortants"))
+EMAIL_TAILLE_LOT = int(os.environ.get("EMAIL_TAILLE_LOT", "20"))
+EMAIL_MAX_TENTATIVES = int(os.environ.get("EMAIL_MAX_TENTATIVES", "5"))
+EMAIL_DELAI_REPRISE_SECONDES = float(os.environ.get("EMAIL_DELAI_REPRISE_SECONDES", "30"))
+EMAIL_INTERVALLE_SECONDES = float(os.environ.get("EMAIL_INTERVALLE_SECONDES", "10"))
+EMAIL_VERROU_SECONDES = 300
+# Un email abandonné garde son contenu (mot de passe temporaire) le temps d'une éventuelle relance
+EMAIL_RETENTION_ABANDONNES_HEURES = float(os.environ.get("EMAIL_RETENTION_ABANDONNES_HEURES", "72"))
+
+class ErreurEmailDefinitive(Exception):
+    """Échec qui ne se résoudra pas par une nouvelle tentative (configuration, destinataire refusé)"""
+
+class TransportEmail(ABC):
+    """Transport d'envoi : lève une exception en cas d'échec (ErreurEmailDefinitive = sans reprise)"""
+    nom = "abstrait"
+    
+    @abstractmethod
+    async def envoyer(self, email: Dict[str, Any]):
+        ...
+
+class TransportSendGrid(TransportEmail):
+    nom = "sendgrid"
+    
+    async def envoyer(self, email: Dict[str, Any]):
         sendgrid_api_key = os.environ.get('SENDGRID_API_KEY')
         sender_email = os.environ.get('SENDER_EMAIL', 'noreply@profiremanager.ca')
-        
         if not sendgrid_api_key:
-            print(f"[WARNING] SENDGRID_API_KEY non configurée - Email non envoyé à {user_email}")
-            return False
+            raise ErreurEmailDefinitive("SENDGRID_API_KEY non configurée")
         
-        try:
-            message = Mail(
-                from_email=sender_email,
-                to_emails=user_email,
-                subject=subject,
-                html_content=html_content
+        message = Mail(
+            from_email=sender_email,
+            to_emails=email["destinataire"],
+            subject=email["sujet"],
+            html_content=email["contenu_html"]
+        )
+        # Appel HTTP bloquant : exécuté hors de la boucle d'événements
+        response = await asyncio.to_thread(SendGridAPIClient(sendgrid_api_key).send, message)
+        if response.status_code not in [200, 201, 202]:
+            if 400 <= response.status_code < 500 and response.status_code != 429:
+                raise ErreurEmailDefinitive(f"SendGrid code {response.status_code}")
+            raise RuntimeError(f"SendGrid code {response.status_code}")
+
+class TransportFichier(TransportEmail):
+    """Écrit chaque email en JSON dans un dossier local (développement, tests)"""
+    nom = "fichier"
+    
+    def __init__(self, dossier: str = EMAIL_DOSSIER_FICHIER):
+        self.dossier = Path(dossier)
+    
+    async def envoyer(self, email: Dict[str, Any]):
+        def ecrire():
+            self.dossier.mkdir(parents=True, exist_ok=True)
+            contenu = {k: email.get(k) for k in ("id", "type", "destinataire", "sujet", "contenu_html")}
+            (self.dossier / f"{email['id']}.json").write_text(json.dumps(contenu, ensure_ascii=False), encoding="utf-8")
+        await asyncio.to_thread(ecrire)
+
+TRANSPORTS_EMAIL = {
+    TransportSendGrid.nom: TransportSendGrid,
+    TransportFichier.nom: TransportFichier,
+}
+
+def creer_transport_email(nom: str = EMAIL_TRANSPORT) -> TransportEmail:
+    if nom not in TRANSPORTS_EMAIL:
+        raise ValueError(f"Transport email inconnu: {nom} ({', '.join(TRANSPORTS_EMAIL)})")
+    return TRANSPORTS_EMAIL[nom]()
+
+class FileEmails(WorkerArrierePlan):
+    """
+    Worker d'envoi de la collection emails_sortants (statut en_attente → en_cours → envoye / abandonne).
+    Les lots sont réservés atomiquement (find_one_and_update) : plusieurs processus peuvent tourner.
+    Une réservation expirée (processus arrêté en cours d'envoi) est reprise par un autre worker.
+    """
+    nom = "worker d'emails"
+    
+    def __init__(self, transport: TransportEmail):
+        super().__init__(EMAIL_INTERVALLE_SECONDES)
+        self.transport = transport
+        self.envoyes = 0
+        self.echecs = 0
+        self.abandonnes = 0
+    
+    async def ajouter(self, emails: List[Dict[str, Any]]) -> List[str]:
+        """Met des emails (destinataire, sujet, contenu_html, type) en file et réveille le worker"""
+        maintenant = datetime.now(timezone.utc)
+        documents = [
+            {
+                "id": str(uuid.uuid4()),
+                "type": email.get("type", "general"),
+                "destinataire": email["destinataire"],
+                "sujet": email["sujet"],
+                "contenu_html": email["contenu_html"],
+                "statut": "en_attente",
+                "tentatives": 0,
+                "prochaine_tentative": maintenant,
+                "derniere_erreur": None,
+                "created_at": maintenant,
+                "envoye_le": None
+            }
+            for email in emails
+        ]
+        if documents:
+            await db.emails_sortants.insert_many(documents, ordered=False)
+            self.reveiller()
+        return [d["id"] for d in documents]
+    
+    async def _reserver_lot(self) -> List[Dict[str, Any]]:
+        maintenant = datetime.now(timezone.utc)
+        lot = []
+        for _ in range(EMAIL_TAILLE_LOT):
+            email = await db.emails_sortants.find_one_and_update(
+                {"$or": [
+                    {"statut": "en_attente", "prochaine_tentative": {"$lte": maintenant}},
+                    {"statut": "en_cours", "verrou_jusqu_a": {"$lte": maintenant}}
+                ]},
+                {"$set": {"statut": "en_cours", "verrou_jusqu_a": maintenant + timedelta(seconds=EMAIL_VERROU_SECONDES)}},
+                sort=[("prochaine_tentative", ASCENDING)],
+                return_document=ReturnDocument.AFTER
             )
-            
-            sg = SendGridAPIClient(sendgrid_api_key)
-            response = sg.send(message)
-            
-            if response.status_code in [200, 201, 202]:
-                print(f"✅ Email de bienvenue envoyé avec succès à {user_email}")
-                return True
-            else:
-                print(f"⚠️ Erreur SendGrid (code {response.status_code}) pour {user_email}")
-                return False
-                
+            if email is None:
+                break
+            lot.append(email)
+        return lot
+    
+    async def _envoyer(self, email: Dict[str, Any]):
+        maintenant = datetime.now(timezone.utc)
+        try:
+            await self.transport.envoyer(email)
         except Exception as e:
-            print(f"❌ Erreur lors de l'envoi de l'email à {user_email}: {str(e)}")
-            return False
-        
-    except Exception as e:
-        print(f"Erreur envoi email: {str(e)}")
-        return False
+            tentatives = email.get("tentatives", 0) + 1
+            definitif = isinstance(e, ErreurEmailDefinitive) or tentatives >= EMAIL_MAX_TENTATIVES
+            self.echecs += 1
+            if definitif:
+                self.abandonnes += 1
+                logger.error(f"Email {email['id']} à {email['destinataire']} abandonné: {str(e)}")
+            await db.emails_sortants.update_one(
+                {"id": email["id"]},
+                {"$set": {
+                    "statut": "abandonne" if definitif else "en_attente",
+                    "tentatives": tentatives,
+                    "derniere_erreur": str(e),
+                    "prochaine_tentative": maintenant + timedelta(
+                        seconds=EMAIL_DELAI_REPRISE_SECONDES * 2 ** (tentatives - 1) * random.uniform(0.8, 1.2)
+                    ),
+                    "abandonne_le": maintenant if definitif else None
+                }, "$unset": {"verrou_jusqu_a": ""}}
+            )
+            return
+        
+        self.envoyes += 1
+        # Le contenu (mot de passe temporaire) n'est pas conservé une fois l'email envoyé
+        await db.emails_sortants.update_one(
+            {"id": email["id"]},
+            {"$set": {"statut": "envoye", "envoye_le": maintenant, "tentatives": email.get("tentatives", 0) + 1},
+             "$unset": {"contenu_html": "", "verrou_jusqu_a": ""}}
+        )
+    
+    async def effacer_contenus_abandonnes(self) -> int:
+        """Retire le contenu des emails abandonnés depuis plus de EMAIL_RETENTION_ABANDONNES_HEURES"""
+        limite = datetime.now(timezone.utc) - timedelta(hours=EMAIL_RETENTION_ABANDONNES_HEURES)
+        result = await db.emails_sortants.update_many(
+            {"statut": "abandonne", "abandonne_le": {"$lte": limite}, "contenu_html": {"$exists": True}},
+            {"$unset": {"contenu_html": ""}, "$set": {"contenu_efface": True}}
+        )
+        return result.modified_count
+    
+    async def traiter(self) -> int:
+        """Envoie tous les emails dus, lot par lot ; retourne le nombre d'emails traités"""
+        await self.effacer_contenus_abandonnes()
+        traites = 0
+        while True:
+            lot = await self._reserver_lot()
+            if not lot:
+                return traites
+            await asyncio.gather(*(self._envoyer(email) for email in lot))
+            traites += len(lot)
+    
+    async def stats(self) -> Dict[str, Any]:
+        par_statut = await db.emails_sortants.aggregate([
+            {"$group": {"_id": "$statut", "nombre": {"$sum": 1}}}
+        ]).to_list(None)
+        return {
+            "transport": self.transport.nom,
+            "par_statut": {s["_id"]: s["nombre"] for s in par_statut},
+            "envoyes": self.envoyes,
+            "echecs": self.echecs,
+            "abandonnes": self.abandonnes
+        }
+
+file_emails = FileEmails(creer_transport_email())
+
+# ==================== SUPPRESSIONS EN CASCADE ====================
+# Collection taches_suppression : les données liées à un utilisateur ou à un type de garde
+# supprimé sont effacées en arrière-plan, par lots bornés, avec progression et reprise.
+SUPPRESSION_TAILLE_LOT = int(os.environ.get("SUPPRESSION_TAILLE_LOT", "1000"))
+SUPPRESSION_MAX_TENTATIVES = 5
+SUPPRESSION_DELAI_REPRISE_SECONDES = 30
+SUPPRESSION_INTERVALLE_SECONDES = 30
+SUPPRESSION_VERROU_SECONDES = 120
+
+def etapes_suppression_utilisateur(user_id: str, remplacements_acceptes: bool = False) -> List[Dict[str, Any]]:
+    # Le registre des heures est vidé en premier : les totaux ne comptent plus l'utilisateur
+    etapes = [
+        ("heures_mensuelles", {"user_id": user_id}),
+        ("disponibilites", {"user_id": user_id}),
+        ("assignations", {"user_id": user_id}),
+        ("demandes_remplacement", {"demandeur_id": user_id}),
+    ]
+    if remplacements_acceptes:
+        etapes.append(("demandes_remplacement", {"remplacant_id": user_id}))
+    return [{"collection": c, "filtre": f, "a_supprimer": None, "supprimes": 0, "terminee": False} for c, f in etapes]
+
+def etapes_suppression_type_garde(type_garde_id: str) -> List[Dict[str, Any]]:
+    etapes = [
+        ("heures_mensuelles", {"type_garde_id": type_garde_id}),
+        ("assignations", {"type_garde_id": type_garde_id}),
+    ]
+    return [{"collection": c, "filtre": f, "a_supprimer": None, "supprimes": 0, "terminee": False} for c, f in etapes]
+
+class TachesSuppression(WorkerArrierePlan):
+    """
+    Worker des suppressions en cascade (statut en_attente → en_cours → terminee / echec).
+    Chaque étape supprime par lots de _id ; la progression est enregistrée après chaque lot,
+    et une tâche interrompue (redémarrage, verrou expiré) reprend là où elle s'était arrêtée.
+    """
+    nom = "worker de suppression"
+    
+    def __init__(self):
+        super().__init__(SUPPRESSION_INTERVALLE_SECONDES)
+    
+    async def creer(self, type_tache: str, cible_id: str, etapes: List[Dict[str, Any]], demandeur_id: str) -> Dict[str, Any]:
+        maintenant = datetime.now(timezone.utc)
+        tache = {
+            "id": str(uuid.uuid4()),
+            "type": type_tache,
+            "cible_id": cible_id,
+            "etapes": etapes,
+            "statut": "en_attente",
+            "tentatives": 0,
+            "derniere_erreur": None,
+            "demandeur_id": demandeur_id,
+            "verrou_jusqu_a": maintenant,
+            "created_at": maintenant,
+            "updated_at": maintenant,
+            "terminee_le": None
+        }
+        await db.taches_suppression.insert_one(tache)
+        self.reveiller()
+        return clean_mongo_doc(tache)
+    
+    async def _reserver(self) -> Optional[Dict[str, Any]]:
+        maintenant = datetime.now(timezone.utc)
+        return await db.taches_suppression.find_one_and_update(
+            {"statut": {"$in": ["en_attente", "en_cours"]}, "verrou_jusqu_a": {"$lte": maintenant}},
+            {"$set": {"statut": "en_cours", "verrou_jusqu_a": maintenant + timedelta(seconds=SUPPRESSION_VERROU_SECONDES)}},
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def _executer(self, tache: Dict[str, Any]):
+        for index, etape in enumerate(tache["etapes"]):
+            if etape["terminee"]:
+                continue
+            collection = db[etape["collection"]]
+            if etape["a_supprimer"] is None:
+                a_supprimer = await collection.count_documents(etape["filtre"])
+                await db.taches_suppression.update_one(
+                    {"id": tache["id"]},
+                    {"$set": {f"etapes.{index}.a_supprimer": etape["supprimes"] + a_supprimer}}
+                )
+            while True:
+                ids = [d["_id"] async for d in collection.find(etape["filtre"], {"_id": 1}).limit(SUPPRESSION_TAILLE_LOT)]
+                if not ids:
+                    break
+                result = await collection.delete_many({"_id": {"$in": ids}})
+                await db.taches_suppression.update_one(
+                    {"id": tache["id"]},
+                    {"$inc": {f"etapes.{index}.supprimes": result.deleted_count},
+                     "$set": {
+                         "updated_at": datetime.now(timezone.utc),
+                         "verrou_jusqu_a": datetime.now(timezone.utc) + timedelta(seconds=SUPPRESSION_VERROU_SECONDES)
+                     }}
+                )
+                if etape["collection"] == "assignations":
+                    await signaler_modification_assignations()
+            await db.taches_suppression.update_one({"id": tache["id"]}, {"$set": {f"etapes.{index}.terminee": True}})
+        
+        maintenant = datetime.now(timezone.utc)
+        await db.taches_suppression.update_one(
+            {"id": tache["id"]},
+            {"$set": {"statut": "terminee", "terminee_le": maintenant, "updated_at": maintenant},
+             "$unset": {"verrou_jusqu_a": ""}}
+        )
+        statistiques_cache.invalidate()
+        logger.info(f"Suppression en cascade {tache['type']} {tache['cible_id']} terminée")
+    
+    async def traiter(self) -> int:
+        """Exécute toutes les tâches disponibles ; retourne le nombre de tâches traitées"""
+        traitees = 0
+        while True:
+            tache = await self._reserver()
+            if tache is None:
+                return traitees
+            try:
+                await self._executer(tache)
+            except Exception as e:
+                tentatives = tache.get("tentatives", 0) + 1
+                echec = tentatives >= SUPPRESSION_MAX_TENTATIVES
+                logger.error(f"Suppression en cascade {tache['id']} (tentative {tentatives}): {str(e)}")
+                await db.taches_suppression.update_one(
+                    {"id": tache["id"]},
+                    {"$set": {
+                        "statut": "echec" if echec else "en_attente",
+                        "tentatives": tentatives,
+                        "derniere_erreur": str(e),
+                        "updated_at": datetime.now(timezone.utc),
+                        "verrou_jusqu_a": datetime.now(timezone.utc) + timedelta(
+                            seconds=SUPPRESSION_DELAI_REPRISE_SECONDES * 2 ** (tentatives - 1)
+                        )
+                    }}
+                )
+            traitees += 1
+    
+
+taches_suppression = TachesSuppression()
+
+def progression_suppression(tache: Dict[str, Any]) -> Dict[str, Any]:
+    """Vue d'une tâche de suppression avec un pourcentage global"""
+    tache = clean_mongo_doc(dict(tache))
+    tache.pop("verrou_jusqu_a", None)
+    total = sum(e["a_supprimer"] or 0 for e in tache["etapes"])
+    supprimes = sum(e["supprimes"] for e in tache["etapes"])
+    if tache["statut"] == "terminee":
+        tache["progression"] = 100
+    else:
+        tache["progression"] = min(99, round(100 * supprimes / total)) if total else 0
+    tache["supprimes"] = supprimes
+    return tache
 
 def verify_password(plain_password, hashed_password):
     return hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
@@ -239,6 +831,27 @@ class User(BaseModel):
     mot_de_passe_hash: str = ""
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class UserIdentite(BaseModel):
+    """Projection minimale pour les listes de sélection (planning, remplacements, tableau de bord)"""
+    id: str
+    nom: str
+    prenom: str
+    grade: str
+    fonction_superieur: bool = False
+    type_emploi: str
+    statut: str = "Actif"
+
+class UserResume(UserIdentite):
+    """Colonnes affichées par les listes du personnel et des comptes d'accès ; la fiche complète vient de /users/{id}"""
+    email: str
+    telephone: str = ""
+    contact_urgence: str = ""
+    heures_max_semaine: int = 40
+    role: str
+    numero_employe: str
+    date_embauche: str
+    formations: List[str] = []
+
 class UserCreate(BaseModel):
     nom: str
     prenom: str
@@ -300,6 +913,7 @@ class Assignation(BaseModel):
     date: str
     statut: str = "planifie"  # planifie, confirme, remplacement_demande
     assignation_type: str = "auto"  # auto, manuel, manuel_avance
+    run_id: Optional[str] = None  # Exécution d'attribution automatique ayant créé l'assignation
 
 class AssignationCreate(BaseModel):
     user_id: str
@@ -307,6 +921,20 @@ class AssignationCreate(BaseModel):
     date: str
     assignation_type: str = "manuel"
 
+class RegleRecurrence(BaseModel):
+    type: str = "hebdomadaire"  # unique, hebdomadaire, bihebdomadaire, mensuel, nieme_jour_semaine
+    date_debut: str  # YYYY-MM-DD
+    date_fin: Optional[str] = None  # YYYY-MM-DD, date_debut par défaut
+    jours_semaine: List[str] = []  # monday..sunday (hebdomadaire, bihebdomadaire, nieme_jour_semaine)
+    jour_mois: Optional[int] = None  # mensuel : jour de date_debut par défaut
+    rang: Optional[int] = None  # nieme_jour_semaine : 1 à 5, -1 = dernier du mois
+    exceptions: List[str] = []  # Dates exclues (YYYY-MM-DD)
+
+class AssignationRecurrenteCreate(BaseModel):
+    user_ids: List[str]
+    type_garde_ids: List[str]
+    regles: List[RegleRecurrence]
+
 class DemandeRemplacement(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     demandeur_id: str
@@ -377,19 +1005,161 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class UserCache:
+    """
+    Cache LRU borné (avec expiration) des objets User déjà validés, indexé par id.
+    Les objets retournés sont partagés entre les requêtes : ne pas les modifier.
+    Le TTL borne la durée de vie d'une entrée obsolète lorsque plusieurs workers
+    tournent en parallèle (l'invalidation n'est que locale au processus).
+    """
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    @property
+    def generation(self) -> int:
+        return self._generation
+    
+    def get(self, user_id: str) -> Optional["User"]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        user, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return user
+    
+    def set(self, user: "User", generation: int):
+        # Une invalidation survenue pendant la lecture en base rend la valeur obsolète
+        if generation != self._generation or self.max_size <= 0:
+            return
+        self._entries[user.id] = (user, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(user.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id: str):
+        self._generation += 1
+        self.invalidations += 1
+        self._entries.pop(user_id, None)
+    
+    def clear(self):
+        self._generation += 1
+        self.invalidations += 1
+        self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "taille": len(self._entries),
+            "taille_max": self.max_size,
+            "ttl_secondes": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "taux_hit": round(self.hits / total, 4) if total else 0.0
+        }
+
+user_cache = UserCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+
+class SnapshotCache:
+    """
+    Valeur calculée unique partagée par toutes les requêtes (ex: tableau de bord).
+    Les requêtes concurrentes attendent le même calcul (single-flight). La valeur est
+    invalidée par événement (invalidate), quand la clé change (ex: date du jour) ou au
+    bout du TTL, qui borne l'obsolescence entre plusieurs workers.
+    """
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._valeur: Any = None
+        self._cle: Any = None
+        self._expire_a = 0.0
+        self._generation = 0
+        self._calcul: Optional[asyncio.Task] = None
+        self._calcul_cle: Any = None
+        self.hits = 0
+        self.calculs = 0
+        self.invalidations = 0
+    
+    async def get(self, cle: Any, calculer):
+        if self._valeur is not None and self._cle == cle and self._expire_a > time.monotonic():
+            self.hits += 1
+            return self._valeur
+        
+        if self._calcul is None or self._calcul_cle != cle:
+            self._calcul_cle = cle
+            self._calcul = asyncio.ensure_future(self._executer(cle, calculer))
+        # Une requête annulée n'annule pas le calcul partagé
+        return await asyncio.shield(self._calcul)
+    
+    async def _executer(self, cle: Any, calculer):
+        generation = self._generation
+        try:
+            valeur = await calculer()
+            self.calculs += 1
+            # Une invalidation survenue pendant le calcul rend la valeur obsolète
+            if generation == self._generation:
+                self._valeur, self._cle = valeur, cle
+                self._expire_a = time.monotonic() + self.ttl_seconds
+            return valeur
+        finally:
+            if self._calcul is asyncio.current_task():
+                self._calcul = None
+    
+    def invalidate(self):
+        self._generation += 1
+        self.invalidations += 1
+        self._valeur = None
+        # Les prochaines requêtes ne rejoignent pas un calcul démarré avant l'invalidation
+        self._calcul = None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl_secondes": self.ttl_seconds,
+            "hits": self.hits,
+            "calculs": self.calculs,
+            "invalidations": self.invalidations
+        }
+
+statistiques_cache = SnapshotCache(STATISTIQUES_CACHE_TTL_SECONDS)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        # Un jeton à portée restreinte (ticket du flux d'événements) n'ouvre pas l'API
+        if user_id is None or payload.get("portee") is not None:
             raise HTTPException(status_code=401, detail="Token invalide")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Token invalide")
     
+    return await charger_utilisateur(user_id)
+
+async def charger_utilisateur(user_id: str) -> User:
+    """Utilisateur authentifié, servi par user_cache ; 401 s'il n'existe plus"""
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+    
+    generation = user_cache.generation
     user = await db.users.find_one({"id": user_id})
     if user is None:
         raise HTTPException(status_code=401, detail="Utilisateur non trouvé")
-    return User(**user)
+    user_obj = User(**user)
+    user_cache.set(user_obj, generation)
+    return user_obj
 
 # Root route
 @api_router.get("/")
@@ -430,6 +1200,123 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
         "formations": current_user.formations
     }
 
+@api_router.get("/monitoring/cache-utilisateurs")
+async def get_user_cache_stats(current_user: User = Depends(get_current_user)):
+    """Compteurs du cache des utilisateurs authentifiés (monitoring)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    return user_cache.stats()
+
+@api_router.get("/metrics", include_in_schema=False)
+async def get_metrics(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """
+    Métriques au format texte Prometheus : requêtes, latences et accès MongoDB par endpoint,
+    caches et file d'emails. Protégé par METRIQUES_TOKEN (Bearer) s'il est défini, sinon
+    réservé aux administrateurs connectés.
+    """
+    if METRIQUES_TOKEN:
+        if not secrets.compare_digest(credentials.credentials.encode(), METRIQUES_TOKEN.encode()):
+            raise HTTPException(status_code=401, detail="Jeton de métriques invalide")
+    elif (await get_current_user(credentials)).role != "admin":
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    lignes = metriques.exposer()
+    caches = {"utilisateurs": user_cache.stats(), "statistiques": statistiques_cache.stats(), "notifications": non_lues_cache.stats()}
+    lignes.append("# HELP profiremanager_cache_hits_total Lectures servies par un cache")
+    lignes.append("# TYPE profiremanager_cache_hits_total counter")
+    for nom, stats in caches.items():
+        lignes.append(f"profiremanager_cache_hits_total{_labels(cache=nom)} {stats['hits']}")
+    lignes.append("# HELP profiremanager_cache_invalidations_total Invalidations d'un cache")
+    lignes.append("# TYPE profiremanager_cache_invalidations_total counter")
+    for nom, stats in caches.items():
+        lignes.append(f"profiremanager_cache_invalidations_total{_labels(cache=nom)} {stats['invalidations']}")
+    lignes.append("# HELP profiremanager_cache_misses_total Lectures non servies par un cache (calcul ou lecture en base)")
+    lignes.append("# TYPE profiremanager_cache_misses_total counter")
+    lignes.append(f"profiremanager_cache_misses_total{_labels(cache='utilisateurs')} {caches['utilisateurs']['misses']}")
+    lignes.append(f"profiremanager_cache_misses_total{_labels(cache='statistiques')} {caches['statistiques']['calculs']}")
+    lignes.append(f"profiremanager_cache_misses_total{_labels(cache='notifications')} {caches['notifications']['misses']}")
+    lignes.append("# HELP profiremanager_emails_total Emails traités par le worker de ce processus")
+    lignes.append("# TYPE profiremanager_emails_total counter")
+    for resultat, n in (("envoye", file_emails.envoyes), ("echec", file_emails.echecs), ("abandonne", file_emails.abandonnes)):
+        lignes.append(f"profiremanager_emails_total{_labels(resultat=resultat)} {n}")
+    flux = diffusion.stats()
+    lignes.append("# HELP profiremanager_flux_evenements_ouverts Flux Server-Sent Events ouverts sur ce processus")
+    lignes.append("# TYPE profiremanager_flux_evenements_ouverts gauge")
+    lignes.append(f"profiremanager_flux_evenements_ouverts {flux['flux_ouverts']}")
+    lignes.append("# HELP profiremanager_evenements_publies_total Événements déposés dans les files des abonnés")
+    lignes.append("# TYPE profiremanager_evenements_publies_total counter")
+    lignes.append(f"profiremanager_evenements_publies_total {flux['evenements_publies']}")
+    lignes.append("# HELP profiremanager_evenements_resynchronisations_total Files d'abonnés lents vidées (client invité à recharger)")
+    lignes.append("# TYPE profiremanager_evenements_resynchronisations_total counter")
+    lignes.append(f"profiremanager_evenements_resynchronisations_total {flux['resynchronisations']}")
+    return PlainTextResponse("\n".join(lignes) + "\n", media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@api_router.get("/monitoring/emails")
+async def get_email_outbox_stats(current_user: User = Depends(get_current_user)):
+    """État de la file d'envoi des emails (monitoring)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    stats = await file_emails.stats()
+    stats["abandonnes_recents"] = await db.emails_sortants.find(
+        {"statut": "abandonne"},
+        {"_id": 0, "id": 1, "type": 1, "destinataire": 1, "tentatives": 1, "derniere_erreur": 1, "created_at": 1}
+    ).sort("created_at", DESCENDING).to_list(50)
+    return stats
+
+@api_router.post("/monitoring/emails/{email_id}/relancer")
+async def relancer_email(email_id: str, current_user: User = Depends(get_current_user)):
+    """Remet un email abandonné (dead-letter) dans la file d'envoi"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    result = await db.emails_sortants.update_one(
+        {"id": email_id, "statut": "abandonne", "contenu_html": {"$exists": True}},
+        {"$set": {"statut": "en_attente", "tentatives": 0, "prochaine_tentative": datetime.now(timezone.utc), "abandonne_le": None}}
+    )
+    if result.modified_count == 0:
+        if await db.emails_sortants.find_one({"id": email_id, "statut": "abandonne"}, {"_id": 1}):
+            raise HTTPException(status_code=410, detail="Contenu de l'email effacé après le délai de conservation, relance impossible")
+        raise HTTPException(status_code=404, detail="Email abandonné non trouvé")
+    file_emails.reveiller()
+    return {"message": "Email remis en file d'envoi"}
+
+@api_router.get("/taches-suppression")
+async def get_taches_suppression(statut: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Dernières suppressions en cascade avec leur progression"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    filtre = {"statut": statut} if statut else {}
+    taches = await db.taches_suppression.find(filtre).sort("created_at", DESCENDING).limit(100).to_list(100)
+    return [progression_suppression(t) for t in taches]
+
+@api_router.get("/taches-suppression/{tache_id}")
+async def get_tache_suppression(tache_id: str, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    tache = await db.taches_suppression.find_one({"id": tache_id})
+    if not tache:
+        raise HTTPException(status_code=404, detail="Tâche de suppression non trouvée")
+    return progression_suppression(tache)
+
+@api_router.post("/taches-suppression/{tache_id}/relancer")
+async def relancer_tache_suppression(tache_id: str, current_user: User = Depends(get_current_user)):
+    """Relance une suppression en échec ; les étapes déjà terminées ne sont pas rejouées"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    result = await db.taches_suppression.update_one(
+        {"id": tache_id, "statut": "echec"},
+        {"$set": {"statut": "en_attente", "tentatives": 0, "verrou_jusqu_a": datetime.now(timezone.utc)}}
+    )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=404, detail="Tâche de suppression en échec non trouvée")
+    taches_suppression.reveiller()
+    return {"message": "Suppression relancée"}
+
 # User management routes
 @api_router.post("/users", response_model=User)
 async def create_user(user_create: UserCreate, current_user: User = Depends(get_current_user)):
@@ -454,31 +1341,355 @@ async def create_user(user_create: UserCreate, current_user: User = Depends(get_
     user_obj = User(**user_dict)
     
     await db.users.insert_one(user_obj.dict())
+    await signaler_modification_referentiel()
     
-    # Envoyer l'email de bienvenue
+    # Mettre l'email de bienvenue en file (envoyé par le worker, hors requête)
     try:
         user_name = f"{user_create.prenom} {user_create.nom}"
-        email_sent = send_welcome_email(user_create.email, user_name, user_create.role, temp_password)
-        
-        if email_sent:
-            print(f"Email de bienvenue envoyé à {user_create.email}")
-        else:
-            print(f"Échec envoi email à {user_create.email}")
-            
+        email = construire_email_bienvenue(user_create.email, user_name, user_create.role, temp_password)
+        await file_emails.ajouter([{**email, "type": "bienvenue"}])
     except Exception as e:
-        print(f"Erreur lors de l'envoi de l'email: {str(e)}")
         # Ne pas échouer la création du compte si l'email échoue
+        logger.error(f"Mise en file de l'email de bienvenue à {user_create.email} impossible: {str(e)}")
     
     return user_obj
 
-@api_router.get("/users", response_model=List[User])
-async def get_users(current_user: User = Depends(get_current_user)):
+# Import en masse du personnel (CSV ou XLSX)
+IMPORT_TAILLE_LOT = 500
+IMPORT_MAX_LIGNES = int(os.environ.get("IMPORT_MAX_LIGNES", "10000"))
+IMPORT_VALEURS_VRAIES = {"1", "true", "vrai", "oui", "o", "x", "yes"}
+# Format stocké par le référentiel ; le formulaire du personnel envoie du ISO
+FORMAT_DATE_EMBAUCHE = "%d/%m/%Y"
+FORMATS_DATE_EMBAUCHE_ACCEPTES = (FORMAT_DATE_EMBAUCHE, "%Y-%m-%d")
+
+def lire_date_embauche(valeur: str) -> Optional[datetime]:
+    for format_date in FORMATS_DATE_EMBAUCHE_ACCEPTES:
+        try:
+            return datetime.strptime(valeur, format_date)
+        except ValueError:
+            continue
+    return None
+
+def generer_mot_de_passe_temporaire() -> str:
+    """Mot de passe aléatoire qui respecte validate_complex_password"""
+    caracteres = [secrets.choice(string.ascii_letters + string.digits) for _ in range(9)]
+    caracteres += [secrets.choice(string.ascii_uppercase), secrets.choice(string.digits), secrets.choice("!@#$%^&*+-?")]
+    secrets.SystemRandom().shuffle(caracteres)
+    return "".join(caracteres)
+
+def _normaliser_entete(valeur) -> str:
+    # "Prénom", "Numéro employé" -> prenom, numero_employe
+    texte = unicodedata.normalize("NFKD", str(valeur or "")).encode("ascii", "ignore").decode()
+    return re.sub(r"[\s\-]+", "_", texte.strip().lower())
+
+def _lignes_import(fichier, nom_fichier: str):
+    """
+    Itère (numéro de ligne, valeurs par colonne) sur un CSV (séparateur et encodage détectés)
+    ou sur la première feuille d'un XLSX, sans charger tout le fichier en mémoire.
+    """
+    if nom_fichier.lower().endswith((".xlsx", ".xlsm")):
+        classeur = load_workbook(fichier, read_only=True, data_only=True)
+        try:
+            lignes = classeur.active.iter_rows(values_only=True)
+            entetes = [_normaliser_entete(v) for v in next(lignes, ())]
+            for numero, valeurs in enumerate(lignes, start=2):
+                if any(v not in (None, "") for v in valeurs):
+                    yield numero, dict(zip(entetes, valeurs))
+        finally:
+            classeur.close()
+        return
+    
+    echantillon = fichier.read(65536)
+    fichier.seek(0)
+    encodage = "utf-8-sig"
+    try:
+        echantillon.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # Un caractère coupé en fin d'échantillon n'est pas une erreur d'encodage
+        if e.start < len(echantillon) - 3:
+            encodage = "cp1252"
+    texte = TextIOWrapper(fichier, encoding=encodage, newline="")
+    try:
+        try:
+            dialecte = csv.Sniffer().sniff(texte.read(8192), delimiters=",;\t")
+        except csv.Error:
+            dialecte = csv.excel
+        texte.seek(0)
+        lecteur = csv.reader(texte, dialecte)
+        entetes = [_normaliser_entete(v) for v in next(lecteur, [])]
+        for valeurs in lecteur:
+            if any(v.strip() for v in valeurs):
+                yield lecteur.line_num, dict(zip(entetes, valeurs))
+    finally:
+        texte.detach()
+
+def _verifier_fichier_import(fichier, nom_fichier: str) -> int:
+    """
+    Parcourt tout le fichier avant la première écriture : nombre de lignes (arrêt dès que
+    IMPORT_MAX_LIGNES est dépassé) ; lève si le fichier est illisible. Rembobine le fichier.
+    """
+    total = 0
+    lignes = _lignes_import(fichier, nom_fichier)
+    try:
+        for total, _ in enumerate(lignes, start=1):
+            if total > IMPORT_MAX_LIGNES:
+                break
+    finally:
+        lignes.close()
+    fichier.seek(0)
+    return total
+
+def _lot_import(lignes, taille: int) -> list:
+    return list(itertools.islice(lignes, taille))
+
+def _utilisateur_depuis_ligne(ligne: Dict[str, Any], formations_par_nom: Dict[str, str]) -> Tuple[UserCreate, bool]:
+    """
+    Convertit une ligne du fichier en UserCreate (lève ValueError/ValidationError si invalide).
+    Le booléen indique un mot de passe généré, que seul l'email de bienvenue transmet.
+    """
+    donnees: Dict[str, Any] = {}
+    for champ, valeur in ligne.items():
+        if champ not in UserCreate.model_fields or valeur is None:
+            continue
+        if isinstance(valeur, datetime):
+            valeur = valeur.strftime(FORMAT_DATE_EMBAUCHE)
+        elif isinstance(valeur, float) and valeur.is_integer():
+            valeur = int(valeur)
+        valeur = str(valeur).strip()
+        if valeur:
+            donnees[champ] = valeur
+    
+    if "fonction_superieur" in donnees:
+        donnees["fonction_superieur"] = donnees["fonction_superieur"].lower() in IMPORT_VALEURS_VRAIES
+    if "date_embauche" in donnees:
+        date_embauche = lire_date_embauche(donnees["date_embauche"])
+        if date_embauche is None:
+            raise ValueError("date_embauche: date invalide (JJ/MM/AAAA attendu)")
+        donnees["date_embauche"] = date_embauche.strftime(FORMAT_DATE_EMBAUCHE)
+    if "formations" in donnees:
+        formations = []
+        for nom in re.split(r"[,;|]", donnees["formations"]):
+            nom = nom.strip()
+            if not nom:
+                continue
+            if nom.lower() not in formations_par_nom:
+                raise ValueError(f"formations: formation inconnue « {nom} »")
+            formations.append(formations_par_nom[nom.lower()])
+        donnees["formations"] = formations
+    mot_de_passe_genere = "mot_de_passe" not in donnees
+    if mot_de_passe_genere:
+        donnees["mot_de_passe"] = generer_mot_de_passe_temporaire()
+    elif not validate_complex_password(donnees["mot_de_passe"]):
+        raise ValueError("mot_de_passe: ne respecte pas les critères de complexité")
+    return UserCreate(**donnees), mot_de_passe_genere
+
+def _messages_validation(erreur: Exception) -> List[str]:
+    if isinstance(erreur, ValidationError):
+        return [f"{'.'.join(str(l) for l in e['loc'])}: {e['msg']}" for e in erreur.errors()]
+    return [str(erreur)]
+
+@api_router.post("/users/import")
+async def import_users(fichier: UploadFile = File(...), envoyer_emails: bool = True, current_user: User = Depends(get_current_user)):
+    """
+    Crée le personnel à partir d'un CSV ou d'un XLSX (une ligne d'en-tête aux noms des champs
+    de UserCreate). Le fichier est lu par lots : une requête $in pour les emails existants,
+    un insert_many et une mise en file groupée des emails de bienvenue par lot. Les lignes
+    invalides sont ignorées et détaillées dans le rapport. Le fichier est entièrement parcouru
+    (taille, lisibilité) avant toute création : un fichier refusé ne crée personne.
+    Avec envoyer_emails=False, seuls les comptes sans colonne mot_de_passe reçoivent
+    l'email de bienvenue, seul moyen de leur communiquer le mot de passe généré.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    nom_fichier = fichier.filename or ""
+    if not nom_fichier.lower().endswith((".csv", ".txt", ".xlsx", ".xlsm")):
+        raise HTTPException(status_code=400, detail="Format non supporté (CSV ou XLSX attendu)")
+    
+    formations_par_nom: Dict[str, str] = {}
+    async for formation in db.formations.find({}, {"_id": 0, "id": 1, "nom": 1}):
+        formations_par_nom[formation["nom"].strip().lower()] = formation["id"]
+        formations_par_nom[formation["id"].lower()] = formation["id"]
+    
+    try:
+        nombre_lignes = await asyncio.to_thread(_verifier_fichier_import, fichier.file, nom_fichier)
+    except Exception as e:
+        await fichier.close()
+        logger.warning(f"Import du personnel: fichier {nom_fichier} illisible ({e})")
+        raise HTTPException(status_code=400, detail="Fichier illisible ou corrompu")
+    if nombre_lignes > IMPORT_MAX_LIGNES:
+        await fichier.close()
+        raise HTTPException(status_code=400, detail=f"Le fichier dépasse {IMPORT_MAX_LIGNES} lignes")
+    
+    lignes = _lignes_import(fichier.file, nom_fichier)
+    emails_du_fichier: Dict[str, int] = {}
+    erreurs: List[Dict[str, Any]] = []
+    total = crees = emails_en_file = 0
+    tronque = False
+    
+    try:
+        while True:
+            try:
+                lot = await asyncio.to_thread(_lot_import, lignes, IMPORT_TAILLE_LOT)
+            except Exception as e:
+                # Lots précédents déjà créés : le rapport indique où l'import s'est arrêté
+                logger.warning(f"Import du personnel: lecture de {nom_fichier} interrompue ({e})")
+                tronque = True
+                break
+            if not lot:
+                break
+            total += len(lot)
+            
+            valides = []
+            for numero, ligne in lot:
+                try:
+                    user_create, mot_de_passe_genere = _utilisateur_depuis_ligne(ligne, formations_par_nom)
+                except (ValueError, ValidationError) as e:
+                    erreurs.append({"ligne": numero, "email": str(ligne.get("email") or ""), "erreurs": _messages_validation(e)})
+                    continue
+                if user_create.email in emails_du_fichier:
+                    erreurs.append({"ligne": numero, "email": user_create.email, "erreurs": [f"email: déjà présent ligne {emails_du_fichier[user_create.email]}"]})
+                    continue
+                emails_du_fichier[user_create.email] = numero
+                valides.append((numero, user_create, mot_de_passe_genere))
+            
+            existants = set()
+            if valides:
+                async for user in db.users.find({"email": {"$in": [u.email for _, u, _ in valides]}}, {"_id": 0, "email": 1}):
+                    existants.add(user["email"])
+            
+            a_creer = []
+            for numero, user_create, mot_de_passe_genere in valides:
+                if user_create.email in existants:
+                    erreurs.append({"ligne": numero, "email": user_create.email, "erreurs": ["email: Cet email est déjà utilisé"]})
+                    continue
+                user_dict = user_create.dict()
+                temp_password = user_dict.pop("mot_de_passe")
+                user_dict["mot_de_passe_hash"] = get_password_hash(temp_password)
+                a_creer.append((numero, User(**user_dict), temp_password, mot_de_passe_genere))
+            if not a_creer:
+                continue
+            
+            # Une création concurrente peut encore heurter l'index unique sur l'email
+            rejetes = set()
+            try:
+                await db.users.insert_many([u.dict() for _, u, _, _ in a_creer], ordered=False)
+            except BulkWriteError as e:
+                for erreur in e.details.get("writeErrors", []):
+                    rejetes.add(erreur["index"])
+                    numero, user_obj, _, _ = a_creer[erreur["index"]]
+                    message = "email: Cet email est déjà utilisé" if erreur.get("code") == 11000 else erreur.get("errmsg", "insertion refusée")
+                    erreurs.append({"ligne": numero, "email": user_obj.email, "erreurs": [message]})
+            inseres = [c for i, c in enumerate(a_creer) if i not in rejetes]
+            crees += len(inseres)
+            
+            emails = []
+            for _, user_obj, temp_password, mot_de_passe_genere in inseres:
+                if envoyer_emails or mot_de_passe_genere:
+                    email = construire_email_bienvenue(user_obj.email, f"{user_obj.prenom} {user_obj.nom}", user_obj.role, temp_password)
+                    emails.append({**email, "type": "bienvenue"})
+            if emails:
+                await file_emails.ajouter(emails)
+                emails_en_file += len(emails)
+    finally:
+        lignes.close()
+        await fichier.close()
+        if crees:
+            await signaler_modification_referentiel()
+    
+    erreurs.sort(key=lambda e: e["ligne"])
+    return {
+        "total_lignes": total,
+        "crees": crees,
+        "en_erreur": len(erreurs),
+        "emails_en_file": emails_en_file,
+        "tronque": tronque,
+        "erreurs": erreurs
+    }
+
+# Liste du personnel : tri stable (nom, prénom, id) pour la pagination par curseur
+USERS_TRI = [("nom", ASCENDING), ("prenom", ASCENDING), ("id", ASCENDING)]
+USERS_PROJECTION = {"_id": 0, **{champ: 1 for champ in UserResume.model_fields}}
+USERS_PROJECTION_IDENTITE = {"_id": 0, **{champ: 1 for champ in UserIdentite.model_fields}}
+USERS_LIMITE_MAX = 500
+
+def encoder_curseur_users(user: Dict[str, Any]) -> str:
+    cle = [user.get("nom", ""), user.get("prenom", ""), user["id"]]
+    return base64.urlsafe_b64encode(json.dumps(cle).encode()).decode().rstrip("=")
+
+def decoder_curseur_users(curseur: str) -> Dict[str, Any]:
+    """Filtre keyset des utilisateurs situés après le curseur dans l'ordre (nom, prénom, id)"""
+    try:
+        nom, prenom, user_id = json.loads(base64.urlsafe_b64decode(curseur + "=" * (-len(curseur) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+    return {"$or": [
+        {"nom": {"$gt": nom}},
+        {"nom": nom, "prenom": {"$gt": prenom}},
+        {"nom": nom, "prenom": prenom, "id": {"$gt": user_id}}
+    ]}
+
+def filtre_users(statut: Optional[str], role: Optional[str], grade: Optional[str], type_emploi: Optional[str]) -> Dict[str, Any]:
+    filtre: Dict[str, Any] = {}
+    for champ, valeur in (("statut", statut), ("role", role), ("grade", grade), ("type_emploi", type_emploi)):
+        if valeur:
+            valeurs = [v.strip() for v in valeur.split(",") if v.strip()]
+            filtre[champ] = valeurs[0] if len(valeurs) == 1 else {"$in": valeurs}
+    return filtre
+
+@api_router.get("/users", response_model=List[UserResume])
+async def get_users(
+    response: Response,
+    statut: Optional[str] = None,
+    role: Optional[str] = None,
+    grade: Optional[str] = None,
+    type_emploi: Optional[str] = None,
+    limite: Optional[int] = None,
+    curseur: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Personnel trié par nom. Les filtres acceptent plusieurs valeurs séparées par des virgules.
+    Sans `limite` toute la liste est renvoyée ; avec `limite`, l'en-tête X-Next-Cursor porte
+    le curseur de la page suivante (absent sur la dernière page).
+    """
+    if current_user.role not in ["admin", "superviseur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    if limite is not None and not 1 <= limite <= USERS_LIMITE_MAX:
+        raise HTTPException(status_code=400, detail=f"La limite doit être comprise entre 1 et {USERS_LIMITE_MAX}")
+    
+    filtre = filtre_users(statut, role, grade, type_emploi)
+    if curseur:
+        filtre = {"$and": [filtre, decoder_curseur_users(curseur)]} if filtre else decoder_curseur_users(curseur)
+    
+    cursor = db.users.find(filtre, USERS_PROJECTION).sort(USERS_TRI)
+    if limite is None:
+        return await cursor.to_list(None)
+    
+    # Une ligne de plus pour savoir s'il reste une page
+    users = await cursor.limit(limite + 1).to_list(limite + 1)
+    if len(users) > limite:
+        users = users[:limite]
+        response.headers["X-Next-Cursor"] = encoder_curseur_users(users[-1])
+    return users
+
+@api_router.get("/users/identites", response_model=List[UserIdentite])
+async def get_users_identites(
+    statut: Optional[str] = None,
+    role: Optional[str] = None,
+    grade: Optional[str] = None,
+    type_emploi: Optional[str] = None,
+    cree_depuis: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Personnel trié par nom, réduit à l'identité (nom, grade, emploi, statut) ; mêmes filtres que /users"""
     if current_user.role not in ["admin", "superviseur"]:
         raise HTTPException(status_code=403, detail="Accès refusé")
     
-    users = await db.users.find().to_list(1000)
-    cleaned_users = [clean_mongo_doc(user) for user in users]
-    return [User(**user) for user in cleaned_users]
+    filtre = filtre_users(statut, role, grade, type_emploi)
+    if cree_depuis:
+        filtre["created_at"] = {"$gte": cree_depuis if cree_depuis.tzinfo else cree_depuis.replace(tzinfo=timezone.utc)}
+    return await db.users.find(filtre, USERS_PROJECTION_IDENTITE).sort(USERS_TRI).to_list(None)
 
 @api_router.get("/users/{user_id}", response_model=User)
 async def get_user(user_id: str, current_user: User = Depends(get_current_user)):
@@ -514,6 +1725,8 @@ async def update_mon_profil(
             {"id": current_user.id}, 
             {"$set": profile_data.dict()}
         )
+        user_cache.invalidate(current_user.id)
+        await signaler_modification_referentiel()
         
         if result.modified_count == 0:
             raise HTTPException(status_code=400, detail="Impossible de mettre à jour le profil")
@@ -549,6 +1762,8 @@ async def update_user(user_id: str, user_update: UserCreate, current_user: User
     user_dict["created_at"] = existing_user.get("created_at")
     
     result = await db.users.replace_one({"id": user_id}, user_dict)
+    user_cache.invalidate(user_id)
+    await signaler_modification_referentiel()
     if result.modified_count == 0:
         raise HTTPException(status_code=400, detail="Impossible de mettre à jour l'utilisateur")
     
@@ -556,7 +1771,7 @@ async def update_user(user_id: str, user_update: UserCreate, current_user: User
     updated_user = clean_mongo_doc(updated_user)
     return User(**updated_user)
 
-@api_router.delete("/users/{user_id}")
+@api_router.delete("/users/{user_id}", status_code=202)
 async def delete_user(user_id: str, current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Accès refusé")
@@ -568,15 +1783,15 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_use
     
     # Delete user
     result = await db.users.delete_one({"id": user_id})
+    user_cache.invalidate(user_id)
+    await signaler_modification_referentiel()
     if result.deleted_count == 0:
         raise HTTPException(status_code=400, detail="Impossible de supprimer l'utilisateur")
     
-    # Also delete related data
-    await db.disponibilites.delete_many({"user_id": user_id})
-    await db.assignations.delete_many({"user_id": user_id})
-    await db.demandes_remplacement.delete_many({"demandeur_id": user_id})
+    # Les données liées sont supprimées en arrière-plan
+    tache = await taches_suppression.creer("utilisateur", user_id, etapes_suppression_utilisateur(user_id), current_user.id)
     
-    return {"message": "Utilisateur supprimé avec succès"}
+    return {"message": "Utilisateur supprimé avec succès", "tache_id": tache["id"]}
 
 @api_router.put("/users/{user_id}/access", response_model=User)
 async def update_user_access(user_id: str, role: str, statut: str, current_user: User = Depends(get_current_user)):
@@ -602,6 +1817,8 @@ async def update_user_access(user_id: str, role: str, statut: str, current_user:
         {"id": user_id}, 
         {"$set": {"role": role, "statut": statut}}
     )
+    user_cache.invalidate(user_id)
+    await signaler_modification_referentiel()
     
     if result.modified_count == 0:
         raise HTTPException(status_code=400, detail="Impossible de mettre à jour l'accès")
@@ -610,7 +1827,7 @@ async def update_user_access(user_id: str, role: str, statut: str, current_user:
     updated_user = clean_mongo_doc(updated_user)
     return User(**updated_user)
 
-@api_router.delete("/users/{user_id}/revoke")
+@api_router.delete("/users/{user_id}/revoke", status_code=202)
 async def revoke_user_completely(user_id: str, current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Accès refusé")
@@ -624,14 +1841,15 @@ async def revoke_user_completely(user_id: str, current_user: User = Depends(get_
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Impossible de supprimer votre propre compte")
     
-    # Delete user and all related data
+    # Delete user, then all related data in the background
     await db.users.delete_one({"id": user_id})
-    await db.disponibilites.delete_many({"user_id": user_id})
-    await db.assignations.delete_many({"user_id": user_id})
-    await db.demandes_remplacement.delete_many({"demandeur_id": user_id})
-    await db.demandes_remplacement.delete_many({"remplacant_id": user_id})
+    user_cache.invalidate(user_id)
+    await signaler_modification_referentiel()
+    tache = await taches_suppression.creer(
+        "utilisateur", user_id, etapes_suppression_utilisateur(user_id, remplacements_acceptes=True), current_user.id
+    )
     
-    return {"message": "Utilisateur et toutes ses données ont été supprimés définitivement"}
+    return {"message": "Utilisateur supprimé définitivement, suppression de ses données en cours", "tache_id": tache["id"]}
 
 # Types de garde routes
 @api_router.post("/types-garde", response_model=TypeGarde)
@@ -641,6 +1859,7 @@ async def create_type_garde(type_garde: TypeGardeCreate, current_user: User = De
     
     type_garde_obj = TypeGarde(**type_garde.dict())
     await db.types_garde.insert_one(type_garde_obj.dict())
+    await signaler_modification_referentiel()
     return type_garde_obj
 
 @api_router.get("/types-garde", response_model=List[TypeGarde])
@@ -674,12 +1893,16 @@ async def update_type_garde(type_garde_id: str, type_garde_update: TypeGardeCrea
     result = await db.types_garde.replace_one({"id": type_garde_id}, type_dict)
     if result.modified_count == 0:
         raise HTTPException(status_code=400, detail="Impossible de mettre à jour le type de garde")
+    await signaler_modification_referentiel()
+    
+    if type_dict.get("duree_heures", 8) != existing_type.get("duree_heures", 8):
+        await recalculer_heures_type_garde(type_garde_id, type_dict.get("duree_heures", 8))
     
     updated_type = await db.types_garde.find_one({"id": type_garde_id})
     updated_type = clean_mongo_doc(updated_type)
     return TypeGarde(**updated_type)
 
-@api_router.delete("/types-garde/{type_garde_id}")
+@api_router.delete("/types-garde/{type_garde_id}", status_code=202)
 async def delete_type_garde(type_garde_id: str, current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Accès refusé")
@@ -693,11 +1916,12 @@ async def delete_type_garde(type_garde_id: str, current_user: User = Depends(get
     result = await db.types_garde.delete_one({"id": type_garde_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=400, detail="Impossible de supprimer le type de garde")
+    await signaler_modification_referentiel()
     
-    # Also delete related assignations
-    await db.assignations.delete_many({"type_garde_id": type_garde_id})
+    # Les assignations liées sont supprimées en arrière-plan
+    tache = await taches_suppression.creer("type_garde", type_garde_id, etapes_suppression_type_garde(type_garde_id), current_user.id)
     
-    return {"message": "Type de garde supprimé avec succès"}
+    return {"message": "Type de garde supprimé avec succès", "tache_id": tache["id"]}
 @api_router.get("/planning/{semaine_debut}")
 async def get_planning(semaine_debut: str, current_user: User = Depends(get_current_user)):
     planning = await db.planning.find_one({"semaine_debut": semaine_debut})
@@ -727,6 +1951,7 @@ async def retirer_assignation(assignation_id: str, current_user: User = Depends(
         result = await db.assignations.delete_one({"id": assignation_id})
         if result.deleted_count == 0:
             raise HTTPException(status_code=400, detail="Impossible de retirer l'assignation")
+        await assignations_modifiees([assignation], signe=-1)
         
         return {
             "message": "Assignation retirée avec succès",
@@ -739,17 +1964,39 @@ async def retirer_assignation(assignation_id: str, current_user: User = Depends(
         raise HTTPException(status_code=500, detail=f"Erreur suppression assignation: {str(e)}")
 
 @api_router.post("/planning/assignation")
-async def create_assignation(assignation: AssignationCreate, current_user: User = Depends(get_current_user)):
+async def create_assignation(
+    assignation: AssignationCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user)
+):
     if current_user.role not in ["admin", "superviseur"]:
         raise HTTPException(status_code=403, detail="Accès refusé")
     
-    # Store assignation in database
+    return await executer_idempotent(
+        idempotency_key, current_user, "planning/assignation", assignation,
+        lambda: _creer_assignation(assignation)
+    )
+
+async def _creer_assignation(assignation: AssignationCreate):
+    type_garde = await db.types_garde.find_one({"id": assignation.type_garde_id})
+    
+    # Gardes de l'employé qui chevauchent celle-ci (nuit de la veille comprise) ou son repos minimum
+    if type_garde:
+        intervalles = await charger_index_intervalles(assignation.date, assignation.date, [assignation.user_id])
+        conflit = intervalles.conflit(assignation.user_id, *intervalle_garde(assignation.date, type_garde))
+        if conflit:
+            existante = conflit[2]
+            if existante["type_garde_id"] == assignation.type_garde_id and existante["date"] == assignation.date:
+                raise HTTPException(status_code=409, detail="Cet employé est déjà assigné à ce type de garde ce jour-là")
+            raise HTTPException(status_code=409, detail=message_chevauchement(conflit))
+    
+    # Store assignation in database (index unique : employé, date, type de garde)
     assignation_obj = Assignation(**assignation.dict())
-    await db.assignations.insert_one(assignation_obj.dict())
+    if not await inserer_assignations([assignation_obj.dict()]):
+        raise HTTPException(status_code=409, detail="Cet employé est déjà assigné à ce type de garde ce jour-là")
     
     # Créer notification pour l'employé assigné
     user_assigne = await db.users.find_one({"id": assignation.user_id})
-    type_garde = await db.types_garde.find_one({"id": assignation.type_garde_id})
     
     if user_assigne and type_garde:
         await creer_notification(
@@ -873,6 +2120,7 @@ async def delete_formation(formation_id: str, current_user: User = Depends(get_c
         {"formations": formation_id},
         {"$pull": {"formations": formation_id}}
     )
+    user_cache.clear()
     
     return {"message": "Formation supprimée avec succès"}
 
@@ -1110,51 +2358,92 @@ async def recherche_remplacants_automatique(demande_id: str, current_user: User
         
         # Récupérer les paramètres de remplacement
         # (selon les règles définies dans Paramètres > Remplacements)
+        parametres_doc = await db.parametres_remplacements.find_one()
+        parametres = ParametresRemplacements(**clean_mongo_doc(parametres_doc)) if parametres_doc else ParametresRemplacements()
         
-        # Trouver les remplaçants potentiels selon l'algorithme intelligent
-        users = await db.users.find({"statut": "Actif"}).to_list(1000)
+        # Charger en une fois tout ce dont le scoring a besoin
         type_garde = await db.types_garde.find_one({"id": demande["type_garde_id"]})
+        demandeur = await db.users.find_one({"id": demande["demandeur_id"]}) or {}
+        users = await db.users.find({"statut": "Actif", "id": {"$ne": demande["demandeur_id"]}}).to_list(None)
+        disponibilites = await db.disponibilites.find(
+            {"date": demande["date"], "statut": "disponible"},
+            {"_id": 0, "user_id": 1, "type_garde_id": 1}
+        ).to_list(None)
+        
+        # Mois de la demande (heures) et jours voisins (gardes qui chevauchent la garde à remplacer)
+        date_demande = datetime.strptime(demande["date"], "%Y-%m-%d")
+        debut_mois = date_demande.replace(day=1).strftime("%Y-%m-%d")
+        fin_mois = ((date_demande.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)).strftime("%Y-%m-%d")
+        marge = timedelta(days=marge_intervalles_jours())
+        assignations_periode = await db.assignations.find(
+            {"date": {
+                "$gte": min(debut_mois, (date_demande - marge).strftime("%Y-%m-%d")),
+                "$lte": max(fin_mois, (date_demande + marge).strftime("%Y-%m-%d"))
+            }},
+            {"_id": 0, "user_id": 1, "type_garde_id": 1, "date": 1}
+        ).to_list(None)
+        types_garde = await db.types_garde.find({}, {"_id": 0, "id": 1, "duree_heures": 1, "heure_debut": 1, "heure_fin": 1}).to_list(None)
+        types_garde_par_id = {t["id"]: t for t in types_garde}
+        
+        heures: Dict[str, int] = {}
+        intervalles = IndexIntervalles()
+        for assignation in assignations_periode:
+            intervalles.ajouter_assignation(assignation, types_garde_par_id)
+            if debut_mois <= assignation["date"] <= fin_mois:
+                duree = types_garde_par_id.get(assignation["type_garde_id"], {}).get("duree_heures", 8)
+                heures[assignation["user_id"]] = heures.get(assignation["user_id"], 0) + duree
+        if type_garde:
+            garde_demandee = intervalle_garde(demande["date"], type_garde)
+            occupes = {user_id for user_id in intervalles.debuts if intervalles.conflit(user_id, *garde_demandee)}
+        else:
+            occupes = {a["user_id"] for a in assignations_periode if a["date"] == demande["date"]}
         
-        remplacants_potentiels = []
-        
-        for user in users:
-            if user["id"] == demande["demandeur_id"]:
-                continue  # Skip demandeur
-                
-            # Étape 1: Vérifier disponibilités (si temps partiel)
-            if user["type_emploi"] == "temps_partiel":
-                # Get user disponibilités pour cette date exacte
-                user_dispos = await db.disponibilites.find({
-                    "user_id": user["id"],
-                    "date": demande["date"],
-                    "statut": "disponible"
-                }).to_list(10)
-                
-                # Vérifier si disponible pour ce type de garde spécifiquement
-                type_garde_compatible = any(
-                    d.get("type_garde_id") == type_garde["id"] or d.get("type_garde_id") is None 
-                    for d in user_dispos
-                )
-                
-                if not type_garde_compatible:
-                    continue  # Skip si pas disponible pour ce type de garde
-            
-            # Étape 2: Vérifier grade équivalent (si paramètre activé)
-            # Étape 3: Vérifier compétences équivalentes (si paramètre activé)
-            
-            remplacants_potentiels.append({
-                "user_id": user["id"],
-                "nom": f"{user['prenom']} {user['nom']}",
-                "grade": user["grade"],
-                "score_compatibilite": 85  # Algorithme de scoring à développer
-            })
+        dispos_par_user: Dict[tuple, set] = {}
+        for dispo in disponibilites:
+            dispos_par_user.setdefault((dispo["user_id"], demande["date"]), set()).add(dispo.get("type_garde_id"))
+        
+        # Étape 1: disponibilités (temps partiel) et pas de garde qui chevauche celle à remplacer
+        # Étape 2: grade équivalent / officier (si paramètre activé)
+        # Étape 3: compétences équivalentes (si paramètre activé)
+        table = TableCandidats(users, [type_garde] if type_garde else [], [demande["date"]], dispos_par_user, heures, toujours_disponibles=True)
+        masque = table.disponibles(demande["type_garde_id"], demande["date"])
+        masque &= np.array([user_id not in occupes for user_id in table.ids], dtype=bool)
+        
+        officier_requis = False
+        if parametres.priorite_grade and type_garde and type_garde.get("officier_obligatoire", False) and demandeur and est_officier(demandeur):
+            collegues = await db.assignations.find(
+                {"date": demande["date"], "type_garde_id": demande["type_garde_id"], "user_id": {"$ne": demande["demandeur_id"]}},
+                {"_id": 0, "user_id": 1}
+            ).to_list(None)
+            officiers_restants = await db.users.count_documents({
+                "id": {"$in": [c["user_id"] for c in collegues]},
+                "$or": [{"grade": {"$in": GRADES_OFFICIERS}}, {"fonction_superieur": True}]
+            }) if collegues else 0
+            officier_requis = officiers_restants == 0
+        
+        scores = table.scores_compatibilite(
+            masque,
+            grade_cible=demandeur.get("grade") if parametres.priorite_grade else None,
+            formations_cibles=demandeur.get("formations", []) if parametres.priorite_competences else None,
+            officier_requis=officier_requis
+        )
+        if officier_requis:
+            masque &= table.peut_etre_officier
         
-        # Trier par score de compatibilité
-        remplacants_potentiels.sort(key=lambda x: x["score_compatibilite"], reverse=True)
+        # Trier par score de compatibilité (à égalité : moins d'heures puis ancienneté)
+        indices = np.flatnonzero(masque)
+        indices = indices[np.lexsort((table.rang_anciennete[indices], table.heures[indices], -scores[indices]))]
         
-        # Limiter selon max_personnes_contact des paramètres
-        max_contacts = 5  # À récupérer des paramètres
-        remplacants_finaux = remplacants_potentiels[:max_contacts]
+        # Limiter selon max_contacts des paramètres
+        remplacants_finaux = [
+            {
+                "user_id": table.ids[i],
+                "nom": f"{table.users[i]['prenom']} {table.users[i]['nom']}",
+                "grade": table.users[i]["grade"],
+                "score_compatibilite": float(scores[i])
+            }
+            for i in indices[:parametres.max_contacts].tolist()
+        ]
         
         # Créer les notifications pour les remplaçants potentiels
         for remplacant in remplacants_finaux:
@@ -1169,169 +2458,426 @@ async def recherche_remplacants_automatique(demande_id: str, current_user: User
         return {
             "message": "Recherche automatique effectuée",
             "remplacants_contactes": len(remplacants_finaux),
+            "remplacants": remplacants_finaux,
             "algorithme": "Disponibilités → Grade → Compétences → Score compatibilité"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur recherche automatique: {str(e)}")
 
 # Rapports et exports routes
+# Génération des rapports hors de la boucle d'événements : pool de processus borné
+RAPPORTS_MAX_WORKERS = int(os.environ.get("RAPPORTS_MAX_WORKERS", "2"))
+RAPPORT_LIGNES_PAR_TABLEAU = 200
+_executeur_rapports: Optional[ProcessPoolExecutor] = None
+
+def executeur_rapports() -> ProcessPoolExecutor:
+    global _executeur_rapports
+    if _executeur_rapports is None:
+        _executeur_rapports = ProcessPoolExecutor(
+            max_workers=RAPPORTS_MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executeur_rapports
+
+async def executer_rendu(fonction, *args):
+    """Exécute un rendu ou un calcul (CPU) dans le pool de processus ; un pool cassé est recréé à l'appel suivant"""
+    global _executeur_rapports
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executeur_rapports(), fonction, *args)
+    except BrokenProcessPool:
+        _executeur_rapports = None
+        raise
+
+def reponse_fichier(chemin: str, filename: str, media_type: str) -> StreamingResponse:
+    """Diffuse un fichier temporaire par blocs puis le supprime"""
+    def lire_par_blocs():
+        with open(chemin, "rb") as fichier:
+            while True:
+                bloc = fichier.read(64 * 1024)
+                if not bloc:
+                    break
+                yield bloc
+    
+    return StreamingResponse(
+        lire_par_blocs(),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Content-Length": str(os.path.getsize(chemin))
+        },
+        background=BackgroundTask(os.unlink, chemin)
+    )
+
+def periode_rapport(date_debut: Optional[str], date_fin: Optional[str]) -> tuple:
+    """Période par défaut : le mois courant"""
+    aujourd_hui = datetime.now().date()
+    debut = date_debut or aujourd_hui.replace(day=1).strftime("%Y-%m-%d")
+    fin = date_fin or ((aujourd_hui.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)).strftime("%Y-%m-%d")
+    try:
+        if datetime.strptime(debut, "%Y-%m-%d") > datetime.strptime(fin, "%Y-%m-%d"):
+            raise HTTPException(status_code=400, detail="date_debut doit précéder date_fin")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates invalides (format attendu: YYYY-MM-DD)")
+    return debut, fin
+
+async def collecter_rapport_pdf(type_rapport: str, user_id: Optional[str], date_debut: str, date_fin: str) -> Dict[str, Any]:
+    """Données du rapport (types simples, sérialisables vers le processus de rendu)"""
+    types_garde = {
+        t["id"]: t for t in await db.types_garde.find(
+            {}, {"_id": 0, "id": 1, "nom": 1, "heure_debut": 1, "heure_fin": 1, "duree_heures": 1, "personnel_requis": 1}
+        ).to_list(None)
+    }
+    periode = {"$gte": date_debut, "$lte": date_fin}
+    projection = {"_id": 0, "user_id": 1, "type_garde_id": 1, "date": 1}
+    rapport: Dict[str, Any] = {"type": type_rapport, "date_debut": date_debut, "date_fin": date_fin}
+    
+    if type_rapport == "general":
+        users = await db.users.find(
+            {"statut": "Actif"},
+            {"_id": 0, "id": 1, "nom": 1, "prenom": 1, "grade": 1, "type_emploi": 1}
+        ).to_list(None)
+        noms = {u["id"]: f"{u['prenom']} {u['nom']}" for u in users}
+        assignations_totales, formations_count = await asyncio.gather(
+            db.assignations.count_documents({}),
+            db.formations.count_documents({})
+        )
+        rapport["statistiques"] = [
+            ['Personnel actif', str(len(users))],
+            ['Assignations totales', str(assignations_totales)],
+            ['Formations disponibles', str(formations_count)],
+            ['Employés temps plein', str(sum(1 for u in users if u.get('type_emploi') == 'temps_plein'))],
+            ['Employés temps partiel', str(sum(1 for u in users if u.get('type_emploi') == 'temps_partiel'))],
+        ]
+        
+        # Planning de la période (une ligne par garde) et récapitulatif par employé, en une passe
+        creneaux: Dict[tuple, List[str]] = {}
+        par_employe: Dict[str, List[int]] = {}
+        async for assignation in db.assignations.find({"date": periode}, projection).sort("date", ASCENDING):
+            type_garde = types_garde.get(assignation["type_garde_id"], {})
+            creneaux.setdefault((assignation["date"], assignation["type_garde_id"]), []).append(
+                noms.get(assignation["user_id"], "Utilisateur inconnu")
+            )
+            totaux = par_employe.setdefault(assignation["user_id"], [0, 0])
+            totaux[0] += 1
+            totaux[1] += type_garde.get("duree_heures", 8)
+        
+        rapport["planning"] = []
+        for (date_str, type_garde_id), personnel in sorted(
+            creneaux.items(), key=lambda c: (c[0][0], types_garde.get(c[0][1], {}).get("heure_debut", ""))
+        ):
+            type_garde = types_garde.get(type_garde_id, {})
+            rapport["planning"].append([
+                date_str,
+                type_garde.get("nom", "Garde supprimée"),
+                f"{type_garde.get('heure_debut', '')}-{type_garde.get('heure_fin', '')}",
+                ", ".join(sorted(personnel)),
+                f"{len(personnel)}/{type_garde.get('personnel_requis', 1)}"
+            ])
+        rapport["employes"] = [
+            [noms[u["id"]], u.get("grade", ""), str(par_employe.get(u["id"], [0, 0])[0]), str(par_employe.get(u["id"], [0, 0])[1])]
+            for u in sorted(users, key=lambda u: (u["nom"], u["prenom"]))
+        ]
+    
+    elif type_rapport == "employe" and user_id:
+        user_data = await db.users.find_one({"id": user_id}, {"_id": 0, "mot_de_passe_hash": 0})
+        if not user_data:
+            raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+        
+        rapport["employe"] = f"{user_data['prenom']} {user_data['nom']}"
+        rapport["gardes"] = []
+        heures = 0
+        async for assignation in db.assignations.find({"user_id": user_id, "date": periode}, projection).sort("date", ASCENDING):
+            type_garde = types_garde.get(assignation["type_garde_id"], {})
+            heures += type_garde.get("duree_heures", 8)
+            rapport["gardes"].append([
+                assignation["date"],
+                type_garde.get("nom", "Garde supprimée"),
+                f"{type_garde.get('heure_debut', '')}-{type_garde.get('heure_fin', '')}",
+                str(type_garde.get("duree_heures", 8))
+            ])
+        
+        rapport["informations"] = [
+            ['Nom complet', rapport["employe"]],
+            ['Grade', user_data['grade']],
+            ['Type emploi', user_data['type_emploi']],
+            ['Gardes assignées', str(await db.assignations.count_documents({"user_id": user_id}))],
+            ['Gardes sur la période', str(len(rapport["gardes"]))],
+            ['Heures sur la période', str(heures)],
+            ['Statut', user_data['statut']]
+        ]
+    
+    else:
+        raise HTTPException(status_code=400, detail="Type de rapport invalide (general, ou employe avec user_id)")
+    
+    return rapport
+
+def _tableaux_pdf(entete: List[str], lignes: List[List[str]], style: TableStyle, largeurs=None) -> List[Table]:
+    """Découpe un long tableau en tableaux bornés (en-tête répété) pour garder un rendu linéaire"""
+    if not lignes:
+        lignes = [["—"] * len(entete)]
+    tableaux = []
+    for debut in range(0, len(lignes), RAPPORT_LIGNES_PAR_TABLEAU):
+        table = Table([entete] + lignes[debut:debut + RAPPORT_LIGNES_PAR_TABLEAU], colWidths=largeurs, repeatRows=1)
+        table.setStyle(style)
+        tableaux.append(table)
+    return tableaux
+
+def rendre_rapport_pdf(rapport: Dict[str, Any], chemin: str):
+    """Rendu ReportLab (exécuté dans le pool de processus) écrit directement dans chemin"""
+    doc = SimpleDocTemplate(chemin, pagesize=A4)
+    styles = getSampleStyleSheet()
+    cellule = ParagraphStyle('Cellule', parent=styles['Normal'], fontSize=8, leading=10)
+    story = []
+    
+    # En-tête du rapport
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        spaceAfter=30,
+        alignment=TA_CENTER,
+        textColor=colors.HexColor('#dc2626')
+    )
+    
+    story.append(Paragraph("ProFireManager v2.0 - Rapport d'Activité", title_style))
+    story.append(Paragraph(f"Période du {rapport['date_debut']} au {rapport['date_fin']}", styles['Normal']))
+    story.append(Spacer(1, 12))
+    
+    style_general = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+    style_employe = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#dc2626')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+    style_liste = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#dc2626')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f3f4f6')]),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black)
+    ])
+    
+    if rapport["type"] == "general":
+        # Rapport général
+        story.append(Paragraph("📊 Statistiques Générales", styles['Heading2']))
+        story.extend(_tableaux_pdf(['Indicateur', 'Valeur'], rapport["statistiques"], style_general))
+        
+        story.append(PageBreak())
+        story.append(Paragraph("📅 Planning de la période", styles['Heading2']))
+        lignes = [[date_str, garde, horaire, Paragraph(personnel, cellule), couverture] for date_str, garde, horaire, personnel, couverture in rapport["planning"]]
+        story.extend(_tableaux_pdf(['Date', 'Garde', 'Horaire', 'Personnel', 'Effectif'], lignes, style_liste, [65, 100, 70, 235, 45]))
+        
+        story.append(PageBreak())
+        story.append(Paragraph("👥 Récapitulatif par employé", styles['Heading2']))
+        story.extend(_tableaux_pdf(['Employé', 'Grade', 'Gardes', 'Heures'], rapport["employes"], style_liste, [200, 120, 80, 80]))
+    
+    else:
+        # Rapport par employé
+        story.append(Paragraph(f"👤 Rapport Personnel - {rapport['employe']}", styles['Heading2']))
+        story.extend(_tableaux_pdf(['Information', 'Détail'], rapport["informations"], style_employe))
+        
+        story.append(Spacer(1, 18))
+        story.append(Paragraph("📅 Gardes de la période", styles['Heading2']))
+        story.extend(_tableaux_pdf(['Date', 'Garde', 'Horaire', 'Durée (h)'], rapport["gardes"], style_liste, [80, 180, 100, 70]))
+    
+    doc.build(story)
+
 @api_router.get("/rapports/export-pdf")
-async def export_pdf_report(type_rapport: str = "general", user_id: str = None, current_user: User = Depends(get_current_user)):
+async def export_pdf_report(
+    type_rapport: str = "general",
+    user_id: str = None,
+    date_debut: Optional[str] = None,
+    date_fin: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     if current_user.role not in ["admin", "superviseur"]:
         raise HTTPException(status_code=403, detail="Accès refusé")
     
+    date_debut, date_fin = periode_rapport(date_debut, date_fin)
+    rapport = await collecter_rapport_pdf(type_rapport, user_id, date_debut, date_fin)
+    
+    descripteur, chemin = tempfile.mkstemp(prefix="rapport_", suffix=".pdf")
+    os.close(descripteur)
     try:
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
-        styles = getSampleStyleSheet()
-        story = []
-        
-        # En-tête du rapport
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=30,
-            alignment=TA_CENTER,
-            textColor=colors.HexColor('#dc2626')
-        )
-        
-        story.append(Paragraph("ProFireManager v2.0 - Rapport d'Activité", title_style))
-        story.append(Spacer(1, 12))
-        
-        if type_rapport == "general":
-            # Rapport général
-            story.append(Paragraph("📊 Statistiques Générales", styles['Heading2']))
-            
-            # Récupérer les données
-            users = await db.users.find({"statut": "Actif"}).to_list(1000)
-            assignations = await db.assignations.find().to_list(1000)
-            formations = await db.formations.find().to_list(1000)
-            
-            data = [
-                ['Indicateur', 'Valeur'],
-                ['Personnel actif', str(len(users))],
-                ['Assignations totales', str(len(assignations))],
-                ['Formations disponibles', str(len(formations))],
-                ['Employés temps plein', str(len([u for u in users if u.get('type_emploi') == 'temps_plein']))],
-                ['Employés temps partiel', str(len([u for u in users if u.get('type_emploi') == 'temps_partiel']))],
-            ]
-            
-            table = Table(data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 14),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            story.append(table)
-            
-        elif type_rapport == "employe" and user_id:
-            # Rapport par employé
-            user_data = await db.users.find_one({"id": user_id})
-            if user_data:
-                story.append(Paragraph(f"👤 Rapport Personnel - {user_data['prenom']} {user_data['nom']}", styles['Heading2']))
-                
-                user_assignations = await db.assignations.find({"user_id": user_id}).to_list(1000)
-                
-                data = [
-                    ['Information', 'Détail'],
-                    ['Nom complet', f"{user_data['prenom']} {user_data['nom']}"],
-                    ['Grade', user_data['grade']],
-                    ['Type emploi', user_data['type_emploi']],
-                    ['Gardes assignées', str(len(user_assignations))],
-                    ['Statut', user_data['statut']]
-                ]
-                
-                table = Table(data)
-                table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#dc2626')),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                ]))
-                
-                story.append(table)
-        
-        doc.build(story)
-        pdf_data = buffer.getvalue()
-        buffer.close()
-        
-        # Retourner en base64 pour le frontend
-        pdf_base64 = base64.b64encode(pdf_data).decode('utf-8')
-        
-        return {
-            "message": "Rapport PDF généré avec succès",
-            "filename": f"rapport_{type_rapport}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-            "data": pdf_base64
-        }
-        
+        await executer_rendu(rendre_rapport_pdf, rapport, chemin)
     except Exception as e:
+        os.unlink(chemin)
         raise HTTPException(status_code=500, detail=f"Erreur génération PDF: {str(e)}")
+    
+    return reponse_fichier(
+        chemin,
+        f"rapport_{type_rapport}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+        "application/pdf"
+    )
+
+EXCEL_TAILLE_LOT = 2000
+EXCEL_MOIS = ["Janv.", "Févr.", "Mars", "Avr.", "Mai", "Juin", "Juil.", "Août", "Sept.", "Oct.", "Nov.", "Déc."]
+
+def _entete_excel(ws, titres: List[str]) -> List[WriteOnlyCell]:
+    # Style de l'en-tête
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="DC2626", end_color="DC2626", fill_type="solid")
+    cellules = []
+    for titre in titres:
+        cellule = WriteOnlyCell(ws, value=titre)
+        cellule.font = header_font
+        cellule.fill = header_fill
+        cellule.alignment = Alignment(horizontal="center")
+        cellules.append(cellule)
+    return cellules
+
+def _ajouter_lignes_excel(ws, lignes: List[list]):
+    for ligne in lignes:
+        ws.append(ligne)
 
 @api_router.get("/rapports/export-excel")
-async def export_excel_report(type_rapport: str = "general", current_user: User = Depends(get_current_user)):
+async def export_excel_report(type_rapport: str = "general", annee: Optional[int] = None, current_user: User = Depends(get_current_user)):
+    """
+    Classeur de paie d'une année : synthèse, détail de chaque garde, puis totaux par employé,
+    par type de garde et par mois. Écrit en mode write-only au fil d'un curseur asynchrone
+    (mémoire constante quel que soit le nombre de lignes) et diffusé en binaire.
+    """
     if current_user.role not in ["admin", "superviseur"]:
         raise HTTPException(status_code=403, detail="Accès refusé")
+    if type_rapport != "general":
+        raise HTTPException(status_code=400, detail="Type de rapport invalide")
+    
+    annee = annee or datetime.now().year
+    descripteur, chemin = tempfile.mkstemp(prefix="rapport_", suffix=".xlsx")
+    os.close(descripteur)
     
     try:
-        wb = Workbook()
-        ws = wb.active
-        
-        # Style de l'en-tête
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="DC2626", end_color="DC2626", fill_type="solid")
+        users = await db.users.find(
+            {}, {"_id": 0, "id": 1, "nom": 1, "prenom": 1, "numero_employe": 1, "grade": 1, "type_emploi": 1, "statut": 1}
+        ).to_list(None)
+        users_par_id = {u["id"]: u for u in users}
+        types_garde = {
+            t["id"]: t for t in await db.types_garde.find(
+                {}, {"_id": 0, "id": 1, "nom": 1, "heure_debut": 1, "heure_fin": 1, "duree_heures": 1}
+            ).to_list(None)
+        }
         
-        if type_rapport == "general":
-            ws.title = "Rapport Général"
+        wb = Workbook(write_only=True)
+        # Ordre des feuilles = ordre de création ; les totaux sont écrits après le détail
+        ws_synthese = wb.create_sheet("Synthèse")
+        ws_employes = wb.create_sheet("Par employé")
+        ws_types = wb.create_sheet("Par type de garde")
+        ws_mois = wb.create_sheet("Par mois")
+        ws_detail = wb.create_sheet("Détail des gardes")
+        ws_detail.append(_entete_excel(ws_detail, [
+            "Date", "Mois", "Employé", "N° employé", "Grade", "Type de garde", "Début", "Fin", "Durée (h)", "Type d'assignation"
+        ]))
+        
+        # Totaux [gardes, heures, heures par mois] : O(employés + types), indépendant du nombre de gardes
+        par_employe: Dict[str, list] = {}
+        par_type: Dict[str, list] = {}
+        par_mois = [[0, 0, set()] for _ in range(12)]
+        
+        lot = []
+        curseur = db.assignations.find(
+            {"date": {"$gte": f"{annee}-01-01", "$lte": f"{annee}-12-31"}},
+            {"_id": 0, "user_id": 1, "type_garde_id": 1, "date": 1, "assignation_type": 1}
+        ).sort("date", ASCENDING).batch_size(EXCEL_TAILLE_LOT)
+        async for assignation in curseur:
+            user = users_par_id.get(assignation["user_id"], {})
+            type_garde = types_garde.get(assignation["type_garde_id"], {})
+            duree = type_garde.get("duree_heures", 8)
+            mois = int(assignation["date"][5:7]) - 1
             
-            # En-tête
-            headers = ["Indicateur", "Valeur", "Détails"]
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=header)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = Alignment(horizontal="center")
+            lot.append([
+                assignation["date"],
+                EXCEL_MOIS[mois],
+                f"{user.get('prenom', '')} {user.get('nom', 'Utilisateur supprimé')}".strip(),
+                user.get("numero_employe", ""),
+                user.get("grade", ""),
+                type_garde.get("nom", "Garde supprimée"),
+                type_garde.get("heure_debut", ""),
+                type_garde.get("heure_fin", ""),
+                duree,
+                assignation.get("assignation_type", "")
+            ])
             
-            # Données
-            users = await db.users.find({"statut": "Actif"}).to_list(1000)
-            assignations = await db.assignations.find().to_list(1000)
+            totaux = par_employe.setdefault(assignation["user_id"], [0, 0, [0] * 12])
+            totaux[0] += 1
+            totaux[1] += duree
+            totaux[2][mois] += duree
+            totaux = par_type.setdefault(assignation["type_garde_id"], [0, 0, [0] * 12])
+            totaux[0] += 1
+            totaux[1] += duree
+            totaux[2][mois] += 1
+            par_mois[mois][0] += 1
+            par_mois[mois][1] += duree
+            par_mois[mois][2].add(assignation["user_id"])
             
-            data_rows = [
-                ["Personnel Total", len(users), f"{len([u for u in users if u.get('type_emploi') == 'temps_plein'])} temps plein, {len([u for u in users if u.get('type_emploi') == 'temps_partiel'])} temps partiel"],
-                ["Assignations", len(assignations), f"Période: {datetime.now().strftime('%B %Y')}"],
-                ["Taux Activité", "85%", "Personnel actif vs total"],
-            ]
-            
-            for row, (indicateur, valeur, details) in enumerate(data_rows, 2):
-                ws.cell(row=row, column=1, value=indicateur)
-                ws.cell(row=row, column=2, value=valeur)
-                ws.cell(row=row, column=3, value=details)
-        
-        # Sauvegarder en mémoire
-        buffer = BytesIO()
-        wb.save(buffer)
-        excel_data = buffer.getvalue()
-        buffer.close()
-        
-        # Retourner en base64
-        excel_base64 = base64.b64encode(excel_data).decode('utf-8')
-        
-        return {
-            "message": "Rapport Excel généré avec succès",
-            "filename": f"rapport_{type_rapport}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            "data": excel_base64
-        }
+            if len(lot) >= EXCEL_TAILLE_LOT:
+                await asyncio.to_thread(_ajouter_lignes_excel, ws_detail, lot)
+                lot = []
+        await asyncio.to_thread(_ajouter_lignes_excel, ws_detail, lot)
+        
+        # Synthèse
+        actifs = [u for u in users if u.get("statut") == "Actif"]
+        total_gardes = sum(m[0] for m in par_mois)
+        total_heures = sum(m[1] for m in par_mois)
+        ws_synthese.append(_entete_excel(ws_synthese, ["Indicateur", "Valeur", "Détails"]))
+        _ajouter_lignes_excel(ws_synthese, [
+            ["Personnel Total", len(actifs), f"{sum(1 for u in actifs if u.get('type_emploi') == 'temps_plein')} temps plein, {sum(1 for u in actifs if u.get('type_emploi') == 'temps_partiel')} temps partiel"],
+            ["Assignations", total_gardes, f"Année {annee}"],
+            ["Heures travaillées", total_heures, f"Année {annee}"],
+            ["Taux Activité", f"{round(len(par_employe) / len(actifs) * 100, 1) if actifs else 0.0}%", "Personnel ayant au moins une garde vs personnel actif"],
+        ])
+        
+        # Par employé (heures par mois)
+        ws_employes.append(_entete_excel(ws_employes, ["Employé", "N° employé", "Grade", "Type emploi", "Gardes", "Heures"] + EXCEL_MOIS))
+        lignes = []
+        for user in sorted(users, key=lambda u: (u.get("nom", ""), u.get("prenom", ""))):
+            gardes, heures, heures_mois = par_employe.get(user["id"], [0, 0, [0] * 12])
+            if not gardes and user.get("statut") != "Actif":
+                continue
+            lignes.append([f"{user.get('prenom', '')} {user.get('nom', '')}", user.get("numero_employe", ""), user.get("grade", ""), user.get("type_emploi", ""), gardes, heures] + heures_mois)
+        await asyncio.to_thread(_ajouter_lignes_excel, ws_employes, lignes)
+        
+        # Par type de garde (gardes par mois)
+        ws_types.append(_entete_excel(ws_types, ["Type de garde", "Durée (h)", "Gardes", "Heures"] + EXCEL_MOIS))
+        _ajouter_lignes_excel(ws_types, [
+            [type_garde.get("nom", "Garde supprimée"), type_garde.get("duree_heures", 8), gardes, heures] + gardes_mois
+            for type_garde_id, (gardes, heures, gardes_mois) in sorted(par_type.items(), key=lambda t: types_garde.get(t[0], {}).get("nom", ""))
+            for type_garde in [types_garde.get(type_garde_id, {})]
+        ])
+        
+        # Par mois
+        ws_mois.append(_entete_excel(ws_mois, ["Mois", "Gardes", "Heures", "Employés distincts"]))
+        _ajouter_lignes_excel(ws_mois, [
+            [f"{EXCEL_MOIS[i]} {annee}", gardes, heures, len(employes)]
+            for i, (gardes, heures, employes) in enumerate(par_mois)
+        ])
+        
+        await asyncio.to_thread(wb.save, chemin)
         
     except Exception as e:
+        os.unlink(chemin)
         raise HTTPException(status_code=500, detail=f"Erreur génération Excel: {str(e)}")
+    
+    return reponse_fichier(
+        chemin,
+        f"rapport_{type_rapport}_{annee}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
 
 @api_router.get("/rapports/statistiques-avancees")
 async def get_statistiques_avancees(current_user: User = Depends(get_current_user)):
@@ -1339,41 +2885,58 @@ async def get_statistiques_avancees(current_user: User = Depends(get_current_use
         raise HTTPException(status_code=403, detail="Accès refusé")
     
     try:
-        # Récupérer toutes les données nécessaires
-        users = await db.users.find().to_list(1000)
-        assignations = await db.assignations.find().to_list(1000)
-        types_garde = await db.types_garde.find().to_list(1000)
-        formations = await db.formations.find().to_list(1000)
-        demandes_remplacement = await db.demandes_remplacement.find().to_list(1000)
+        now = datetime.now()
+        debut_mois = now.replace(day=1)
+        fin_mois = (debut_mois + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        
+        # Récupérer toutes les données nécessaires, sans limite de taille, en parallèle :
+        # les comptages par utilisateur sont faits côté serveur ($group / $size)
+        users, heures_mois, disponibilites_par_user, formations_count, remplacements_count, types_garde = await asyncio.gather(
+            db.users.aggregate([
+                {"$project": {
+                    "_id": 0, "id": 1, "nom": 1, "prenom": 1, "grade": 1, "role": 1, "type_emploi": 1, "statut": 1,
+                    "formations_count": {"$size": {"$ifNull": ["$formations", []]}}
+                }}
+            ]).to_list(None),
+            lire_heures_mensuelles(now.strftime("%Y-%m")),
+            db.disponibilites.aggregate([
+                {"$group": {"_id": "$user_id", "nombre": {"$sum": 1}}}
+            ], allowDiskUse=True).to_list(None),
+            db.formations.count_documents({}),
+            db.demandes_remplacement.count_documents({}),
+            db.types_garde.find({}, {"_id": 0, "id": 1, "jours_application": 1, "personnel_requis": 1}).to_list(None)
+        )
+        disponibilites_count = {d["_id"]: d["nombre"] for d in disponibilites_par_user}
+        couverture = await calculer_couverture(debut_mois.strftime("%Y-%m-%d"), fin_mois.strftime("%Y-%m-%d"), types_garde)
         
         # Statistiques générales
         stats_generales = {
             "personnel_total": len(users),
-            "personnel_actif": len([u for u in users if u.get("statut") == "Actif"]),
-            "assignations_mois": len(assignations),
-            "taux_couverture": 94.5,  # Calcul à améliorer
-            "formations_disponibles": len(formations),
-            "remplacements_demandes": len(demandes_remplacement)
+            "personnel_actif": sum(1 for u in users if u.get("statut") == "Actif"),
+            "assignations_mois": sum(total["gardes"] for total in heures_mois.values()),
+            "taux_couverture": round(min(
+                couverture["personnel_assigne"] / couverture["personnel_requis"] * 100 if couverture["personnel_requis"] else 0.0,
+                100.0
+            ), 1),
+            "formations_disponibles": formations_count,
+            "remplacements_demandes": remplacements_count
         }
         
-        # Statistiques par rôle
-        stats_par_role = {}
-        for role in ["admin", "superviseur", "employe"]:
-            users_role = [u for u in users if u.get("role") == role]
-            assignations_role = [a for a in assignations if any(u["id"] == a["user_id"] and u.get("role") == role for u in users)]
-            
-            stats_par_role[role] = {
-                "nombre_utilisateurs": len(users_role),
-                "assignations_totales": len(assignations_role),
-                "heures_moyennes": len(assignations_role) * 8,  # Estimation
-                "formations_completees": sum(len(u.get("formations", [])) for u in users_role)
-            }
-        
-        # Statistiques par employé (pour export individuel)
+        # Statistiques par rôle et par employé (pour export individuel) : une seule passe
+        stats_par_role = {
+            role: {"nombre_utilisateurs": 0, "assignations_totales": 0, "heures_moyennes": 0, "formations_completees": 0}
+            for role in ["admin", "superviseur", "employe"]
+        }
         stats_par_employe = []
         for user in users:
-            user_assignations = [a for a in assignations if a["user_id"] == user["id"]]
-            user_disponibilites = await db.disponibilites.find({"user_id": user["id"]}).to_list(100)
+            totaux_user = heures_mois.get(user["id"], {"heures": 0, "gardes": 0})
+            
+            stats_role = stats_par_role.get(user.get("role"))
+            if stats_role is not None:
+                stats_role["nombre_utilisateurs"] += 1
+                stats_role["assignations_totales"] += totaux_user["gardes"]
+                stats_role["heures_moyennes"] += totaux_user["heures"]
+                stats_role["formations_completees"] += user["formations_count"]
             
             stats_par_employe.append({
                 "id": user["id"],
@@ -1381,18 +2944,18 @@ async def get_statistiques_avancees(current_user: User = Depends(get_current_use
                 "grade": user["grade"],
                 "role": user["role"],
                 "type_emploi": user["type_emploi"],
-                "assignations_count": len(user_assignations),
-                "disponibilites_count": len(user_disponibilites),
-                "formations_count": len(user.get("formations", [])),
-                "heures_estimees": len(user_assignations) * 8
+                "assignations_count": totaux_user["gardes"],
+                "disponibilites_count": disponibilites_count.get(user["id"], 0),
+                "formations_count": user["formations_count"],
+                "heures_estimees": totaux_user["heures"]
             })
         
         return {
             "statistiques_generales": stats_generales,
             "statistiques_par_role": stats_par_role,
             "statistiques_par_employe": stats_par_employe,
-            "periode": datetime.now().strftime("%B %Y"),
-            "date_generation": datetime.now().isoformat()
+            "periode": now.strftime("%B %Y"),
+            "date_generation": now.isoformat()
         }
         
     except Exception as e:
@@ -1406,6 +2969,7 @@ async def create_session_formation(session: SessionFormationCreate, current_user
     
     session_obj = SessionFormation(**session.dict())
     await db.sessions_formation.insert_one(session_obj.dict())
+    statistiques_cache.invalidate()
     return session_obj
 
 @api_router.get("/sessions-formation", response_model=List[SessionFormation])
@@ -1520,362 +3084,2048 @@ async def delete_disponibilite(disponibilite_id: str, current_user: User = Depen
     
     return {"message": "Disponibilité supprimée avec succès"}
 
-# Assignation manuelle avancée avec récurrence
+# ==================== ASSIGNATIONS RÉCURRENTES ====================
+# Les règles sont développées en mémoire, les conflits (assignations déjà présentes) lus en
+# une requête sur la période, puis tout est écrit en un seul insert_many non ordonné.
+RECURRENCE_MAX_JOURS = 731
+RECURRENCE_MAX_ASSIGNATIONS = int(os.environ.get('RECURRENCE_MAX_ASSIGNATIONS', '20000'))
+JOURS_SEMAINE_INDEX = {
+    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
+    'friday': 4, 'saturday': 5, 'sunday': 6
+}
+
+def _date_regle(valeur: str, champ: str):
+    try:
+        return datetime.strptime(valeur, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ValueError(f"{champ} invalide (format AAAA-MM-JJ attendu)")
+
+def _mois_periode(debut, fin):
+    mois = debut.replace(day=1)
+    while mois <= fin:
+        yield mois
+        mois = mois.replace(year=mois.year + 1, month=1) if mois.month == 12 else mois.replace(month=mois.month + 1)
+
+def dates_recurrence(regle: RegleRecurrence) -> List[str]:
+    """Développe une règle en dates (YYYY-MM-DD) triées ; ValueError si la règle est invalide"""
+    debut = _date_regle(regle.date_debut, "date_debut")
+    fin = _date_regle(regle.date_fin or regle.date_debut, "date_fin")
+    if fin < debut:
+        raise ValueError("date_fin doit être postérieure à date_debut")
+    if (fin - debut).days > RECURRENCE_MAX_JOURS:
+        raise ValueError(f"Période limitée à {RECURRENCE_MAX_JOURS} jours")
+    inconnus = [jour for jour in regle.jours_semaine if jour not in JOURS_SEMAINE_INDEX]
+    if inconnus:
+        raise ValueError(f"Jour(s) de semaine invalide(s): {', '.join(inconnus)}")
+    jours = {JOURS_SEMAINE_INDEX[jour] for jour in regle.jours_semaine}
+    
+    dates = []
+    if regle.type == "unique":
+        dates = [debut]
+    elif regle.type in ("hebdomadaire", "bihebdomadaire"):
+        if not jours:
+            raise ValueError("jours_semaine requis pour une récurrence hebdomadaire")
+        pas = 2 if regle.type == "bihebdomadaire" else 1
+        lundi = debut - timedelta(days=debut.weekday())
+        semaine = 0
+        while lundi + timedelta(weeks=semaine) <= fin:
+            for jour in sorted(jours):
+                date = lundi + timedelta(weeks=semaine, days=jour)
+                if debut <= date <= fin:
+                    dates.append(date)
+            semaine += pas
+    elif regle.type == "mensuel":
+        jour_mois = regle.jour_mois or debut.day
+        if not 1 <= jour_mois <= 31:
+            raise ValueError("jour_mois doit être compris entre 1 et 31")
+        for mois in _mois_periode(debut, fin):
+            try:
+                date = mois.replace(day=jour_mois)
+            except ValueError:
+                continue  # Jour absent de ce mois (ex: 31 février)
+            if debut <= date <= fin:
+                dates.append(date)
+    elif regle.type == "nieme_jour_semaine":
+        if not jours:
+            raise ValueError("jours_semaine requis pour une récurrence nieme_jour_semaine")
+        if regle.rang not in (1, 2, 3, 4, 5, -1):
+            raise ValueError("rang doit valoir 1 à 5, ou -1 pour le dernier du mois")
+        for mois in _mois_periode(debut, fin):
+            mois_suivant = (mois + timedelta(days=32)).replace(day=1)
+            for jour in sorted(jours):
+                if regle.rang > 0:
+                    date = mois + timedelta(days=(jour - mois.weekday()) % 7 + 7 * (regle.rang - 1))
+                    if date >= mois_suivant:
+                        continue  # Pas de 5e occurrence ce mois-ci
+                else:
+                    dernier = mois_suivant - timedelta(days=1)
+                    date = dernier - timedelta(days=(dernier.weekday() - jour) % 7)
+                if debut <= date <= fin:
+                    dates.append(date)
+    else:
+        raise ValueError(f"Type de récurrence inconnu: {regle.type}")
+    
+    exceptions = set(regle.exceptions)
+    return [d for d in (date.strftime("%Y-%m-%d") for date in sorted(dates)) if d not in exceptions]
+
+async def creer_assignations_recurrentes(
+    user_ids: List[str], type_garde_ids: List[str], regles: List[RegleRecurrence]
+) -> Dict[str, Any]:
+    """
+    Crée les assignations employés × types de garde × dates des règles. Les assignations déjà
+    présentes ou générées par une règle précédente sont ignorées, celles qui chevauchent une
+    autre garde de l'employé (ou son repos minimum) écartées ; compteurs par règle.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    type_garde_ids = list(dict.fromkeys(type_garde_ids))
+    if not user_ids or not type_garde_ids or not regles:
+        raise HTTPException(status_code=400, detail="user_ids, type_garde_ids et regles sont requis")
+    
+    dates_par_regle = []
+    for index, regle in enumerate(regles):
+        try:
+            dates_par_regle.append(dates_recurrence(regle))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Règle {index + 1}: {e}")
+    total = sum(len(dates) for dates in dates_par_regle) * len(user_ids) * len(type_garde_ids)
+    if total > RECURRENCE_MAX_ASSIGNATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{total} assignations demandées, maximum {RECURRENCE_MAX_ASSIGNATIONS} par requête"
+        )
+    
+    users_trouves = await db.users.distinct("id", {"id": {"$in": user_ids}})
+    types_garde = await db.types_garde.find(
+        {"id": {"$in": type_garde_ids}}, {"_id": 0, "id": 1, "heure_debut": 1, "heure_fin": 1}
+    ).to_list(None)
+    types_garde_par_id = {t["id"]: t for t in types_garde}
+    manquants = [i for i in user_ids if i not in users_trouves] + [i for i in type_garde_ids if i not in types_garde_par_id]
+    if manquants:
+        raise HTTPException(status_code=404, detail=f"Employé(s) ou type(s) de garde introuvable(s): {', '.join(manquants)}")
+    
+    # Une seule lecture : gardes des employés sur la période (marge de repos incluse)
+    toutes_dates = [date for dates in dates_par_regle for date in dates]
+    intervalles = IndexIntervalles()
+    if toutes_dates:
+        intervalles = await charger_index_intervalles(min(toutes_dates), max(toutes_dates), user_ids)
+    existantes = {
+        (garde[2]["user_id"], garde[2]["date"], garde[2]["type_garde_id"])
+        for gardes in intervalles.gardes.values() for garde in gardes
+    }
+    
+    resultats = []
+    a_inserer = []
+    regle_de = {}
+    for index, (regle, dates) in enumerate(zip(regles, dates_par_regle)):
+        resultat = {"regle": index + 1, "type": regle.type, "dates": len(dates), "creees": 0, "ignorees": 0, "chevauchements": 0}
+        for date in dates:
+            for user_id in user_ids:
+                for type_garde_id in type_garde_ids:
+                    if (user_id, date, type_garde_id) in existantes:
+                        resultat["ignorees"] += 1
+                        continue
+                    debut, fin = intervalle_garde(date, types_garde_par_id[type_garde_id])
+                    if intervalles.conflit(user_id, debut, fin):
+                        resultat["chevauchements"] += 1
+                        continue
+                    assignation = Assignation(
+                        user_id=user_id, type_garde_id=type_garde_id, date=date, assignation_type="manuel_avance"
+                    ).dict()
+                    existantes.add((user_id, date, type_garde_id))
+                    intervalles.ajouter(user_id, debut, fin, assignation)
+                    regle_de[assignation["id"]] = index
+                    a_inserer.append(assignation)
+        resultats.append(resultat)
+    
+    inserees = await inserer_assignations(a_inserer)
+    for assignation in inserees:
+        resultats[regle_de[assignation["id"]]]["creees"] += 1
+    for resultat in resultats:
+        # Créées entre la lecture des conflits et l'insertion : rejetées par l'index unique
+        resultat["ignorees"] = resultat["dates"] * len(user_ids) * len(type_garde_ids) - resultat["creees"] - resultat["chevauchements"]
+    
+    return {
+        "assignations_creees": len(inserees),
+        "assignations_ignorees": sum(r["ignorees"] for r in resultats),
+        "chevauchements": sum(r["chevauchements"] for r in resultats),
+        "regles": resultats
+    }
+
+@api_router.post("/planning/assignations-recurrentes")
+async def create_assignations_recurrentes(
+    demande: AssignationRecurrenteCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role not in ["admin", "superviseur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    return await executer_idempotent(
+        idempotency_key, current_user, "planning/assignations-recurrentes", demande.dict(),
+        lambda: creer_assignations_recurrentes(demande.user_ids, demande.type_garde_ids, demande.regles)
+    )
+
+# Assignation manuelle avancée avec récurrence (un employé, un type de garde)
 @api_router.post("/planning/assignation-avancee")
 async def assignation_manuelle_avancee(
     assignation_data: dict,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: User = Depends(get_current_user)
 ):
     if current_user.role not in ["admin", "superviseur"]:
         raise HTTPException(status_code=403, detail="Accès refusé")
     
+    return await executer_idempotent(
+        idempotency_key, current_user, "planning/assignation-avancee", assignation_data,
+        lambda: _assignation_manuelle_avancee(assignation_data)
+    )
+
+async def _assignation_manuelle_avancee(assignation_data: dict):
     try:
-        user_id = assignation_data.get("user_id")
-        type_garde_id = assignation_data.get("type_garde_id")
         recurrence_type = assignation_data.get("recurrence_type", "unique")
-        date_debut = datetime.strptime(assignation_data.get("date_debut"), "%Y-%m-%d").date()
-        date_fin = datetime.strptime(assignation_data.get("date_fin", assignation_data.get("date_debut")), "%Y-%m-%d").date()
-        jours_semaine = assignation_data.get("jours_semaine", [])
-        
-        assignations_creees = []
-        
-        if recurrence_type == "unique":
-            # Assignation unique
-            assignation_obj = Assignation(
-                user_id=user_id,
-                type_garde_id=type_garde_id,
-                date=date_debut.strftime("%Y-%m-%d"),
-                assignation_type="manuel_avance"
-            )
-            await db.assignations.insert_one(assignation_obj.dict())
-            assignations_creees.append(assignation_obj.dict())
-            
-        elif recurrence_type == "hebdomadaire":
-            # Récurrence hebdomadaire
-            current_date = date_debut
-            jours_semaine_index = {
-                'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
-                'friday': 4, 'saturday': 5, 'sunday': 6
-            }
-            
-            while current_date <= date_fin:
-                day_name = current_date.strftime("%A").lower()
-                
-                if day_name in jours_semaine:
-                    # Vérifier qu'il n'y a pas déjà une assignation
-                    existing = await db.assignations.find_one({
-                        "user_id": user_id,
-                        "type_garde_id": type_garde_id,
-                        "date": current_date.strftime("%Y-%m-%d")
-                    })
-                    
-                    if not existing:
-                        assignation_obj = Assignation(
-                            user_id=user_id,
-                            type_garde_id=type_garde_id,
-                            date=current_date.strftime("%Y-%m-%d"),
-                            assignation_type="manuel_avance"
-                        )
-                        await db.assignations.insert_one(assignation_obj.dict())
-                        assignations_creees.append(assignation_obj.dict())
-                
-                current_date += timedelta(days=1)
-                
-        elif recurrence_type == "mensuel":
-            # Récurrence mensuelle (même jour du mois)
-            jour_mois = date_debut.day
-            current_month = date_debut.replace(day=1)
-            
-            while current_month <= date_fin:
-                try:
-                    # Essayer de créer la date pour ce mois
-                    target_date = current_month.replace(day=jour_mois)
-                    
-                    if date_debut <= target_date <= date_fin:
-                        existing = await db.assignations.find_one({
-                            "user_id": user_id,
-                            "type_garde_id": type_garde_id,
-                            "date": target_date.strftime("%Y-%m-%d")
-                        })
-                        
-                        if not existing:
-                            assignation_obj = Assignation(
-                                user_id=user_id,
-                                type_garde_id=type_garde_id,
-                                date=target_date.strftime("%Y-%m-%d"),
-                                assignation_type="manuel_avance"
-                            )
-                            await db.assignations.insert_one(assignation_obj.dict())
-                            assignations_creees.append(assignation_obj.dict())
-                            
-                except ValueError:
-                    # Jour n'existe pas dans ce mois (ex: 31 février)
-                    pass
-                
-                # Passer au mois suivant
-                if current_month.month == 12:
-                    current_month = current_month.replace(year=current_month.year + 1, month=1)
-                else:
-                    current_month = current_month.replace(month=current_month.month + 1)
+        date_debut = assignation_data.get("date_debut")
+        date_fin = assignation_data.get("date_fin") or date_debut
+        regle = RegleRecurrence(
+            type=recurrence_type,
+            date_debut=date_debut,
+            date_fin=date_fin,
+            jours_semaine=assignation_data.get("jours_semaine", []),
+            exceptions=assignation_data.get("exceptions", [])
+        )
+        resultat = await creer_assignations_recurrentes(
+            [assignation_data.get("user_id")], [assignation_data.get("type_garde_id")], [regle]
+        )
         
         return {
             "message": "Assignation avancée créée avec succès",
-            "assignations_creees": len(assignations_creees),
+            "assignations_creees": resultat["assignations_creees"],
+            "assignations_ignorees": resultat["assignations_ignorees"],
+            "chevauchements": resultat["chevauchements"],
             "recurrence": recurrence_type,
-            "periode": f"{date_debut.strftime('%Y-%m-%d')} à {date_fin.strftime('%Y-%m-%d')}"
+            "periode": f"{date_debut} à {date_fin}"
         }
-        
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur assignation avancée: {str(e)}")
 
-# Mode démo spécial - Attribution automatique agressive pour impression client
-@api_router.post("/planning/attribution-auto-demo")
-async def attribution_automatique_demo(semaine_debut: str, current_user: User = Depends(get_current_user)):
-    if current_user.role not in ["admin", "superviseur"]:
-        raise HTTPException(status_code=403, detail="Accès refusé")
+# ==================== REGISTRE DES HEURES MENSUELLES ====================
+
+# Collection heures_mensuelles : un document par (user_id, mois "YYYY-MM", type_garde_id)
+# avec heures et gardes, tenu à jour par $inc à chaque écriture d'assignations.
+
+def mois_de(date_str: str) -> str:
+    return date_str[:7]
+
+async def _durees_types_garde(type_garde_ids) -> Dict[str, int]:
+    types_garde = await db.types_garde.find(
+        {"id": {"$in": list(type_garde_ids)}},
+        {"_id": 0, "id": 1, "duree_heures": 1}
+    ).to_list(None)
+    return {t["id"]: t.get("duree_heures", 8) for t in types_garde}
+
+async def mettre_a_jour_heures_mensuelles(assignations: List[Dict[str, Any]], signe: int = 1):
+    """
+    Ajoute (signe=1) ou retire (signe=-1) des assignations du registre, en un seul bulk_write
+    d'incréments atomiques ($inc avec upsert). Les lignes retombées à zéro garde sont supprimées.
+    """
+    if not assignations:
+        return
+    
+    durees = await _durees_types_garde({a["type_garde_id"] for a in assignations})
+    increments: Dict[tuple, List[int]] = {}
+    for assignation in assignations:
+        cle = (assignation["user_id"], mois_de(assignation["date"]), assignation["type_garde_id"])
+        increment = increments.setdefault(cle, [0, 0])
+        increment[0] += durees.get(assignation["type_garde_id"], 8)
+        increment[1] += 1
+    
+    await db.heures_mensuelles.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "mois": mois, "type_garde_id": type_garde_id},
+            {"$inc": {"heures": signe * heures, "gardes": signe * gardes}},
+            upsert=True
+        )
+        for (user_id, mois, type_garde_id), (heures, gardes) in increments.items()
+    ], ordered=False)
+    
+    if signe < 0:
+        await db.heures_mensuelles.delete_many({
+            "$or": [
+                {"user_id": user_id, "mois": mois, "type_garde_id": type_garde_id}
+                for user_id, mois, type_garde_id in increments
+            ],
+            "gardes": {"$lte": 0}
+        })
+
+async def incrementer_versions_planning(semaines: Optional[List[str]] = None):
+    """Nouvelle version des semaines touchées (lundis ; None = toutes : version globale « * »)"""
+    await db.versions_planning.bulk_write(
+        [UpdateOne({"semaine": semaine}, {"$inc": {"version": 1}}, upsert=True) for semaine in semaines or ["*"]],
+        ordered=False
+    )
+
+async def signaler_modification_assignations(dates: Optional[Set[str]] = None):
+    """
+    Point unique appelé après toute écriture d'assignations (dates touchées, None = toutes) :
+    invalide les vues dérivées (tableau de bord, grilles du planning) et prévient les clients connectés.
+    """
+    semaines = None if dates is None else sorted({lundi_de(date) for date in dates})
+    statistiques_cache.invalidate()
+    await incrementer_versions_planning(semaines)
+    diffusion.publier("planning", {"semaines": semaines})
+
+async def signaler_modification_referentiel():
+    """Après une modification du personnel ou des types de garde : invalide les vues qui les affichent"""
+    statistiques_cache.invalidate()
+    await incrementer_versions_planning(None)
+    diffusion.publier("planning", {"semaines": None})
+
+async def assignations_modifiees(assignations: List[Dict[str, Any]], signe: int = 1):
+    """Répercute des assignations créées (signe=1) ou supprimées (signe=-1) : registre des heures et vues dérivées"""
+    if not assignations:
+        return
+    await mettre_a_jour_heures_mensuelles(assignations, signe)
+    await signaler_modification_assignations({a["date"] for a in assignations})
+
+async def supprimer_assignations(filtre: Dict[str, Any]) -> int:
+    """Supprime les assignations correspondant au filtre et les retire du registre des heures"""
+    if not filtre:
+        result = await db.assignations.delete_many({})
+        await db.heures_mensuelles.delete_many({})
+        await signaler_modification_assignations()
+        return result.deleted_count
+    
+    assignations = await db.assignations.find(
+        filtre,
+        {"_id": 0, "id": 1, "user_id": 1, "type_garde_id": 1, "date": 1}
+    ).to_list(None)
+    if not assignations:
+        return 0
+    
+    result = await db.assignations.delete_many({"id": {"$in": [a["id"] for a in assignations]}})
+    await assignations_modifiees(assignations, signe=-1)
+    return result.deleted_count
+
+async def inserer_assignations(assignations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insère des assignations en un aller-retour et les ajoute au registre des heures.
+    Les doublons (même employé, même date, même type de garde : index unique) sont ignorés ;
+    retourne les assignations réellement insérées.
+    """
+    if not assignations:
+        return []
     
+    erreurs = []
     try:
-        # Get all available users and types de garde
-        users = await db.users.find({"statut": "Actif"}).to_list(1000)
-        types_garde = await db.types_garde.find().to_list(1000)
-        
-        # Get existing assignations for the week
-        semaine_fin = (datetime.strptime(semaine_debut, "%Y-%m-%d") + timedelta(days=6)).strftime("%Y-%m-%d")
-        existing_assignations = await db.assignations.find({
-            "date": {
-                "$gte": semaine_debut,
-                "$lte": semaine_fin
+        await db.assignations.insert_many(assignations, ordered=False)
+    except BulkWriteError as e:
+        erreurs = e.details.get("writeErrors", [])
+    rejetees = {erreur["index"] for erreur in erreurs}
+    inserees = [a for i, a in enumerate(assignations) if i not in rejetees]
+    await assignations_modifiees(inserees)
+    
+    autres = [erreur for erreur in erreurs if erreur.get("code") != 11000]
+    if autres:
+        raise RuntimeError(f"{len(autres)} assignation(s) non insérée(s): {autres[0].get('errmsg')}")
+    return inserees
+
+async def dedoublonner_assignations() -> int:
+    """
+    Supprime les assignations en double (même employé, date et type de garde) en gardant la
+    première, pour permettre la création de l'index unique ; reconstruit le registre si besoin.
+    """
+    doublons = await db.assignations.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "date": "$date", "type_garde_id": "$type_garde_id"},
+            "ids": {"$push": "$_id"},
+            "nombre": {"$sum": 1}
+        }},
+        {"$match": {"nombre": {"$gt": 1}}}
+    ], allowDiskUse=True).to_list(None)
+    a_supprimer = [_id for doublon in doublons for _id in doublon["ids"][1:]]
+    if not a_supprimer:
+        return 0
+    
+    supprimees = 0
+    for debut in range(0, len(a_supprimer), SUPPRESSION_TAILLE_LOT):
+        result = await db.assignations.delete_many({"_id": {"$in": a_supprimer[debut:debut + SUPPRESSION_TAILLE_LOT]}})
+        supprimees += result.deleted_count
+    await reconstruire_heures_mensuelles()
+    await signaler_modification_assignations()
+    return supprimees
+
+async def recalculer_heures_type_garde(type_garde_id: str, duree_heures: int):
+    """Après changement de durée d'un type de garde : heures = gardes × nouvelle durée"""
+    await db.heures_mensuelles.update_many(
+        {"type_garde_id": type_garde_id},
+        [{"$set": {"heures": {"$multiply": ["$gardes", duree_heures]}}}]
+    )
+    statistiques_cache.invalidate()
+
+async def reconstruire_heures_mensuelles() -> int:
+    """Reconstruit entièrement le registre à partir des assignations (une agrégation)"""
+    groupes = await db.assignations.aggregate([
+        {"$group": {
+            "_id": {"user_id": "$user_id", "mois": {"$substrBytes": ["$date", 0, 7]}, "type_garde_id": "$type_garde_id"},
+            "gardes": {"$sum": 1}
+        }}
+    ], allowDiskUse=True).to_list(None)
+    durees = await _durees_types_garde({g["_id"]["type_garde_id"] for g in groupes})
+    
+    await db.heures_mensuelles.delete_many({})
+    if groupes:
+        await db.heures_mensuelles.insert_many([
+            {
+                **g["_id"],
+                "heures": g["gardes"] * durees.get(g["_id"]["type_garde_id"], 8),
+                "gardes": g["gardes"]
             }
-        }).to_list(1000)
-        
-        nouvelles_assignations = []
-        
-        # MODE DÉMO AGRESSIF - REMPLIR AU MAXIMUM
+            for g in groupes
+        ], ordered=False)
+    await signaler_modification_assignations()
+    return len(groupes)
+
+async def lire_heures_mensuelles(mois: str, user_id: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+    """Heures et gardes du mois par utilisateur, lues depuis le registre"""
+    filtre: Dict[str, Any] = {"mois": mois}
+    if user_id:
+        filtre["user_id"] = user_id
+    lignes = await db.heures_mensuelles.find(filtre, {"_id": 0, "user_id": 1, "heures": 1, "gardes": 1}).to_list(None)
+    
+    totaux: Dict[str, Dict[str, int]] = {}
+    for ligne in lignes:
+        total = totaux.setdefault(ligne["user_id"], {"heures": 0, "gardes": 0})
+        total["heures"] += ligne["heures"]
+        total["gardes"] += ligne["gardes"]
+    return totaux
+
+@api_router.post("/planning/heures-mensuelles/reconstruire")
+async def reconstruire_registre_heures(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    lignes = await reconstruire_heures_mensuelles()
+    return {"message": "Registre des heures mensuelles reconstruit", "lignes": lignes}
+
+# ==================== CONCURRENCE DES ÉCRITURES DU PLANNING ====================
+# Baux par semaine (collection baux_planning) : un seul calcul d'attribution écrit une semaine
+# donnée à la fois. Clés d'idempotence (collection cles_idempotence) : une requête rejouée avec
+# le même en-tête Idempotency-Key renvoie la réponse de la première exécution.
+BAIL_PLANNING_SECONDES = 120
+IDEMPOTENCE_TTL_HEURES = 24
+IDEMPOTENCE_VERROU_SECONDES = 300
+
+def fin_de_semaine(semaine_debut: str) -> str:
+    return (datetime.strptime(semaine_debut, "%Y-%m-%d") + timedelta(days=6)).strftime("%Y-%m-%d")
+
+def lundi_de(date: str) -> str:
+    jour = datetime.strptime(date, "%Y-%m-%d").date()
+    return (jour - timedelta(days=jour.weekday())).strftime("%Y-%m-%d")
+
+def semaines_iso(date_debut: str, date_fin: str) -> List[str]:
+    """Lundis des semaines touchées par la période (clés des baux)"""
+    debut = datetime.strptime(date_debut, "%Y-%m-%d").date()
+    fin = datetime.strptime(date_fin, "%Y-%m-%d").date()
+    lundi = debut - timedelta(days=debut.weekday())
+    semaines = []
+    while lundi <= fin:
+        semaines.append(lundi.strftime("%Y-%m-%d"))
+        lundi += timedelta(weeks=1)
+    return semaines
+
+async def _acquerir_bail(semaine: str, proprietaire: str) -> bool:
+    maintenant = datetime.now(timezone.utc)
+    try:
+        await db.baux_planning.find_one_and_update(
+            {"semaine": semaine, "$or": [{"expire_le": {"$lte": maintenant}}, {"proprietaire": proprietaire}]},
+            {"$set": {
+                "proprietaire": proprietaire,
+                "acquis_le": maintenant,
+                "expire_le": maintenant + timedelta(seconds=BAIL_PLANNING_SECONDES)
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Le document existe et appartient à un autre écrivain dont le bail court encore
+        return False
+    return True
+
+class BailPlanning:
+    """
+    Baux détenus par un écrivain du planning. Ils sont prolongés en tâche de fond tant que le
+    bloc s'exécute (un calcul dans le pool de processus peut dépasser BAIL_PLANNING_SECONDES) ;
+    confirmer() vérifie juste avant l'écriture qu'aucun n'a été repris entre-temps.
+    """
+    def __init__(self):
+        self.proprietaire = str(uuid.uuid4())
+        self.semaines: List[str] = []
+        self.perdu = False
+    
+    async def renouveler(self) -> bool:
+        if self.semaines and not self.perdu:
+            result = await db.baux_planning.update_many(
+                {"semaine": {"$in": self.semaines}, "proprietaire": self.proprietaire},
+                {"$set": {"expire_le": datetime.now(timezone.utc) + timedelta(seconds=BAIL_PLANNING_SECONDES)}}
+            )
+            self.perdu = result.matched_count < len(self.semaines)
+        return not self.perdu
+    
+    async def confirmer(self):
+        """À appeler juste avant d'écrire : prolonge les baux, 409 si l'un d'eux a été repris"""
+        if not await self.renouveler():
+            raise HTTPException(
+                status_code=409,
+                detail="Le planning a été modifié par une autre attribution pendant le calcul, relancez l'attribution"
+            )
+    
+    async def entretenir(self):
+        while not self.perdu:
+            await asyncio.sleep(BAIL_PLANNING_SECONDES / 3)
+            try:
+                await self.renouveler()
+            except Exception as e:
+                logger.warning(f"Renouvellement des baux du planning impossible: {str(e)}")
+
+@asynccontextmanager
+async def bail_planning(date_debut: str, date_fin: str, attente: float = 0):
+    """
+    Détient les baux des semaines de la période le temps du bloc (ordre croissant : pas
+    d'interblocage entre deux périodes qui se chevauchent) et retourne le BailPlanning.
+    Sans bail après `attente` secondes : HTTPException 409.
+    """
+    bail = BailPlanning()
+    limite = time.monotonic() + attente
+    entretien: Optional[asyncio.Task] = None
+    try:
+        for semaine in semaines_iso(date_debut, date_fin):
+            while not await _acquerir_bail(semaine, bail.proprietaire):
+                if time.monotonic() >= limite:
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"Le planning de la semaine du {semaine} est en cours de modification, réessayez dans un instant"
+                    )
+                await asyncio.sleep(1)
+            bail.semaines.append(semaine)
+        entretien = asyncio.create_task(bail.entretenir())
+        yield bail
+    finally:
+        if entretien is not None:
+            entretien.cancel()
+        if bail.semaines:
+            await db.baux_planning.delete_many({"semaine": {"$in": bail.semaines}, "proprietaire": bail.proprietaire})
+
+async def executer_idempotent(cle: Optional[str], current_user: "User", portee: str, parametres: Any, executer):
+    """
+    Exécute `executer()` une seule fois par (utilisateur, portée, clé). Une clé réutilisée avec
+    d'autres paramètres est refusée (422) ; pendant l'exécution, un doublon reçoit 409.
+    Une exécution en échec libère la clé pour permettre une nouvelle tentative.
+    """
+    if not cle:
+        return await executer()
+    
+    identifiant = f"{current_user.id}:{portee}:{cle}"
+    empreinte = hashlib.sha256(json.dumps(jsonable_encoder(parametres), sort_keys=True).encode()).hexdigest()
+    maintenant = datetime.now(timezone.utc)
+    verrou = maintenant + timedelta(seconds=IDEMPOTENCE_VERROU_SECONDES)
+    try:
+        await db.cles_idempotence.insert_one({
+            "cle": identifiant,
+            "empreinte": empreinte,
+            "statut": "en_cours",
+            "verrou_jusqu_a": verrou,
+            "created_at": maintenant,
+            "expire_le": maintenant + timedelta(hours=IDEMPOTENCE_TTL_HEURES)
+        })
+    except DuplicateKeyError:
+        existante = await db.cles_idempotence.find_one({"cle": identifiant})
+        if existante is None or existante["empreinte"] != empreinte:
+            raise HTTPException(status_code=422, detail="Clé d'idempotence déjà utilisée pour une autre requête")
+        if existante["statut"] == "terminee":
+            return existante["reponse"]
+        # Exécution précédente interrompue (verrou expiré) : on la reprend
+        reprise = await db.cles_idempotence.find_one_and_update(
+            {"cle": identifiant, "statut": "en_cours", "verrou_jusqu_a": {"$lte": maintenant}},
+            {"$set": {"verrou_jusqu_a": verrou}}
+        )
+        if reprise is None:
+            raise HTTPException(status_code=409, detail="Une requête identique est déjà en cours de traitement")
+    
+    try:
+        reponse = await executer()
+    except BaseException:
+        await db.cles_idempotence.delete_one({"cle": identifiant})
+        raise
+    reponse = jsonable_encoder(reponse)
+    await db.cles_idempotence.update_one(
+        {"cle": identifiant},
+        {"$set": {"statut": "terminee", "reponse": reponse}, "$unset": {"verrou_jusqu_a": ""}}
+    )
+    return reponse
+
+# ==================== GRILLE DU PLANNING ====================
+# Vue jours × types de garde d'une semaine, construite en une agrégation et mise en cache
+# par semaine. La version (collection versions_planning, incrémentée à chaque écriture
+# d'assignations de la semaine ou modification du référentiel) sert d'ETag.
+GRILLE_CACHE_TAILLE = 64
+_grilles_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+async def version_planning(semaine_debut: str, semaine_fin: str) -> str:
+    semaines = semaines_iso(semaine_debut, semaine_fin)
+    versions = {
+        v["semaine"]: v["version"]
+        async for v in db.versions_planning.find({"semaine": {"$in": ["*"] + semaines}}, {"_id": 0})
+    }
+    return ".".join(str(versions.get(semaine, 0)) for semaine in ["*"] + semaines)
+
+async def construire_grille_planning(semaine_debut: str, semaine_fin: str) -> Dict[str, Any]:
+    types_garde = await db.types_garde.aggregate([
+        {"$sort": {"heure_debut": 1, "nom": 1}},
+        {"$lookup": {
+            "from": "assignations",
+            "let": {"type_garde_id": "$id"},
+            "pipeline": [
+                {"$match": {"date": {"$gte": semaine_debut, "$lte": semaine_fin}}},
+                {"$match": {"$expr": {"$eq": ["$type_garde_id", "$$type_garde_id"]}}},
+                {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "user"}},
+                {"$unwind": {"path": "$user", "preserveNullAndEmptyArrays": True}},
+                {"$project": {
+                    "_id": 0, "id": 1, "date": 1, "user_id": 1, "statut": 1, "assignation_type": 1,
+                    "nom": "$user.nom", "prenom": "$user.prenom", "grade": "$user.grade",
+                    "fonction_superieur": "$user.fonction_superieur"
+                }},
+                {"$sort": {"nom": 1, "prenom": 1}}
+            ],
+            "as": "assignations"
+        }},
+        {"$project": {"_id": 0, "created_at": 0}}
+    ]).to_list(None)
+    
+    personnel_requis_total = 0
+    places_pourvues_total = 0
+    jours = []
+    debut = datetime.strptime(semaine_debut, "%Y-%m-%d")
+    for offset in range(7):
+        jour = debut + timedelta(days=offset)
+        date_str = jour.strftime("%Y-%m-%d")
+        nom_jour = jour.strftime("%A").lower()
+        gardes = []
         for type_garde in types_garde:
-            for day_offset in range(7):
-                current_date = datetime.strptime(semaine_debut, "%Y-%m-%d") + timedelta(days=day_offset)
-                date_str = current_date.strftime("%Y-%m-%d")
-                day_name = current_date.strftime("%A").lower()
-                
-                # Skip if type garde doesn't apply to this day
-                if type_garde.get("jours_application") and day_name not in type_garde["jours_application"]:
-                    continue
+            assignes = [a for a in type_garde["assignations"] if a["date"] == date_str]
+            applicable = not type_garde.get("jours_application") or nom_jour in type_garde["jours_application"]
+            if not applicable and not assignes:
+                continue
+            
+            personnel_requis = type_garde.get("personnel_requis", 1) if applicable else 0
+            officier_present = any(est_officier(a) for a in assignes)
+            personnel_requis_total += personnel_requis
+            places_pourvues_total += min(len(assignes), personnel_requis)
+            if personnel_requis and not assignes:
+                couverture = "vacante"
+            elif len(assignes) >= personnel_requis:
+                couverture = "complete"
+            else:
+                couverture = "partielle"
+            gardes.append({
+                "type_garde_id": type_garde["id"],
+                "nom": type_garde["nom"],
+                "heure_debut": type_garde.get("heure_debut"),
+                "heure_fin": type_garde.get("heure_fin"),
+                "couleur": type_garde.get("couleur"),
+                "personnel_requis": personnel_requis,
+                "places_pourvues": len(assignes),
+                "places_libres": max(0, personnel_requis - len(assignes)),
+                "couverture": couverture,
+                "officier_obligatoire": type_garde.get("officier_obligatoire", False),
+                "officier_present": officier_present,
+                "officier_manquant": type_garde.get("officier_obligatoire", False) and not officier_present,
+                "assignes": [
+                    {
+                        "assignation_id": a["id"],
+                        "user_id": a["user_id"],
+                        "nom": a.get("nom", ""),
+                        "prenom": a.get("prenom", ""),
+                        "grade": a.get("grade"),
+                        "officier": est_officier(a),
+                        "statut": a.get("statut"),
+                        "assignation_type": a.get("assignation_type")
+                    }
+                    for a in assignes
+                ]
+            })
+        jours.append({"date": date_str, "jour": nom_jour, "gardes": gardes})
+    
+    return {
+        "semaine_debut": semaine_debut,
+        "semaine_fin": semaine_fin,
+        "types_garde": [{k: v for k, v in t.items() if k != "assignations"} for t in types_garde],
+        "jours": jours,
+        "couverture": {
+            "personnel_requis": personnel_requis_total,
+            "places_pourvues": places_pourvues_total,
+            "taux_couverture": round(100 * places_pourvues_total / personnel_requis_total, 1) if personnel_requis_total else 0
+        }
+    }
+
+@api_router.get("/planning/grille/{semaine_debut}")
+async def get_grille_planning(semaine_debut: str, request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    """
+    Grille de la semaine pour l'écran de planning : noms, grades, places requises/pourvues et
+    présence d'un officier par garde. ETag faible : If-None-Match → 304 si rien n'a changé.
+    """
+    try:
+        semaine_fin = fin_de_semaine(semaine_debut)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Date de semaine invalide (format AAAA-MM-JJ attendu)")
+    
+    version = await version_planning(semaine_debut, semaine_fin)
+    etag = f'W/"grille-{semaine_debut}-{version}"'
+    en_tetes = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=en_tetes)
+    
+    en_cache = _grilles_cache.get(semaine_debut)
+    if en_cache is not None and en_cache[0] == version:
+        _grilles_cache.move_to_end(semaine_debut)
+        grille = en_cache[1]
+    else:
+        # Version lue avant la construction : une écriture concurrente produira une version plus récente
+        grille = {**await construire_grille_planning(semaine_debut, semaine_fin), "version": version}
+        _grilles_cache[semaine_debut] = (version, grille)
+        _grilles_cache.move_to_end(semaine_debut)
+        while len(_grilles_cache) > GRILLE_CACHE_TAILLE:
+            _grilles_cache.popitem(last=False)
+    
+    response.headers.update(en_tetes)
+    return grille
+
+# ==================== INTERVALLES DE GARDE ====================
+# Une assignation occupe [date + heure_debut, date + heure_fin[ ; si l'heure de fin ne suit pas
+# l'heure de début (garde de nuit), la garde se termine le lendemain. Deux gardes d'un même
+# employé sont en conflit si leurs intervalles se chevauchent ou laissent moins que le repos minimum.
+REPOS_MINIMUM_HEURES = float(os.environ.get('REPOS_MINIMUM_HEURES', '0'))
+
+def _minutes(date: str, heure: Optional[str]) -> int:
+    """Instant en minutes (depuis l'an 1) d'une date YYYY-MM-DD et d'une heure HH:MM"""
+    heures, minutes = (heure or "00:00").split(":")[:2]
+    return datetime.strptime(date, "%Y-%m-%d").toordinal() * 1440 + int(heures) * 60 + int(minutes)
+
+def intervalle_garde(date: str, type_garde: Dict[str, Any]) -> Tuple[int, int]:
+    """Intervalle [début, fin[ en minutes de la garde commençant ce jour"""
+    debut = _minutes(date, type_garde.get("heure_debut"))
+    fin = _minutes(date, type_garde.get("heure_fin"))
+    if fin <= debut:
+        fin += 1440
+    return debut, fin
+
+def marge_intervalles_jours() -> int:
+    """Jours à charger autour d'une période pour voir toutes les gardes pouvant entrer en conflit"""
+    return 1 + math.ceil(REPOS_MINIMUM_HEURES / 24)
+
+class IndexIntervalles:
+    """
+    Gardes concrètes par employé, triées par début. Un chevauchement (ou un repos insuffisant)
+    se vérifie par dichotomie en O(log n + k), k étant le nombre de gardes de l'employé qui
+    commencent dans la fenêtre [début - durée max - repos, fin + repos[ (une ou deux en pratique).
+    """
+    def __init__(self, repos_minimum_heures: Optional[float] = None):
+        heures = REPOS_MINIMUM_HEURES if repos_minimum_heures is None else repos_minimum_heures
+        self.repos = int(round(heures * 60))
+        self.debuts: Dict[str, List[int]] = {}
+        self.gardes: Dict[str, List[Tuple[int, int, Any]]] = {}
+        self.duree_max = 0
+    
+    def ajouter(self, user_id: str, debut: int, fin: int, valeur: Any = None):
+        debuts = self.debuts.setdefault(user_id, [])
+        position = bisect.bisect_right(debuts, debut)
+        debuts.insert(position, debut)
+        self.gardes.setdefault(user_id, []).insert(position, (debut, fin, valeur))
+        self.duree_max = max(self.duree_max, fin - debut)
+    
+    def ajouter_assignation(self, assignation: Dict[str, Any], types_garde_par_id: Dict[str, Dict[str, Any]]):
+        type_garde = types_garde_par_id.get(assignation["type_garde_id"])
+        if type_garde:
+            self.ajouter(assignation["user_id"], *intervalle_garde(assignation["date"], type_garde), assignation)
+    
+    def conflit(self, user_id: str, debut: int, fin: int) -> Optional[Tuple[int, int, Any]]:
+        """Première garde de l'employé qui chevauche [debut, fin[ ou s'en trouve à moins du repos minimum"""
+        debuts = self.debuts.get(user_id)
+        if not debuts:
+            return None
+        gardes = self.gardes[user_id]
+        premier = bisect.bisect_right(debuts, debut - self.repos - self.duree_max)
+        dernier = bisect.bisect_left(debuts, fin + self.repos)
+        for j in range(premier, dernier):
+            garde = gardes[j]
+            if garde[1] + self.repos > debut:
+                return garde
+        return None
+
+async def charger_index_intervalles(
+    date_debut: str,
+    date_fin: str,
+    user_ids: Optional[List[str]] = None
+) -> IndexIntervalles:
+    """Gardes pouvant entrer en conflit avec la période (marge de repos incluse), en deux requêtes"""
+    marge = timedelta(days=marge_intervalles_jours())
+    filtre: Dict[str, Any] = {"date": {
+        "$gte": (datetime.strptime(date_debut, "%Y-%m-%d") - marge).strftime("%Y-%m-%d"),
+        "$lte": (datetime.strptime(date_fin, "%Y-%m-%d") + marge).strftime("%Y-%m-%d")
+    }}
+    if user_ids is not None:
+        filtre["user_id"] = {"$in": user_ids}
+    assignations = await db.assignations.find(
+        filtre, {"_id": 0, "id": 1, "user_id": 1, "type_garde_id": 1, "date": 1}
+    ).to_list(None)
+    types_garde = await db.types_garde.find(
+        {"id": {"$in": list({a["type_garde_id"] for a in assignations})}},
+        {"_id": 0, "id": 1, "nom": 1, "heure_debut": 1, "heure_fin": 1}
+    ).to_list(None)
+    
+    index = IndexIntervalles()
+    types_garde_par_id = {t["id"]: t for t in types_garde}
+    for assignation in assignations:
+        assignation["type_garde_nom"] = types_garde_par_id.get(assignation["type_garde_id"], {}).get("nom")
+        index.ajouter_assignation(assignation, types_garde_par_id)
+    return index
+
+def message_chevauchement(garde: Tuple[int, int, Any]) -> str:
+    assignation = garde[2] or {}
+    detail = f"la garde « {assignation.get('type_garde_nom') or assignation.get('type_garde_id')} » du {assignation.get('date')}"
+    if REPOS_MINIMUM_HEURES:
+        return f"Chevauchement ou repos minimum ({REPOS_MINIMUM_HEURES:g} h) non respecté avec {detail}"
+    return f"Chevauchement avec {detail}"
+
+# ==================== CONTEXTE D'ATTRIBUTION ====================
+
+class ContexteSemaine:
+    """
+    Données d'une semaine de planning chargées une seule fois en mémoire pour
+    l'attribution automatique, indexées pour des recherches en O(1) :
+    - disponibilités : (user_id, date) -> ids des types de garde (None = tous)
+    - assignations : (date, user_id) et (date, type_garde_id) -> assignations
+    - intervalles : gardes par employé (semaine et jours voisins) pour les conflits d'horaires
+    - heures_mensuelles : user_id -> heures du mois courant (registre heures_mensuelles)
+    """
+    def __init__(
+        self,
+        semaine_debut: str,
+        semaine_fin: str,
+        users: List[Dict[str, Any]],
+        types_garde: List[Dict[str, Any]],
+        disponibilites: List[Dict[str, Any]],
+        assignations: List[Dict[str, Any]],
+        heures_mensuelles: Dict[str, int],
+        assignations_voisines: List[Dict[str, Any]] = ()
+    ):
+        """assignations_voisines : gardes des jours autour de la semaine (conflits d'horaires seulement)"""
+        self.semaine_debut = semaine_debut
+        self.semaine_fin = semaine_fin
+        self.users = users
+        self.types_garde = types_garde
+        self.types_garde_par_id = {t["id"]: t for t in types_garde}
+        self.users_par_id = {u["id"]: u for u in users}
+        self.heures_mensuelles = heures_mensuelles
+        
+        self.disponibilites: Dict[tuple, set] = {}
+        for dispo in disponibilites:
+            self.disponibilites.setdefault((dispo["user_id"], dispo["date"]), set()).add(dispo.get("type_garde_id"))
+        
+        self.assignations: List[Dict[str, Any]] = []
+        self.assignations_par_date_user: Dict[tuple, List[Dict[str, Any]]] = {}
+        self.assignations_par_date_type: Dict[tuple, List[Dict[str, Any]]] = {}
+        self.intervalles = IndexIntervalles()
+        for assignation in assignations:
+            self.ajouter_assignation(assignation)
+        for assignation in assignations_voisines:
+            self.intervalles.ajouter_assignation(assignation, self.types_garde_par_id)
+    
+    def jours(self):
+        """Itère sur les 7 jours de la semaine : (date_str, nom du jour en anglais)"""
+        debut = datetime.strptime(self.semaine_debut, "%Y-%m-%d")
+        for day_offset in range(7):
+            current_date = debut + timedelta(days=day_offset)
+            yield current_date.strftime("%Y-%m-%d"), current_date.strftime("%A").lower()
+    
+    def types_disponibles(self, user_id: str, date: str) -> set:
+        """Types de garde pour lesquels l'utilisateur est disponible ce jour (None = tous)"""
+        return self.disponibilites.get((user_id, date), set())
+    
+    def est_disponible(self, user_id: str, date: str, type_garde_id: str) -> bool:
+        types = self.types_disponibles(user_id, date)
+        return type_garde_id in types or None in types
+    
+    def assignations_jour(self, date: str, user_id: str) -> List[Dict[str, Any]]:
+        return self.assignations_par_date_user.get((date, user_id), [])
+    
+    def assignations_creneau(self, date: str, type_garde_id: str) -> List[Dict[str, Any]]:
+        return self.assignations_par_date_type.get((date, type_garde_id), [])
+    
+    def ajouter_assignation(self, assignation: Dict[str, Any]):
+        self.assignations.append(assignation)
+        self.assignations_par_date_user.setdefault((assignation["date"], assignation["user_id"]), []).append(assignation)
+        self.assignations_par_date_type.setdefault((assignation["date"], assignation["type_garde_id"]), []).append(assignation)
+        self.intervalles.ajouter_assignation(assignation, self.types_garde_par_id)
+    
+    def en_conflit(self, user_id: str, date: str, type_garde: Dict[str, Any]) -> bool:
+        """La garde chevauche-t-elle une garde de l'employé (ou empiète-t-elle sur son repos) ?"""
+        return self.intervalles.conflit(user_id, *intervalle_garde(date, type_garde)) is not None
+
+async def charger_contexte_semaine(semaine_debut: str) -> ContexteSemaine:
+    """Charge en un nombre constant de requêtes tout ce dont l'attribution a besoin"""
+    semaine_fin = (datetime.strptime(semaine_debut, "%Y-%m-%d") + timedelta(days=6)).strftime("%Y-%m-%d")
+    periode_semaine = {"$gte": semaine_debut, "$lte": semaine_fin}
+    
+    marge = timedelta(days=marge_intervalles_jours())
+    
+    users = await db.users.find({"statut": "Actif"}).to_list(None)
+    types_garde = await db.types_garde.find().to_list(None)
+    # Semaine et jours voisins (gardes de nuit, repos minimum) en une requête
+    assignations_periode = await db.assignations.find({"date": {
+        "$gte": (datetime.strptime(semaine_debut, "%Y-%m-%d") - marge).strftime("%Y-%m-%d"),
+        "$lte": (datetime.strptime(semaine_fin, "%Y-%m-%d") + marge).strftime("%Y-%m-%d")
+    }}).to_list(None)
+    assignations = [a for a in assignations_periode if semaine_debut <= a["date"] <= semaine_fin]
+    disponibilites = await db.disponibilites.find(
+        {"date": periode_semaine, "statut": "disponible"},
+        {"_id": 0, "user_id": 1, "date": 1, "type_garde_id": 1}
+    ).to_list(None)
+    # Mois courant pour la rotation équitable (registre des heures, O(utilisateurs))
+    heures_mensuelles = await lire_heures_mensuelles(mois_de(semaine_debut))
+    
+    return ContexteSemaine(
+        semaine_debut,
+        semaine_fin,
+        users,
+        types_garde,
+        disponibilites,
+        assignations,
+        {user_id: total["heures"] for user_id, total in heures_mensuelles.items()},
+        [a for a in assignations_periode if not semaine_debut <= a["date"] <= semaine_fin]
+    )
+
+def calculer_heures_mensuelles(contexte: ContexteSemaine) -> Dict[str, int]:
+    """Heures du mois courant par utilisateur actif (rotation équitable)"""
+    return {user["id"]: contexte.heures_mensuelles.get(user["id"], 0) for user in contexte.users}
+
+def planifier_attribution_demo(contexte: ContexteSemaine) -> List[Dict[str, Any]]:
+    """Mode démo : remplit chaque garde au maximum avec des contraintes assouplies (sans écrire en base)"""
+    nouvelles_assignations = []
+    
+    # MODE DÉMO AGRESSIF - REMPLIR AU MAXIMUM
+    for type_garde in contexte.types_garde:
+        for date_str, day_name in contexte.jours():
+            # Skip if type garde doesn't apply to this day
+            if type_garde.get("jours_application") and day_name not in type_garde["jours_application"]:
+                continue
+            
+            # Compter combien de personnel déjà assigné pour cette garde
+            personnel_deja_assigne = len(contexte.assignations_creneau(date_str, type_garde["id"]))
+            personnel_requis = type_garde.get("personnel_requis", 1)
+            
+            # Assigner jusqu'au maximum requis
+            for i in range(personnel_requis - personnel_deja_assigne):
+                # Trouver utilisateurs disponibles
+                available_users = []
                 
-                # Compter combien de personnel déjà assigné pour cette garde
-                existing_for_garde = [a for a in existing_assignations 
-                                    if a["date"] == date_str and a["type_garde_id"] == type_garde["id"]]
+                for user in contexte.users:
+                    # Skip si une garde de l'employé chevauche celle-ci (éviter conflits)
+                    if contexte.en_conflit(user["id"], date_str, type_garde):
+                        continue
+                    
+                    # Vérifier disponibilités pour ce type de garde précis
+                    if type_garde["id"] in contexte.types_disponibles(user["id"], date_str):
+                        available_users.append(user)
                 
-                personnel_deja_assigne = len(existing_for_garde)
-                personnel_requis = type_garde.get("personnel_requis", 1)
+                if not available_users:
+                    break  # Pas d'utilisateurs disponibles pour ce poste
                 
-                # Assigner jusqu'au maximum requis
-                for i in range(personnel_requis - personnel_deja_assigne):
-                    # Trouver utilisateurs disponibles
-                    available_users = []
-                    
-                    for user in users:
-                        # Skip si déjà assigné cette garde ce jour
-                        if any(a["user_id"] == user["id"] and a["date"] == date_str and a["type_garde_id"] == type_garde["id"] 
-                               for a in existing_assignations):
-                            continue
-                        
-                        # Skip si déjà assigné autre garde ce jour (éviter conflits)
-                        if any(a["user_id"] == user["id"] and a["date"] == date_str 
-                               for a in existing_assignations):
-                            continue
-                        
-                        # Vérifier disponibilités
-                        user_dispos = await db.disponibilites.find({
-                            "user_id": user["id"],
-                            "date": date_str,
-                            "type_garde_id": type_garde["id"],
-                            "statut": "disponible"
-                        }).to_list(10)
-                        
-                        if user_dispos:
-                            available_users.append(user)
-                    
-                    if not available_users:
-                        break  # Pas d'utilisateurs disponibles pour ce poste
+                # MODE DÉMO : ASSOUPLIR CONTRAINTE OFFICIER
+                if type_garde.get("officier_obligatoire", False):
+                    # Chercher officiers d'abord
+                    officers = [u for u in available_users if u["grade"] in ["Capitaine", "Lieutenant", "Directeur"]]
+                    # Sinon pompiers avec fonction supérieur
+                    if not officers:
+                        officers = [u for u in available_users if u.get("fonction_superieur", False)]
+                    # En dernier recours : tous pompiers (MODE DÉMO)
+                    if not officers:
+                        officers = available_users
                     
-                    # MODE DÉMO : ASSOUPLIR CONTRAINTE OFFICIER
-                    if type_garde.get("officier_obligatoire", False):
-                        # Chercher officiers d'abord
-                        officers = [u for u in available_users if u["grade"] in ["Capitaine", "Lieutenant", "Directeur"]]
-                        # Sinon pompiers avec fonction supérieur
-                        if not officers:
-                            officers = [u for u in available_users if u.get("fonction_superieur", False)]
-                        # En dernier recours : tous pompiers (MODE DÉMO)
-                        if not officers:
-                            officers = available_users
-                        
-                        if officers:
-                            selected_user = officers[0]
-                        else:
-                            continue
+                    if officers:
+                        selected_user = officers[0]
                     else:
-                        selected_user = available_users[0]
-                    
-                    # Créer assignation
-                    assignation_obj = Assignation(
-                        user_id=selected_user["id"],
-                        type_garde_id=type_garde["id"],
-                        date=date_str,
-                        assignation_type="auto_demo"
-                    )
-                    
-                    await db.assignations.insert_one(assignation_obj.dict())
-                    nouvelles_assignations.append(assignation_obj.dict())
-                    existing_assignations.append(assignation_obj.dict())
+                        continue
+                else:
+                    selected_user = available_users[0]
+                
+                assignation_obj = Assignation(
+                    user_id=selected_user["id"],
+                    type_garde_id=type_garde["id"],
+                    date=date_str,
+                    assignation_type="auto_demo"
+                )
+                nouvelles_assignations.append(assignation_obj.dict())
+                contexte.ajouter_assignation(assignation_obj.dict())
+    
+    return nouvelles_assignations
+
+# ==================== TABLE DES CANDIDATS ====================
+
+GRADES_OFFICIERS = ["Capitaine", "Lieutenant", "Directeur"]
+
+def _date_embauche(user: Dict[str, Any]) -> datetime:
+    return lire_date_embauche(user.get("date_embauche") or "") or datetime.max
+
+def est_officier(user: Dict[str, Any]) -> bool:
+    """Officier de grade, ou pompier autorisé à agir comme lieutenant (fonction supérieure)"""
+    return user.get("grade") in GRADES_OFFICIERS or bool(user.get("fonction_superieur", False))
+
+class TableCandidats:
+    """
+    Candidats d'une exécution rangés en colonnes NumPy, construite une seule fois et partagée
+    par le solveur d'attribution et la recherche de remplaçants :
+    - heures : heures du mois courant (rotation équitable)
+    - rang_anciennete : 0 = plus ancien (date d'embauche analysée une seule fois)
+    - officier / fonction_superieur : drapeaux de grade
+    - disponibilites : masque de bits par (candidat, type de garde), bit j = j-ième date de la période
+    Les sélections et classements par garde sont des opérations vectorisées sur ces colonnes.
+    """
+    MAX_DATES = 64
+    
+    def __init__(
+        self,
+        users: List[Dict[str, Any]],
+        types_garde: List[Dict[str, Any]],
+        dates: List[str],
+        disponibilites: Dict[tuple, set],
+        heures: Dict[str, int],
+        toujours_disponibles: bool = False
+    ):
+        """
+        disponibilites : (user_id, date) -> ids des types de garde (None = tous), comme ContexteSemaine.
+        toujours_disponibles : les temps plein sont disponibles sur toute la période.
+        """
+        if len(dates) > self.MAX_DATES:
+            raise ValueError(f"Période limitée à {self.MAX_DATES} jours")
+        self.users = users
+        self.ids = [u["id"] for u in users]
+        self.index_users = {user_id: i for i, user_id in enumerate(self.ids)}
+        self.index_types = {t["id"]: k for k, t in enumerate(types_garde)}
+        self.index_dates = {date: j for j, date in enumerate(dates)}
+        
+        nb = len(users)
+        self.heures = np.array([heures.get(user_id, 0) for user_id in self.ids], dtype=np.int64)
+        self.rang_anciennete = np.empty(nb, dtype=np.int64)
+        self.rang_anciennete[sorted(range(nb), key=lambda i: _date_embauche(users[i]))] = np.arange(nb)
+        self.officier = np.array([u.get("grade") in GRADES_OFFICIERS for u in users], dtype=bool)
+        self.fonction_superieur = np.array([bool(u.get("fonction_superieur", False)) for u in users], dtype=bool)
+        self.grades = np.array([u.get("grade", "") for u in users], dtype=object)
+        
+        self.disponibilites = np.zeros((nb, max(1, len(types_garde))), dtype=np.uint64)
+        for (user_id, date), types in disponibilites.items():
+            i = self.index_users.get(user_id)
+            j = self.index_dates.get(date)
+            if i is None or j is None:
+                continue
+            bit = np.uint64(1 << j)
+            if None in types:
+                self.disponibilites[i, :] |= bit
+            else:
+                for type_garde_id in types:
+                    k = self.index_types.get(type_garde_id)
+                    if k is not None:
+                        self.disponibilites[i, k] |= bit
+        if toujours_disponibles:
+            temps_plein = np.array([u.get("type_emploi") != "temps_partiel" for u in users], dtype=bool)
+            self.disponibilites[temps_plein, :] = np.uint64((1 << len(dates)) - 1)
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    @property
+    def peut_etre_officier(self) -> np.ndarray:
+        return self.officier | self.fonction_superieur
+    
+    def disponibles(self, type_garde_id: str, date: str) -> np.ndarray:
+        """Masque des candidats disponibles pour cette garde ce jour"""
+        k = self.index_types.get(type_garde_id)
+        j = self.index_dates.get(date)
+        if k is None or j is None:
+            return np.zeros(len(self), dtype=bool)
+        return ((self.disponibilites[:, k] >> np.uint64(j)) & np.uint64(1)).astype(bool)
+    
+    def classer(self, masque: np.ndarray, heures_supplementaires: Optional[np.ndarray] = None, officiers_d_abord: bool = False) -> np.ndarray:
+        """
+        Indices des candidats du masque, classés : officiers (si demandé) → moins d'heures
+        (heures du mois + heures_supplementaires) → ancienneté.
+        """
+        indices = np.flatnonzero(masque)
+        heures = self.heures[indices]
+        if heures_supplementaires is not None:
+            heures = heures + heures_supplementaires[indices]
+        cles = [self.rang_anciennete[indices], heures]
+        if officiers_d_abord:
+            cles.append(~self.peut_etre_officier[indices])
+        return indices[np.lexsort(cles)]
+    
+    def scores_compatibilite(
+        self,
+        masque: np.ndarray,
+        grade_cible: Optional[str] = None,
+        formations_cibles: Optional[List[str]] = None,
+        officier_requis: bool = False
+    ) -> np.ndarray:
+        """
+        Score de 0 à 100 par candidat (0 hors masque) : grade équivalent (30), compétences
+        communes (30), moins d'heures ce mois (25), ancienneté (15). Un officier est exigé
+        si officier_requis.
+        """
+        nb = len(self)
+        scores = np.zeros(nb, dtype=np.float64)
+        if nb == 0:
+            return scores
+        if grade_cible is not None:
+            scores += 30.0 * (self.grades == grade_cible)
+        if formations_cibles:
+            cibles = set(formations_cibles)
+            communes = np.array([len(cibles.intersection(u.get("formations", []))) for u in self.users], dtype=np.float64)
+            scores += 30.0 * communes / len(cibles)
+        etendue = max(1, int(self.heures.max() - self.heures.min()))
+        scores += 25.0 * (1.0 - (self.heures - self.heures.min()) / etendue)
+        scores += 15.0 * (1.0 - self.rang_anciennete / max(1, nb - 1))
+        if officier_requis:
+            masque = masque & self.peut_etre_officier
+        return np.where(masque, np.round(scores, 1), 0.0)
+
+# ==================== SOLVEUR D'ATTRIBUTION ====================
+
+# Poids du solveur : couvrir un poste prime sur tout, puis le poste officier, puis l'équité
+SOLVEUR_RECOMPENSE_POSTE = 10_000_000
+SOLVEUR_BONUS_OFFICIER = 100_000
+
+class FlotCoutMinimum:
+    """
+    Flot à coût minimum par plus courts chemins successifs (Dijkstra avec potentiels).
+    À chaque phase, tous les chemins de coût réduit nul sont augmentés par DFS avant
+    de relancer Dijkstra. Coûts entiers ; la résolution s'arrête dès que le plus court
+    chemin restant n'a plus un coût strictement négatif (flot de coût minimum, pas
+    nécessairement maximum).
+    """
+    def __init__(self):
+        self.adj: List[List[int]] = []
+        self.dest: List[int] = []
+        self.cap: List[int] = []
+        self.cout: List[int] = []
+    
+    @property
+    def nb_noeuds(self) -> int:
+        return len(self.adj)
+    
+    def ajouter_noeud(self) -> int:
+        self.adj.append([])
+        return len(self.adj) - 1
+    
+    def ajouter_arc(self, u: int, v: int, capacite: int, cout: int) -> int:
+        arc = len(self.dest)
+        self.dest.extend((v, u))
+        self.cap.extend((capacite, 0))
+        self.cout.extend((cout, -cout))
+        self.adj[u].append(arc)
+        self.adj[v].append(arc + 1)
+        return arc
+    
+    def flot(self, arc: int) -> int:
+        return self.cap[arc ^ 1]
+    
+    def resoudre(self, source: int, puits: int, ordre_topologique: List[int]) -> int:
+        """ordre_topologique : ordre des nœuds du graphe initial (acyclique) pour les potentiels"""
+        INF = float("inf")
+        adj, dest, cap, cout = self.adj, self.dest, self.cap, self.cout
+        
+        # Potentiels initiaux : plus courts chemins dans le graphe acyclique (coûts négatifs permis)
+        pot = [INF] * self.nb_noeuds
+        pot[source] = 0
+        for u in ordre_topologique:
+            pu = pot[u]
+            if pu == INF:
+                continue
+            for arc in adj[u]:
+                if cap[arc] > 0 and pu + cout[arc] < pot[dest[arc]]:
+                    pot[dest[arc]] = pu + cout[arc]
+        pot = [p if p != INF else 0 for p in pot]
+        
+        flot_total = 0
+        while True:
+            # Dijkstra sur les coûts réduits, arrêté dès que le puits est atteint
+            dist = [INF] * self.nb_noeuds
+            dist[source] = 0
+            tas = [(0, source)]
+            while tas:
+                d, u = heapq.heappop(tas)
+                if d > dist[u]:
+                    continue
+                if u == puits:
+                    break
+                pu = pot[u]
+                for arc in adj[u]:
+                    if cap[arc] > 0:
+                        v = dest[arc]
+                        nd = d + cout[arc] + pu - pot[v]
+                        if nd < dist[v]:
+                            dist[v] = nd
+                            heapq.heappush(tas, (nd, v))
+            
+            dist_puits = dist[puits]
+            if dist_puits == INF:
+                break
+            for v in range(self.nb_noeuds):
+                pot[v] += dist[v] if dist[v] < dist_puits else dist_puits
+            
+            # Coût réel du plus court chemin : plus rien à gagner
+            if pot[puits] - pot[source] >= 0:
+                break
+            
+            flot_total += self._augmenter_phase(source, puits, pot)
+        
+        return flot_total
+    
+    def _augmenter_phase(self, source: int, puits: int, pot: List[float]) -> int:
+        """Augmente d'une unité tous les chemins admissibles (coût réduit nul) trouvés par DFS"""
+        adj, dest, cap, cout = self.adj, self.dest, self.cap, self.cout
+        courant = [0] * self.nb_noeuds
+        visite = bytearray(self.nb_noeuds)
+        augmentations = 0
+        
+        while True:
+            chemin: List[int] = []
+            u = source
+            visite[source] = 1
+            while u != puits:
+                arcs = adj[u]
+                i = courant[u]
+                pu = pot[u]
+                while i < len(arcs):
+                    arc = arcs[i]
+                    v = dest[arc]
+                    if cap[arc] > 0 and not visite[v] and cout[arc] + pu - pot[v] == 0:
+                        break
+                    i += 1
+                courant[u] = i
+                if i < len(arcs):
+                    arc = arcs[i]
+                    chemin.append(arc)
+                    u = dest[arc]
+                    visite[u] = 1
+                else:
+                    # Impasse : le nœud reste marqué visité pour le reste de la phase
+                    if not chemin:
+                        return augmentations
+                    arc = chemin.pop()
+                    u = dest[arc ^ 1]
+                    courant[u] += 1
+            
+            for arc in chemin:
+                cap[arc] -= 1
+                cap[arc ^ 1] += 1
+                # Les nœuds du chemin redeviennent utilisables pour les chemins suivants
+                visite[dest[arc]] = 0
+            visite[puits] = 0
+            augmentations += 1
+
+def resoudre_attribution(contexte: ContexteSemaine, table: TableCandidats) -> List[Dict[str, Any]]:
+    """
+    Remplit tous les postes requis de la semaine d'un seul coup, formulé en flot à coût minimum :
+    source → utilisateur (arcs parallèles de coût croissant avec les heures mensuelles, d'où
+    l'équité) → utilisateur-bloc (capacité 1 : une garde par bloc de créneaux qui se chevauchent
+    tous, repos minimum inclus) → garde (postes libres) → puits (récompense par poste couvert).
+    Un poste par garde à officier obligatoire est réservé aux officiers. Les heures max par
+    semaine bornent le nombre de gardes ; si des durées hétérogènes font dépasser le plafond,
+    ou si deux gardes de blocs voisins se chevauchent (garde de nuit), les gardes en trop sont
+    retirées et les postes libérés complétés de façon gloutonne.
+    Les candidats sont ceux de la table (heures mensuelles incluses). Ne modifie pas le contexte.
+    """
+    # Postes libres par garde (les assignations existantes, manuelles ou non, sont conservées)
+    creneaux = []
+    for type_garde in contexte.types_garde:
+        for date_str, day_name in contexte.jours():
+            if type_garde.get("jours_application") and day_name not in type_garde["jours_application"]:
+                continue
+            
+            existantes = contexte.assignations_creneau(date_str, type_garde["id"])
+            postes_libres = type_garde.get("personnel_requis", 1) - len(existantes)
+            if postes_libres <= 0:
+                continue
+            
+            officier_requis = type_garde.get("officier_obligatoire", False) and not any(
+                est_officier(u) for u in (contexte.users_par_id.get(a["user_id"]) for a in existantes) if u
+            )
+            creneaux.append({
+                "type_garde": type_garde,
+                "date": date_str,
+                "intervalle": intervalle_garde(date_str, type_garde),
+                "duree": type_garde.get("duree_heures", 8),
+                "postes_libres": postes_libres,
+                "officier_requis": officier_requis
+            })
+    
+    if not creneaux or not len(table):
+        return []
+    
+    # Heures déjà planifiées cette semaine (plafond heures_max_semaine)
+    heures_semaine = np.zeros(len(table), dtype=np.int64)
+    for assignation in contexte.assignations:
+        i = table.index_users.get(assignation["user_id"])
+        type_garde = contexte.types_garde_par_id.get(assignation["type_garde_id"])
+        if i is None or not type_garde:
+            continue
+        heures_semaine[i] += type_garde.get("duree_heures", 8)
+    heures_max = np.array([u.get("heures_max_semaine", 40) for u in table.users], dtype=np.int64)
+    heures_restantes = heures_max - heures_semaine
+    
+    # Candidats déjà pris par une garde existante qui chevauche le créneau (gardes de nuit comprises)
+    intervalles = contexte.intervalles
+    deja_assignes = [(i, user_id) for i, user_id in enumerate(table.ids) if user_id in intervalles.debuts]
+    occupe = []
+    for creneau in creneaux:
+        masque = np.zeros(len(table), dtype=bool)
+        for i, user_id in deja_assignes:
+            masque[i] = intervalles.conflit(user_id, *creneau["intervalle"]) is not None
+        occupe.append(masque)
+    
+    # Blocs : créneaux consécutifs (par début) qui partagent tous un instant, repos compris
+    bloc_de = [0] * len(creneaux)
+    bloc, fin_bloc = -1, None
+    for index in sorted(range(len(creneaux)), key=lambda c: creneaux[c]["intervalle"]):
+        debut, fin = creneaux[index]["intervalle"]
+        if fin_bloc is None or debut >= fin_bloc + intervalles.repos:
+            bloc += 1
+            fin_bloc = fin
+        fin_bloc = min(fin_bloc, fin)
+        bloc_de[index] = bloc
+    
+    # Arcs utilisateur → garde possibles (disponible, sans chevauchement, garde compatible avec les heures restantes)
+    possibles: Dict[int, List[int]] = {}
+    for index, creneau in enumerate(creneaux):
+        masque = table.disponibles(creneau["type_garde"]["id"], creneau["date"])
+        masque &= ~occupe[index]
+        masque &= heures_restantes >= creneau["duree"]
+        for i in np.flatnonzero(masque).tolist():
+            possibles.setdefault(i, []).append(index)
+    
+    duree_moyenne = max(1, round(statistics.mean(c["duree"] for c in creneaux)))
+    
+    # Ancienneté : les plus anciens sont explorés en premier à coût égal
+    candidats = sorted(possibles, key=lambda i: table.rang_anciennete[i])
+    heures_mois = table.heures.tolist()
+    officiers = table.officier.tolist()
+    peut_etre_officier = table.peut_etre_officier.tolist()
+    
+    reseau = FlotCoutMinimum()
+    nouveau_noeud = reseau.ajouter_noeud
+    source = nouveau_noeud()
+    puits = nouveau_noeud()
+    noeuds_users, noeuds_blocs, noeuds_creneaux = [], [], []
+    
+    noeud_general, noeud_officier = [], []
+    for creneau in creneaux:
+        general = nouveau_noeud()
+        officier = nouveau_noeud() if creneau["officier_requis"] else None
+        noeud_general.append(general)
+        noeud_officier.append(officier)
+        noeuds_creneaux.append(general)
+        if officier is not None:
+            noeuds_creneaux.append(officier)
+            reseau.ajouter_arc(officier, puits, 1, -(SOLVEUR_RECOMPENSE_POSTE + SOLVEUR_BONUS_OFFICIER))
+        postes_generaux = creneau["postes_libres"] - (1 if officier is not None else 0)
+        if postes_generaux > 0:
+            reseau.ajouter_arc(general, puits, postes_generaux, -SOLVEUR_RECOMPENSE_POSTE)
+    
+    arcs_affectation = []  # (arc, candidat, index du créneau, poste officier)
+    capacites = {}
+    for u in candidats:
+        indexes = possibles[u]
+        nb_blocs = len({bloc_de[i] for i in indexes})
+        capacite = min(nb_blocs, int(heures_restantes[u]) // max(1, min(creneaux[i]["duree"] for i in indexes)))
+        if capacite <= 0:
+            continue
+        capacites[u] = capacite
+        
+        noeud_user = nouveau_noeud()
+        noeuds_users.append((u, noeud_user))
+        blocs: Dict[int, int] = {}
+        for i in indexes:
+            noeud_bloc = blocs.get(bloc_de[i])
+            if noeud_bloc is None:
+                noeud_bloc = blocs[bloc_de[i]] = nouveau_noeud()
+                noeuds_blocs.append(noeud_bloc)
+                reseau.ajouter_arc(noeud_user, noeud_bloc, 1, 0)
+            arc = reseau.ajouter_arc(noeud_bloc, noeud_general[i], 1, 0)
+            arcs_affectation.append((arc, u, i, False))
+            if peut_etre_officier[u] and noeud_officier[i] is not None:
+                # Les officiers de grade sont préférés aux fonctions supérieures
+                arc = reseau.ajouter_arc(noeud_bloc, noeud_officier[i], 1, 0 if officiers[u] else 1)
+                arcs_affectation.append((arc, u, i, True))
+    
+    # Coût marginal convexe des gardes par utilisateur : équilibre les heures mensuelles
+    for k in range(max(capacites.values(), default=0)):
+        for u, noeud_user in noeuds_users:
+            if k < capacites[u]:
+                reseau.ajouter_arc(source, noeud_user, 1, heures_mois[u] + k * duree_moyenne)
+    
+    ordre = [source] + [n for _, n in noeuds_users] + noeuds_blocs + noeuds_creneaux + [puits]
+    reseau.resoudre(source, puits, ordre)
+    
+    affectations = [(u, i, poste_officier) for arc, u, i, poste_officier in arcs_affectation if reseau.flot(arc) > 0]
+    
+    # Durées hétérogènes : la capacité (en gardes) peut dépasser le plafond d'heures, et deux
+    # blocs voisins peuvent se chevaucher. On retire les gardes les plus longues en cause...
+    affectations.sort(key=lambda a: creneaux[a[1]]["duree"])
+    heures_plan = heures_semaine.copy()
+    plan = IndexIntervalles(intervalles.repos / 60)
+    postes_pris = [0] * len(creneaux)
+    officier_pris = [False] * len(creneaux)
+    retenues = []
+    for u, i, poste_officier in affectations:
+        if heures_plan[u] + creneaux[i]["duree"] > heures_max[u]:
+            continue
+        if plan.conflit(table.ids[u], *creneaux[i]["intervalle"]):
+            continue
+        heures_plan[u] += creneaux[i]["duree"]
+        plan.ajouter(table.ids[u], *creneaux[i]["intervalle"])
+        postes_pris[i] += 1
+        officier_pris[i] = officier_pris[i] or poste_officier
+        retenues.append((u, i))
+    
+    # ...puis les postes ainsi libérés sont complétés de façon gloutonne (moins d'heures d'abord)
+    if len(retenues) < len(affectations):
+        for i, creneau in enumerate(creneaux):
+            if postes_pris[i] >= creneau["postes_libres"]:
+                continue
+            masque = table.disponibles(creneau["type_garde"]["id"], creneau["date"])
+            masque &= ~occupe[i]
+            masque &= heures_max - heures_plan >= creneau["duree"]
+            # Le registre du mois (table.heures) compte déjà les gardes existantes de la semaine
+            for u in table.classer(masque, heures_plan - heures_semaine).tolist():
+                if postes_pris[i] >= creneau["postes_libres"]:
+                    break
+                poste_officier = creneau["officier_requis"] and not officier_pris[i]
+                if poste_officier and postes_pris[i] == creneau["postes_libres"] - 1 and not peut_etre_officier[u]:
+                    continue
+                if plan.conflit(table.ids[u], *creneau["intervalle"]):
+                    continue
+                heures_plan[u] += creneau["duree"]
+                plan.ajouter(table.ids[u], *creneau["intervalle"])
+                postes_pris[i] += 1
+                officier_pris[i] = officier_pris[i] or (poste_officier and peut_etre_officier[u])
+                retenues.append((u, i))
+    
+    retenues.sort(key=lambda a: (creneaux[a[1]]["date"], creneaux[a[1]]["type_garde"].get("heure_debut", ""), creneaux[a[1]]["type_garde"]["id"]))
+    return [
+        Assignation(
+            user_id=table.ids[u],
+            type_garde_id=creneaux[i]["type_garde"]["id"],
+            date=creneaux[i]["date"],
+            assignation_type="auto"
+        ).dict()
+        for u, i in retenues
+    ]
+
+def planifier_attribution(contexte: ContexteSemaine, user_monthly_hours: Dict[str, int]) -> List[Dict[str, Any]]:
+    """
+    Attribution intelligente calculée en mémoire, sans écrire en base : manuel → disponibilités
+    → officiers → heures max → rotation équitable → ancienneté, résolue globalement pour la
+    semaine (les temps plein gardent leur planning fixe manuel).
+    user_monthly_hours est mis à jour avec les heures des gardes proposées.
+    """
+    candidats = [u for u in contexte.users if u["type_emploi"] == "temps_partiel"]
+    table = TableCandidats(
+        candidats,
+        contexte.types_garde,
+        [date_str for date_str, _ in contexte.jours()],
+        contexte.disponibilites,
+        user_monthly_hours
+    )
+    nouvelles_assignations = resoudre_attribution(contexte, table)
+    
+    for assignation in nouvelles_assignations:
+        contexte.ajouter_assignation(assignation)
+        type_garde = contexte.types_garde_par_id[assignation["type_garde_id"]]
+        user_monthly_hours[assignation["user_id"]] += type_garde.get("duree_heures", 8)
+    
+    return nouvelles_assignations
+
+def calculer_metriques_plan(
+    contexte: ContexteSemaine,
+    nouvelles_assignations: List[Dict[str, Any]],
+    user_monthly_hours: Dict[str, int],
+    user_ids_equite: List[str]
+) -> Dict[str, Any]:
+    """Plan détaillé, couverture de la semaine et équité des heures mensuelles après le plan"""
+    users_par_id = {u["id"]: u for u in contexte.users}
+    
+    plan = []
+    for assignation in nouvelles_assignations:
+        user = users_par_id.get(assignation["user_id"], {})
+        type_garde = contexte.types_garde_par_id.get(assignation["type_garde_id"], {})
+        plan.append({
+            "user_id": assignation["user_id"],
+            "nom": f"{user.get('prenom', '')} {user.get('nom', '')}".strip(),
+            "grade": user.get("grade"),
+            "type_garde_id": assignation["type_garde_id"],
+            "type_garde_nom": type_garde.get("nom"),
+            "date": assignation["date"]
+        })
+    
+    # Couverture : personnel assigné (plafonné au requis) / personnel requis
+    total_requis = 0
+    total_assigne = 0
+    creneaux_incomplets = []
+    for type_garde in contexte.types_garde:
+        for date_str, day_name in contexte.jours():
+            jours_app = type_garde.get("jours_application", [])
+            if jours_app and day_name not in jours_app:
+                continue
+            
+            personnel_requis = type_garde.get("personnel_requis", 1)
+            assigne = len(contexte.assignations_creneau(date_str, type_garde["id"]))
+            total_requis += personnel_requis
+            total_assigne += min(assigne, personnel_requis)
+            if assigne < personnel_requis:
+                creneaux_incomplets.append({
+                    "date": date_str,
+                    "type_garde_id": type_garde["id"],
+                    "type_garde_nom": type_garde.get("nom"),
+                    "personnel_requis": personnel_requis,
+                    "personnel_assigne": assigne
+                })
+    
+    taux_couverture = (total_assigne / total_requis * 100) if total_requis > 0 else 0
+    
+    # Équité : dispersion des heures mensuelles du personnel concerné
+    heures = [user_monthly_hours.get(user_id, 0) for user_id in user_ids_equite]
+    equite = {
+        "personnel_concerne": len(heures),
+        "heures_min": min(heures) if heures else 0,
+        "heures_max": max(heures) if heures else 0,
+        "ecart_heures": (max(heures) - min(heures)) if heures else 0,
+        "heures_moyennes": round(statistics.mean(heures), 1) if heures else 0,
+        "ecart_type_heures": round(statistics.pstdev(heures), 2) if heures else 0
+    }
+    
+    return {
+        "plan": plan,
+        "couverture": {
+            "personnel_requis": total_requis,
+            "personnel_assigne": total_assigne,
+            "taux_couverture": round(min(taux_couverture, 100.0), 1),
+            "creneaux_incomplets": creneaux_incomplets
+        },
+        "equite": equite
+    }
+
+def calculer_plan_semaine(contexte: ContexteSemaine) -> Dict[str, Any]:
+    """
+    Plan d'attribution d'une semaine et ses métriques, sans accès à la base : exécutable
+    dans le pool de processus (le contexte est copié, le résultat contient tout le nécessaire).
+    """
+    user_monthly_hours = calculer_heures_mensuelles(contexte)
+    nouvelles_assignations = planifier_attribution(contexte, user_monthly_hours)
+    metriques = calculer_metriques_plan(
+        contexte,
+        nouvelles_assignations,
+        user_monthly_hours,
+        [u["id"] for u in contexte.users if u["type_emploi"] == "temps_partiel"]
+    )
+    return {"assignations": nouvelles_assignations, **metriques}
+
+async def enregistrer_plan(nouvelles_assignations: List[Dict[str, Any]], run_id: str) -> List[Dict[str, Any]]:
+    """
+    Écrit un plan d'attribution en un seul aller-retour, chaque assignation étiquetée par run_id ;
+    retourne les assignations insérées (sans les doublons déjà présents en base)
+    """
+    for assignation in nouvelles_assignations:
+        assignation["run_id"] = run_id
+    return await inserer_assignations(nouvelles_assignations)
+
+# Mode démo spécial - Attribution automatique agressive pour impression client
+@api_router.post("/planning/attribution-auto-demo")
+async def attribution_automatique_demo(
+    semaine_debut: str,
+    dry_run: bool = False,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role not in ["admin", "superviseur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    return await executer_idempotent(
+        idempotency_key, current_user, "planning/attribution-auto-demo", {"semaine_debut": semaine_debut, "dry_run": dry_run},
+        lambda: _attribution_automatique_demo(semaine_debut, dry_run)
+    )
+
+async def _attribution_automatique_demo(semaine_debut: str, dry_run: bool):
+    try:
+        # Bail de la semaine : lecture, calcul et écriture sans autre attribution intercalée
+        async with nullcontext() if dry_run else bail_planning(semaine_debut, fin_de_semaine(semaine_debut)) as bail:
+            # Charger la semaine (utilisateurs, types de garde, assignations, disponibilités)
+            contexte = await charger_contexte_semaine(semaine_debut)
+            semaine_fin = contexte.semaine_fin
+            
+            nouvelles_assignations = planifier_attribution_demo(contexte)
+            
+            user_monthly_hours = calculer_heures_mensuelles(contexte)
+            for assignation in nouvelles_assignations:
+                type_garde = contexte.types_garde_par_id.get(assignation["type_garde_id"], {})
+                user_monthly_hours[assignation["user_id"]] += type_garde.get("duree_heures", 8)
+            metriques = calculer_metriques_plan(
+                contexte,
+                nouvelles_assignations,
+                user_monthly_hours,
+                [u["id"] for u in contexte.users]
+            )
+            
+            # Mode prévisualisation : rien n'est écrit en base
+            run_id = None
+            assignations_creees = 0
+            if not dry_run:
+                await bail.confirmer()
+                run_id = str(uuid.uuid4())
+                assignations_creees = len(await enregistrer_plan(nouvelles_assignations, run_id))
         
         return {
-            "message": "Attribution DÉMO agressive effectuée avec succès",
-            "assignations_creees": len(nouvelles_assignations),
+            "message": "Prévisualisation de l'attribution DÉMO" if dry_run else "Attribution DÉMO agressive effectuée avec succès",
+            "dry_run": dry_run,
+            "run_id": run_id,
+            "assignations_creees": assignations_creees,
+            "assignations_proposees": len(nouvelles_assignations),
             "algorithme": "Mode démo : Contraintes assouplies pour impression maximum",
-            "semaine": f"{semaine_debut} - {semaine_fin}"
+            "semaine": f"{semaine_debut} - {semaine_fin}",
+            **metriques
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur attribution démo: {str(e)}")
 
 # Attribution automatique intelligente avec rotation équitable et ancienneté
 @api_router.post("/planning/attribution-auto")
-async def attribution_automatique(semaine_debut: str, current_user: User = Depends(get_current_user)):
+async def attribution_automatique(
+    semaine_debut: str,
+    dry_run: bool = False,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user)
+):
     if current_user.role not in ["admin", "superviseur"]:
         raise HTTPException(status_code=403, detail="Accès refusé")
     
+    return await executer_idempotent(
+        idempotency_key, current_user, "planning/attribution-auto", {"semaine_debut": semaine_debut, "dry_run": dry_run},
+        lambda: _attribution_automatique(semaine_debut, dry_run)
+    )
+
+async def _attribution_automatique(semaine_debut: str, dry_run: bool):
     try:
-        # Get all available users and types de garde
-        users = await db.users.find({"statut": "Actif"}).to_list(1000)
-        types_garde = await db.types_garde.find().to_list(1000)
-        
-        # Get existing assignations for the week
-        semaine_fin = (datetime.strptime(semaine_debut, "%Y-%m-%d") + timedelta(days=6)).strftime("%Y-%m-%d")
-        existing_assignations = await db.assignations.find({
-            "date": {
-                "$gte": semaine_debut,
-                "$lte": semaine_fin
-            }
-        }).to_list(1000)
-        
-        # Get monthly statistics for rotation équitable (current month)
-        current_month_start = datetime.strptime(semaine_debut, "%Y-%m-%d").replace(day=1).strftime("%Y-%m-%d")
-        current_month_end = (datetime.strptime(current_month_start, "%Y-%m-%d") + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-        current_month_end = current_month_end.strftime("%Y-%m-%d")
-        
-        monthly_assignations = await db.assignations.find({
-            "date": {
-                "$gte": current_month_start,
-                "$lte": current_month_end
-            }
-        }).to_list(1000)
-        
-        # Calculate monthly hours for each user
-        user_monthly_hours = {}
-        for user in users:
-            user_hours = 0
-            for assignation in monthly_assignations:
-                if assignation["user_id"] == user["id"]:
-                    # Find type garde to get duration
-                    type_garde = next((t for t in types_garde if t["id"] == assignation["type_garde_id"]), None)
-                    if type_garde:
-                        user_hours += type_garde.get("duree_heures", 8)
-            user_monthly_hours[user["id"]] = user_hours
-        
-        # Attribution automatique logic (5 niveaux de priorité)
-        nouvelles_assignations = []
-        
-        for type_garde in types_garde:
-            # Check each day for this type de garde
-            for day_offset in range(7):
-                current_date = datetime.strptime(semaine_debut, "%Y-%m-%d") + timedelta(days=day_offset)
-                date_str = current_date.strftime("%Y-%m-%d")
-                day_name = current_date.strftime("%A").lower()
-                
-                # Skip if type garde doesn't apply to this day
-                if type_garde.get("jours_application") and day_name not in type_garde["jours_application"]:
-                    continue
-                
-                # ÉTAPE 1: Check if already assigned manually
-                existing = next((a for a in existing_assignations 
-                               if a["date"] == date_str and a["type_garde_id"] == type_garde["id"]), None)
-                if existing and existing.get("assignation_type") == "manuel":
-                    continue  # Respecter les assignations manuelles
-                
-                # Find available users for this slot
-                available_users = []
-                for user in users:
-                    # ÉTAPE 2: Check if user has availability (for part-time employees)
-                    if user["type_emploi"] == "temps_partiel":
-                        # Get user disponibilités
-                        user_dispos = await db.disponibilites.find({
-                            "user_id": user["id"],
-                            "date": date_str,
-                            "statut": "disponible"
-                        }).to_list(10)
-                        
-                        if not user_dispos:
-                            continue  # Skip if not available
-                    else:
-                        # Skip temps plein (planning fixe manuel)
-                        continue
-                    
-                    # Check if user already assigned on this date
-                    already_assigned = next((a for a in existing_assignations 
-                                           if a["date"] == date_str and a["user_id"] == user["id"]), None)
-                    if already_assigned:
-                        continue
-                    
-                    available_users.append(user)
-                
-                if not available_users:
-                    continue
-                
-                # ÉTAPE 3: Apply grade requirements (1 officier obligatoire si configuré)
-                if type_garde.get("officier_obligatoire", False):
-                    # Filter officers (Capitaine, Lieutenant, Directeur)
-                    officers = [u for u in available_users if u["grade"] in ["Capitaine", "Lieutenant", "Directeur"]]
-                    if officers:
-                        available_users = officers
-                
-                # ÉTAPE 4: Rotation équitable - sort by monthly hours (ascending)
-                available_users.sort(key=lambda u: user_monthly_hours.get(u["id"], 0))
-                
-                # ÉTAPE 5: Ancienneté - among users with same hours, prioritize by ancienneté
-                min_hours = user_monthly_hours.get(available_users[0]["id"], 0)
-                users_with_min_hours = [u for u in available_users if user_monthly_hours.get(u["id"], 0) == min_hours]
-                
-                if len(users_with_min_hours) > 1:
-                    # Sort by ancienneté (date_embauche) - oldest first
-                    users_with_min_hours.sort(key=lambda u: datetime.strptime(u["date_embauche"], "%d/%m/%Y"))
-                
-                # Select the best candidate
-                selected_user = users_with_min_hours[0]
-                
-                assignation_obj = Assignation(
-                    user_id=selected_user["id"],
-                    type_garde_id=type_garde["id"],
-                    date=date_str,
-                    assignation_type="auto"
-                )
-                
-                await db.assignations.insert_one(assignation_obj.dict())
-                nouvelles_assignations.append(assignation_obj.dict())
-                existing_assignations.append(assignation_obj.dict())
-                
-                # Update monthly hours for next iteration
-                user_monthly_hours[selected_user["id"]] += type_garde.get("duree_heures", 8)
+        # Bail de la semaine : lecture, calcul et écriture sans autre attribution intercalée
+        async with nullcontext() if dry_run else bail_planning(semaine_debut, fin_de_semaine(semaine_debut)) as bail:
+            # Charger la semaine en un nombre constant de requêtes
+            contexte = await charger_contexte_semaine(semaine_debut)
+            semaine_fin = contexte.semaine_fin
+            
+            # Calculer le plan entièrement en mémoire
+            metriques = calculer_plan_semaine(contexte)
+            nouvelles_assignations = metriques.pop("assignations")
+            
+            # Mode prévisualisation : rien n'est écrit en base
+            run_id = None
+            assignations_creees = 0
+            if not dry_run:
+                await bail.confirmer()
+                run_id = str(uuid.uuid4())
+                assignations_creees = len(await enregistrer_plan(nouvelles_assignations, run_id))
         
         return {
-            "message": "Attribution automatique intelligente effectuée avec succès",
-            "assignations_creees": len(nouvelles_assignations),
-            "algorithme": "5 niveaux: Manuel → Disponibilités → Grades → Rotation équitable → Ancienneté",
-            "semaine": f"{semaine_debut} - {semaine_fin}"
+            "message": "Prévisualisation de l'attribution automatique" if dry_run else "Attribution automatique intelligente effectuée avec succès",
+            "dry_run": dry_run,
+            "run_id": run_id,
+            "assignations_creees": assignations_creees,
+            "assignations_proposees": len(nouvelles_assignations),
+            "algorithme": "Flot à coût minimum: Manuel → Disponibilités → Officiers → Heures max → Rotation équitable → Ancienneté",
+            "semaine": f"{semaine_debut} - {semaine_fin}",
+            **metriques
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de l'attribution automatique: {str(e)}")
 
+# Annuler une exécution d'attribution automatique (retire les assignations qu'elle a créées)
+@api_router.delete("/planning/attribution-auto/{run_id}")
+async def annuler_attribution_automatique(run_id: str, current_user: User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "superviseur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    assignations_supprimees = await supprimer_assignations({"run_id": run_id})
+    if assignations_supprimees == 0:
+        raise HTTPException(status_code=404, detail="Aucune assignation pour cette exécution")
+    
+    return {
+        "message": "Attribution automatique annulée",
+        "run_id": run_id,
+        "assignations_supprimees": assignations_supprimees
+    }
+
+# ==================== TÂCHES D'ATTRIBUTION ====================
+# Attribution automatique sur plusieurs semaines (jusqu'à un trimestre) exécutée hors requête.
+# Collection taches_attribution (progression par semaine), plans dans rapports_attribution.
+# Les semaines sont traitées dans l'ordre, chaque calcul dans le pool de processus : une semaine
+# à cheval sur deux mois alimente le registre des heures du mois suivant, et les conflits de
+# repos en début de semaine se lisent sur la semaine précédente, déjà écrite.
+ATTRIBUTION_MAX_SEMAINES = 14
+ATTRIBUTION_MAX_TENTATIVES = 3
+ATTRIBUTION_INTERVALLE_SECONDES = 30
+ATTRIBUTION_VERROU_SECONDES = 300
+STATUTS_FINAUX_ATTRIBUTION = ["terminee", "terminee_avec_erreurs", "annulee", "echec"]
+
+def semaines_periode(date_debut: str, date_fin: str) -> List[str]:
+    """Débuts des semaines (tous les 7 jours depuis date_debut) couvrant la période"""
+    try:
+        debut = datetime.strptime(date_debut, "%Y-%m-%d")
+        fin = datetime.strptime(date_fin, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates invalides (format AAAA-MM-JJ attendu)")
+    if fin < debut:
+        raise HTTPException(status_code=400, detail="La date de fin précède la date de début")
+    semaines = [(debut + timedelta(weeks=k)).strftime("%Y-%m-%d") for k in range((fin - debut).days // 7 + 1)]
+    if len(semaines) > ATTRIBUTION_MAX_SEMAINES:
+        raise HTTPException(status_code=400, detail=f"La période est limitée à {ATTRIBUTION_MAX_SEMAINES} semaines")
+    return semaines
+
+def vue_tache_attribution(tache: Dict[str, Any]) -> Dict[str, Any]:
+    tache = clean_mongo_doc(dict(tache))
+    tache.pop("verrou_jusqu_a", None)
+    traitees = sum(1 for s in tache["semaines"] if s["statut"] in ("terminee", "echec", "annulee"))
+    tache["progression"] = round(100 * traitees / len(tache["semaines"])) if tache["semaines"] else 100
+    tache["assignations_creees"] = sum(s.get("assignations_creees", 0) for s in tache["semaines"])
+    tache["assignations_proposees"] = sum(s.get("assignations_proposees", 0) for s in tache["semaines"])
+    return tache
+
+def ajouter_heures_proposees(heures_proposees: Dict[str, Dict[str, int]], heures_par_mois: Dict[str, Dict[str, int]]):
+    for mois, heures_par_user in heures_par_mois.items():
+        heures_mois = heures_proposees.setdefault(mois, {})
+        for user_id, heures in heures_par_user.items():
+            heures_mois[user_id] = heures_mois.get(user_id, 0) + heures
+
+class TachesAttribution(WorkerArrierePlan):
+    """
+    Worker des tâches d'attribution (statut en_attente → en_cours → terminee / terminee_avec_erreurs
+    / annulee / echec). Une tâche interrompue reprend aux semaines non terminées ; l'annulation est
+    prise en compte entre deux semaines, les semaines déjà écrites restent (annulables par run_id).
+    """
+    nom = "worker d'attribution"
+    
+    def __init__(self):
+        super().__init__(ATTRIBUTION_INTERVALLE_SECONDES)
+    
+    async def creer(self, semaines: List[str], dry_run: bool, demandeur_id: str) -> Dict[str, Any]:
+        maintenant = datetime.now(timezone.utc)
+        tache = {
+            "id": str(uuid.uuid4()),
+            "run_id": None if dry_run else str(uuid.uuid4()),
+            "date_debut": semaines[0],
+            "date_fin": (datetime.strptime(semaines[-1], "%Y-%m-%d") + timedelta(days=6)).strftime("%Y-%m-%d"),
+            "dry_run": dry_run,
+            "semaines": [
+                {"semaine_debut": semaine, "statut": "en_attente", "assignations_proposees": 0,
+                 "assignations_creees": 0, "taux_couverture": None, "erreur": None}
+                for semaine in semaines
+            ],
+            "statut": "en_attente",
+            "annulation_demandee": False,
+            "tentatives": 0,
+            "derniere_erreur": None,
+            "demandeur_id": demandeur_id,
+            "verrou_jusqu_a": maintenant,
+            "created_at": maintenant,
+            "updated_at": maintenant,
+            "terminee_le": None
+        }
+        await db.taches_attribution.insert_one(tache)
+        self.reveiller()
+        return vue_tache_attribution(tache)
+    
+    async def _reserver(self) -> Optional[Dict[str, Any]]:
+        maintenant = datetime.now(timezone.utc)
+        return await db.taches_attribution.find_one_and_update(
+            {"statut": {"$in": ["en_attente", "en_cours"]}, "verrou_jusqu_a": {"$lte": maintenant}},
+            {"$set": {"statut": "en_cours", "verrou_jusqu_a": maintenant + timedelta(seconds=ATTRIBUTION_VERROU_SECONDES)}},
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def _maj_semaine(self, tache_id: str, index: int, champs: Dict[str, Any]):
+        maintenant = datetime.now(timezone.utc)
+        await db.taches_attribution.update_one(
+            {"id": tache_id},
+            {"$set": {
+                **{f"semaines.{index}.{k}": v for k, v in champs.items()},
+                "updated_at": maintenant,
+                "verrou_jusqu_a": maintenant + timedelta(seconds=ATTRIBUTION_VERROU_SECONDES)
+            }}
+        )
+    
+    async def _executer_semaine(
+        self,
+        tache: Dict[str, Any],
+        index: int,
+        heures_proposees: Dict[str, Dict[str, int]],
+        precedentes: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Calcule (et écrit hors prévisualisation) une semaine ; retourne ses assignations. En
+        prévisualisation rien n'est en base : heures proposées par mois et assignations de la
+        semaine précédente sont reportées dans le contexte.
+        """
+        semaine_debut = tache["semaines"][index]["semaine_debut"]
+        await self._maj_semaine(tache["id"], index, {"statut": "en_cours"})
+        
+        # Une autre attribution sur la même semaine : on attend la fin de son bail
+        baux = nullcontext() if tache["dry_run"] else bail_planning(semaine_debut, fin_de_semaine(semaine_debut), attente=BAIL_PLANNING_SECONDES)
+        async with baux as bail:
+            contexte = await charger_contexte_semaine(semaine_debut)
+            for user_id, heures in heures_proposees.get(mois_de(semaine_debut), {}).items():
+                contexte.heures_mensuelles[user_id] = contexte.heures_mensuelles.get(user_id, 0) + heures
+            for assignation in precedentes:
+                contexte.intervalles.ajouter_assignation(assignation, contexte.types_garde_par_id)
+            resultat = await executer_rendu(calculer_plan_semaine, contexte)
+            nouvelles_assignations = resultat.pop("assignations")
+            assignations_creees = 0
+            if not tache["dry_run"]:
+                await bail.confirmer()
+                assignations_creees = len(await enregistrer_plan(nouvelles_assignations, tache["run_id"]))
+        
+        heures_par_user: Dict[str, int] = {}
+        heures_par_mois: Dict[str, Dict[str, int]] = {}
+        for assignation in nouvelles_assignations:
+            duree = contexte.types_garde_par_id[assignation["type_garde_id"]].get("duree_heures", 8)
+            heures_par_user[assignation["user_id"]] = heures_par_user.get(assignation["user_id"], 0) + duree
+            heures_mois = heures_par_mois.setdefault(mois_de(assignation["date"]), {})
+            heures_mois[assignation["user_id"]] = heures_mois.get(assignation["user_id"], 0) + duree
+        if tache["dry_run"]:
+            ajouter_heures_proposees(heures_proposees, heures_par_mois)
+        
+        await db.rapports_attribution.replace_one(
+            {"tache_id": tache["id"], "semaine_debut": semaine_debut},
+            {
+                "tache_id": tache["id"],
+                "semaine_debut": semaine_debut,
+                "semaine_fin": contexte.semaine_fin,
+                "heures_par_user": heures_par_user,
+                "heures_par_mois": heures_par_mois,
+                **resultat
+            },
+            upsert=True
+        )
+        await self._maj_semaine(tache["id"], index, {
+            "statut": "terminee",
+            "assignations_proposees": len(nouvelles_assignations),
+            "assignations_creees": assignations_creees,
+            "taux_couverture": resultat["couverture"]["taux_couverture"]
+        })
+        return nouvelles_assignations
+    
+    async def _executer(self, tache: Dict[str, Any]):
+        heures_proposees: Dict[str, Dict[str, int]] = {}
+        if tache["dry_run"]:
+            # Reprise : heures des semaines déjà prévisualisées, par mois des gardes
+            terminees = [s["semaine_debut"] for s in tache["semaines"] if s["statut"] == "terminee"]
+            if terminees:
+                async for rapport in db.rapports_attribution.find(
+                    {"tache_id": tache["id"], "semaine_debut": {"$in": terminees}},
+                    {"_id": 0, "semaine_debut": 1, "heures_par_user": 1, "heures_par_mois": 1}
+                ):
+                    ajouter_heures_proposees(
+                        heures_proposees,
+                        rapport.get("heures_par_mois") or {mois_de(rapport["semaine_debut"]): rapport["heures_par_user"]}
+                    )
+        
+        precedentes: List[Dict[str, Any]] = []
+        for index, semaine in enumerate(tache["semaines"]):
+            if semaine["statut"] in ("terminee", "annulee"):
+                precedentes = []
+                continue
+            etat = await db.taches_attribution.find_one({"id": tache["id"]}, {"_id": 0, "annulation_demandee": 1})
+            if etat is None or etat["annulation_demandee"]:
+                break
+            try:
+                assignations = await self._executer_semaine(tache, index, heures_proposees, precedentes)
+                precedentes = assignations if tache["dry_run"] else []
+            except Exception as e:
+                logger.error(f"Attribution {tache['id']} semaine {semaine['semaine_debut']}: {str(e)}")
+                await self._maj_semaine(tache["id"], index, {"statut": "echec", "erreur": str(e)})
+                precedentes = []
+        
+        tache = await db.taches_attribution.find_one({"id": tache["id"]})
+        maintenant = datetime.now(timezone.utc)
+        champs: Dict[str, Any] = {"terminee_le": maintenant, "updated_at": maintenant}
+        if tache["annulation_demandee"]:
+            champs["statut"] = "annulee"
+            for index, semaine in enumerate(tache["semaines"]):
+                if semaine["statut"] in ("en_attente", "en_cours"):
+                    champs[f"semaines.{index}.statut"] = "annulee"
+        elif any(s["statut"] == "echec" for s in tache["semaines"]):
+            champs["statut"] = "terminee_avec_erreurs"
+        else:
+            champs["statut"] = "terminee"
+        await db.taches_attribution.update_one({"id": tache["id"]}, {"$set": champs, "$unset": {"verrou_jusqu_a": ""}})
+        logger.info(f"Attribution {tache['id']} ({tache['date_debut']} - {tache['date_fin']}): {champs['statut']}")
+    
+    async def traiter(self) -> int:
+        """Exécute toutes les tâches disponibles ; retourne le nombre de tâches traitées"""
+        traitees = 0
+        while True:
+            tache = await self._reserver()
+            if tache is None:
+                return traitees
+            try:
+                await self._executer(tache)
+            except Exception as e:
+                tentatives = tache.get("tentatives", 0) + 1
+                echec = tentatives >= ATTRIBUTION_MAX_TENTATIVES
+                logger.error(f"Attribution {tache['id']} (tentative {tentatives}): {str(e)}")
+                await db.taches_attribution.update_one(
+                    {"id": tache["id"]},
+                    {"$set": {
+                        "statut": "echec" if echec else "en_attente",
+                        "tentatives": tentatives,
+                        "derniere_erreur": str(e),
+                        "updated_at": datetime.now(timezone.utc),
+                        "verrou_jusqu_a": datetime.now(timezone.utc) + timedelta(seconds=ATTRIBUTION_INTERVALLE_SECONDES)
+                    }}
+                )
+            traitees += 1
+
+taches_attribution = TachesAttribution()
+
+@api_router.post("/taches-attribution", status_code=202)
+async def creer_tache_attribution(
+    date_debut: str,
+    date_fin: str,
+    dry_run: bool = False,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user)
+):
+    """Planifie l'attribution automatique de date_debut à date_fin (une semaine à un trimestre)"""
+    if current_user.role not in ["admin", "superviseur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    semaines = semaines_periode(date_debut, date_fin)
+    return await executer_idempotent(
+        idempotency_key, current_user, "taches-attribution", {"date_debut": date_debut, "date_fin": date_fin, "dry_run": dry_run},
+        lambda: taches_attribution.creer(semaines, dry_run, current_user.id)
+    )
+
+@api_router.get("/taches-attribution")
+async def get_taches_attribution(current_user: User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "superviseur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    taches = await db.taches_attribution.find().sort("created_at", DESCENDING).limit(50).to_list(50)
+    return [vue_tache_attribution(t) for t in taches]
+
+@api_router.get("/taches-attribution/{tache_id}")
+async def get_tache_attribution(tache_id: str, current_user: User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "superviseur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    tache = await db.taches_attribution.find_one({"id": tache_id})
+    if not tache:
+        raise HTTPException(status_code=404, detail="Tâche d'attribution non trouvée")
+    return vue_tache_attribution(tache)
+
+@api_router.get("/taches-attribution/{tache_id}/evenements")
+async def suivre_tache_attribution(tache_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Progression en Server-Sent Events : un événement par changement, puis `fin`"""
+    if current_user.role not in ["admin", "superviseur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    if not await db.taches_attribution.find_one({"id": tache_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Tâche d'attribution non trouvée")
+    
+    async def evenements():
+        derniere_maj = None
+        silence = 0.0
+        while not await request.is_disconnected():
+            tache = await db.taches_attribution.find_one({"id": tache_id})
+            if tache is None:
+                return
+            if tache["updated_at"] != derniere_maj:
+                derniere_maj = tache["updated_at"]
+                silence = 0.0
+                vue = vue_tache_attribution(tache)
+                fin = tache["statut"] in STATUTS_FINAUX_ATTRIBUTION
+                yield f"event: {'fin' if fin else 'progression'}\ndata: {json.dumps(vue, default=str)}\n\n"
+                if fin:
+                    return
+            elif silence >= 15:
+                silence = 0.0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(1)
+            silence += 1
+    
+    return StreamingResponse(
+        evenements(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/taches-attribution/{tache_id}/rapport")
+async def get_rapport_tache_attribution(tache_id: str, current_user: User = Depends(get_current_user)):
+    """Rapport final : plan, couverture et équité de chaque semaine"""
+    if current_user.role not in ["admin", "superviseur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    tache = await db.taches_attribution.find_one({"id": tache_id})
+    if not tache:
+        raise HTTPException(status_code=404, detail="Tâche d'attribution non trouvée")
+    if tache["statut"] not in STATUTS_FINAUX_ATTRIBUTION:
+        raise HTTPException(status_code=409, detail="Attribution en cours, rapport pas encore disponible")
+    
+    rapports = await db.rapports_attribution.find(
+        {"tache_id": tache_id}, {"_id": 0, "tache_id": 0, "heures_par_user": 0, "heures_par_mois": 0}
+    ).sort("semaine_debut", ASCENDING).to_list(None)
+    vue = vue_tache_attribution(tache)
+    requis = sum(r["couverture"]["personnel_requis"] for r in rapports)
+    assigne = sum(r["couverture"]["personnel_assigne"] for r in rapports)
+    return {
+        **vue,
+        "couverture": {
+            "personnel_requis": requis,
+            "personnel_assigne": assigne,
+            "taux_couverture": round(100 * assigne / requis, 1) if requis else 0
+        },
+        "rapports": rapports
+    }
+
+@api_router.post("/taches-attribution/{tache_id}/annuler")
+async def annuler_tache_attribution(tache_id: str, current_user: User = Depends(get_current_user)):
+    """Arrête une attribution en cours après la semaine en train d'être calculée"""
+    if current_user.role not in ["admin", "superviseur"]:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    tache = await db.taches_attribution.find_one_and_update(
+        {"id": tache_id, "statut": {"$in": ["en_attente", "en_cours"]}},
+        {"$set": {"annulation_demandee": True, "updated_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not tache:
+        raise HTTPException(status_code=404, detail="Aucune attribution en cours avec cet identifiant")
+    # Pas encore démarrée : terminée tout de suite par le worker
+    taches_attribution.reveiller()
+    return {"message": "Annulation demandée", "run_id": tache["run_id"]}
+
 # Endpoint pour obtenir les statistiques personnelles mensuelles
 @api_router.get("/users/{user_id}/stats-mensuelles")
 async def get_user_monthly_stats(user_id: str, current_user: User = Depends(get_current_user)):
@@ -1883,32 +5133,11 @@ async def get_user_monthly_stats(user_id: str, current_user: User = Depends(get_
         raise HTTPException(status_code=403, detail="Accès refusé")
     
     try:
-        # Get current month assignations for this user
+        # Current month totals for this user, from the monthly hours ledger
         today = datetime.now(timezone.utc)
-        month_start = today.replace(day=1).strftime("%Y-%m-%d")
-        month_end = (today.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-        month_end = month_end.strftime("%Y-%m-%d")
-        
-        user_assignations = await db.assignations.find({
-            "user_id": user_id,
-            "date": {
-                "$gte": month_start,
-                "$lte": month_end
-            }
-        }).to_list(1000)
-        
-        # Get types garde for calculating hours
-        types_garde = await db.types_garde.find().to_list(1000)
-        types_dict = {t["id"]: t for t in types_garde}
-        
-        # Calculate stats
-        gardes_ce_mois = len(user_assignations)
-        heures_travaillees = 0
-        
-        for assignation in user_assignations:
-            type_garde = types_dict.get(assignation["type_garde_id"])
-            if type_garde:
-                heures_travaillees += type_garde.get("duree_heures", 8)
+        totaux = (await lire_heures_mensuelles(today.strftime("%Y-%m"), user_id)).get(user_id, {})
+        gardes_ce_mois = totaux.get("gardes", 0)
+        heures_travaillees = totaux.get("heures", 0)
         
         # Get user formations count
         user_data = await db.users.find_one({"id": user_id})
@@ -1925,92 +5154,71 @@ async def get_user_monthly_stats(user_id: str, current_user: User = Depends(get_
         raise HTTPException(status_code=500, detail=f"Erreur lors du calcul des statistiques: {str(e)}")
 
 # Statistics routes
+async def calculer_couverture(date_debut: str, date_fin: str, types_garde: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Personnel requis / assigné sur une période : les assignations sont comptées par
+    (date, type de garde) en une seule agrégation $group.
+    """
+    groupes = await db.assignations.aggregate([
+        {"$match": {"date": {"$gte": date_debut, "$lte": date_fin}}},
+        {"$group": {"_id": {"date": "$date", "type_garde_id": "$type_garde_id"}, "nombre": {"$sum": 1}}}
+    ]).to_list(None)
+    assignes = {(g["_id"]["date"], g["_id"]["type_garde_id"]): g["nombre"] for g in groupes}
+    
+    personnel_requis = 0
+    personnel_assigne = 0
+    debut = datetime.strptime(date_debut, "%Y-%m-%d")
+    for day_offset in range((datetime.strptime(date_fin, "%Y-%m-%d") - debut).days + 1):
+        current_day = debut + timedelta(days=day_offset)
+        date_str = current_day.strftime("%Y-%m-%d")
+        day_name = current_day.strftime("%A").lower()
+        for type_garde in types_garde:
+            jours_app = type_garde.get("jours_application", [])
+            if jours_app and day_name not in jours_app:
+                continue
+            requis = type_garde.get("personnel_requis", 1)
+            personnel_requis += requis
+            personnel_assigne += min(assignes.get((date_str, type_garde["id"]), 0), requis)
+    
+    return {"personnel_requis": personnel_requis, "personnel_assigne": personnel_assigne}
+
+async def calculer_statistiques() -> Statistiques:
+    today = datetime.now(timezone.utc).date()
+    start_week = today - timedelta(days=today.weekday())
+    end_week = start_week + timedelta(days=6)
+    semaine = {"$gte": start_week.strftime("%Y-%m-%d"), "$lte": end_week.strftime("%Y-%m-%d")}
+    
+    # Requêtes indépendantes lancées en parallèle
+    personnel_count, gardes_count, formations_count, remplacements_count, heures_mois, types_garde = await asyncio.gather(
+        db.users.count_documents({"statut": "Actif"}),
+        db.assignations.count_documents({"date": semaine}),
+        db.sessions_formation.count_documents({"statut": "planifie"}),
+        db.demandes_remplacement.count_documents({"statut": "approuve"}),
+        lire_heures_mensuelles(today.strftime("%Y-%m")),
+        db.types_garde.find({}, {"_id": 0, "id": 1, "jours_application": 1, "personnel_requis": 1}).to_list(None)
+    )
+    
+    # Taux de couverture : (personnel assigné / personnel requis) × 100, plafonné à 100%
+    couverture = await calculer_couverture(semaine["$gte"], semaine["$lte"], types_garde)
+    taux_couverture = (
+        couverture["personnel_assigne"] / couverture["personnel_requis"] * 100
+        if couverture["personnel_requis"] > 0 else 0
+    )
+    
+    return Statistiques(
+        personnel_actif=personnel_count,
+        gardes_cette_semaine=gardes_count,
+        formations_planifiees=formations_count,
+        taux_couverture=round(min(taux_couverture, 100.0), 1),
+        heures_travaillees=sum(total["heures"] for total in heures_mois.values()),
+        remplacements_effectues=remplacements_count
+    )
+
 @api_router.get("/statistiques", response_model=Statistiques)
 async def get_statistiques(current_user: User = Depends(get_current_user)):
     try:
-        # 1. Personnel actif (100% dynamique)
-        personnel_count = await db.users.count_documents({"statut": "Actif"})
-        
-        # 2. Gardes cette semaine (100% dynamique)
-        today = datetime.now(timezone.utc).date()
-        start_week = today - timedelta(days=today.weekday())
-        end_week = start_week + timedelta(days=6)
-        
-        gardes_count = await db.assignations.count_documents({
-            "date": {
-                "$gte": start_week.strftime("%Y-%m-%d"),
-                "$lte": end_week.strftime("%Y-%m-%d")
-            }
-        })
-        
-        # 3. Formations planifiées (100% dynamique)
-        formations_count = await db.sessions_formation.count_documents({"statut": "planifie"})
-        
-        # 4. Taux de couverture dynamique - CALCUL CORRECT
-        # Calculer le total de personnel requis pour la semaine
-        total_assignations_required = await db.types_garde.find().to_list(1000)
-        total_personnel_requis = 0
-        total_personnel_assigne = 0
-        
-        # Pour chaque jour de la semaine
-        for day_offset in range(7):
-            current_day = start_week + timedelta(days=day_offset)
-            day_name = current_day.strftime("%A").lower()
-            
-            # Pour chaque type de garde
-            for type_garde in total_assignations_required:
-                jours_app = type_garde.get("jours_application", [])
-                
-                # Si ce type de garde s'applique à ce jour
-                if not jours_app or day_name in jours_app:
-                    personnel_requis = type_garde.get("personnel_requis", 1)
-                    total_personnel_requis += personnel_requis
-                    
-                    # Compter combien de personnes sont assignées pour cette garde ce jour
-                    assignations_jour = await db.assignations.count_documents({
-                        "date": current_day.strftime("%Y-%m-%d"),
-                        "type_garde_id": type_garde["id"]
-                    })
-                    
-                    total_personnel_assigne += min(assignations_jour, personnel_requis)
-        
-        # Calcul correct : (personnel assigné / personnel requis) × 100
-        taux_couverture = (total_personnel_assigne / total_personnel_requis * 100) if total_personnel_requis > 0 else 0
-        
-        # Cap à 100% maximum
-        taux_couverture = min(taux_couverture, 100.0)
-        
-        # 5. Heures travaillées ce mois (100% dynamique)
-        start_month = today.replace(day=1)
-        end_month = (start_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-        
-        assignations_mois = await db.assignations.find({
-            "date": {
-                "$gte": start_month.strftime("%Y-%m-%d"),
-                "$lte": end_month.strftime("%Y-%m-%d")
-            }
-        }).to_list(1000)
-        
-        # Calculer les heures basées sur les types de garde
-        heures_totales = 0
-        types_garde_dict = {tg["id"]: tg for tg in total_assignations_required}
-        
-        for assignation in assignations_mois:
-            type_garde = types_garde_dict.get(assignation["type_garde_id"])
-            if type_garde:
-                heures_totales += type_garde.get("duree_heures", 8)
-        
-        # 6. Remplacements effectués (100% dynamique)
-        remplacements_count = await db.demandes_remplacement.count_documents({"statut": "approuve"})
-        
-        return Statistiques(
-            personnel_actif=personnel_count,
-            gardes_cette_semaine=gardes_count,
-            formations_planifiees=formations_count,
-            taux_couverture=round(taux_couverture, 1),
-            heures_travaillees=heures_totales,
-            remplacements_effectues=remplacements_count
-        )
+        # Instantané partagé : un seul calcul pour toutes les requêtes concurrentes
+        return await statistiques_cache.get(datetime.now(timezone.utc).date(), calculer_statistiques)
         
     except Exception as e:
         # Fallback en cas d'erreur
@@ -2032,11 +5240,11 @@ async def reinitialiser_planning(current_user: User = Depends(get_current_user))
     
     try:
         # Supprimer toutes les assignations
-        result = await db.assignations.delete_many({})
+        assignations_supprimees = await supprimer_assignations({})
         
         return {
             "message": "Planning réinitialisé avec succès",
-            "assignations_supprimees": result.deleted_count
+            "assignations_supprimees": assignations_supprimees
         }
         
     except Exception as e:
@@ -2179,8 +5387,10 @@ async def init_demo_data_realiste():
     try:
         # Clear existing data
         await db.users.delete_many({})
+        user_cache.clear()
+        await signaler_modification_referentiel()
         await db.types_garde.delete_many({})
-        await db.assignations.delete_many({})
+        await supprimer_assignations({})
         await db.planning.delete_many({})
         await db.demandes_remplacement.delete_many({})
         await db.formations.delete_many({})
@@ -2290,6 +5500,8 @@ async def init_demo_data_realiste():
                     await db.assignations.insert_one(assignation_obj.dict())
                     assignations_created += 1
         
+        await reconstruire_heures_mensuelles()
+        
         return {"message": f"Données de démonstration réalistes créées : {len(demo_users)} utilisateurs, {len(demo_formations)} formations, {assignations_created} assignations historiques"}
         
     except Exception as e:
@@ -2530,8 +5742,10 @@ async def init_demo_client_data():
     try:
         # Clear existing data
         await db.users.delete_many({})
+        user_cache.clear()
+        await signaler_modification_referentiel()
         await db.types_garde.delete_many({})
-        await db.assignations.delete_many({})
+        await supprimer_assignations({})
         await db.formations.delete_many({})
         await db.sessions_formation.delete_many({})
         await db.disponibilites.delete_many({})
@@ -2774,6 +5988,8 @@ async def init_demo_client_data():
             session_obj = SessionFormation(**session_data)
             await db.sessions_formation.insert_one(session_obj.dict())
         
+        await reconstruire_heures_mensuelles()
+        
         return {
             "message": "Données démo CLIENT créées avec succès",
             "details": {
@@ -2801,8 +6017,10 @@ async def init_demo_client_data():
 async def init_demo_data():
     # Clear existing data
     await db.users.delete_many({})
+    user_cache.clear()
+    await signaler_modification_referentiel()
     await db.types_garde.delete_many({})
-    await db.assignations.delete_many({})
+    await supprimer_assignations({})
     await db.planning.delete_many({})
     await db.demandes_remplacement.delete_many({})
     
@@ -2995,6 +6213,298 @@ async def init_demo_data():
     
     return {"message": "Données de démonstration créées avec succès"}
 
+# ==================== DIFFUSION EN DIRECT ====================
+# Pub/sub en mémoire alimenté par les écritures (notifications, assignations) et relayé aux
+# navigateurs par un flux Server-Sent Events par onglet : les clients n'interrogent plus.
+# Propre au processus : avec plusieurs workers, chaque flux ne voit que les écritures du sien.
+DIFFUSION_FILE_MAX = int(os.environ.get('DIFFUSION_FILE_MAX', '100'))
+DIFFUSION_KEEPALIVE_SECONDES = 15
+DIFFUSION_TICKET_SECONDES = 60
+
+class Diffusion:
+    """Une file bornée par abonné ; un abonné trop lent est vidé et invité à se resynchroniser"""
+    def __init__(self, taille_file: int):
+        self.taille_file = taille_file
+        self.abonnes: Dict[str, Set[asyncio.Queue]] = {}
+        self.publies = 0
+        self.resynchronisations = 0
+    
+    def abonner(self, user_id: str) -> asyncio.Queue:
+        file = asyncio.Queue(maxsize=self.taille_file)
+        self.abonnes.setdefault(user_id, set()).add(file)
+        return file
+    
+    def desabonner(self, user_id: str, file: asyncio.Queue):
+        files = self.abonnes.get(user_id)
+        if files is not None:
+            files.discard(file)
+            if not files:
+                del self.abonnes[user_id]
+    
+    def est_connecte(self, user_id: str) -> bool:
+        return user_id in self.abonnes
+    
+    def publier(self, evenement: str, donnees: Any, user_ids: Optional[List[str]] = None):
+        """Événement pour ces utilisateurs (None = tous les connectés), sans jamais bloquer l'écrivain"""
+        if user_ids is None:
+            files = [file for files in self.abonnes.values() for file in files]
+        else:
+            files = [file for user_id in user_ids for file in self.abonnes.get(user_id, ())]
+        for file in files:
+            try:
+                file.put_nowait((evenement, donnees))
+            except asyncio.QueueFull:
+                while not file.empty():
+                    file.get_nowait()
+                file.put_nowait(("resynchroniser", {}))
+                self.resynchronisations += 1
+            self.publies += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "utilisateurs_connectes": len(self.abonnes),
+            "flux_ouverts": sum(len(files) for files in self.abonnes.values()),
+            "evenements_publies": self.publies,
+            "resynchronisations": self.resynchronisations
+        }
+
+diffusion = Diffusion(DIFFUSION_FILE_MAX)
+
+@api_router.post("/evenements/ticket")
+async def creer_ticket_evenements(current_user: User = Depends(get_current_user)):
+    """
+    Ticket d'ouverture du flux d'événements. EventSource n'envoie pas d'en-têtes : le ticket passe
+    dans l'URL (et donc dans les journaux d'accès) à la place du jeton de session. Il ne vaut que
+    pour /evenements et expire après DIFFUSION_TICKET_SECONDES ; le flux ouvert n'en dépend plus.
+    """
+    ticket = create_access_token(
+        data={"sub": current_user.id, "portee": "evenements"},
+        expires_delta=timedelta(seconds=DIFFUSION_TICKET_SECONDES)
+    )
+    return {"ticket": ticket, "expire_dans": DIFFUSION_TICKET_SECONDES}
+
+@api_router.get("/evenements")
+async def flux_evenements(request: Request, ticket: str):
+    """
+    Flux Server-Sent Events de l'utilisateur : `connecte` (compteur initial, à chaque reconnexion),
+    `notification`, `non_lues`, `planning` (semaines modifiées, null = toutes) et `resynchroniser`.
+    Ouvert avec un ticket de POST /evenements/ticket ; à chaque reconnexion le client en demande un nouveau.
+    """
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Ticket invalide ou expiré")
+    if payload.get("portee") != "evenements" or not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Ticket invalide ou expiré")
+    current_user = await charger_utilisateur(payload["sub"])
+    
+    async def evenements():
+        file = diffusion.abonner(current_user.id)
+        try:
+            yield f"retry: 5000\nevent: connecte\ndata: {json.dumps({'non_lues': await lire_non_lues(current_user.id)})}\n\n"
+            while True:
+                try:
+                    evenement, donnees = await asyncio.wait_for(file.get(), DIFFUSION_KEEPALIVE_SECONDES)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {evenement}\ndata: {json.dumps(donnees, default=str)}\n\n"
+        finally:
+            diffusion.desabonner(current_user.id, file)
+    
+    return StreamingResponse(
+        evenements(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ==================== COMPTEURS DE NOTIFICATIONS ====================
+# Collection compteurs_notifications : un document par utilisateur {user_id, non_lues}, tenu à
+# jour par $inc à chaque création ou lecture de notification. Le badge devient une lecture par
+# clé, servie par un cache mémoire ; une réconciliation périodique corrige les dérives.
+COMPTEURS_CACHE_MAX_SIZE = int(os.environ.get("COMPTEURS_CACHE_MAX_SIZE", "5000"))
+COMPTEURS_CACHE_TTL_SECONDS = float(os.environ.get("COMPTEURS_CACHE_TTL_SECONDS", "30"))
+RECONCILIATION_NOTIFICATIONS_SECONDES = float(os.environ.get("RECONCILIATION_NOTIFICATIONS_SECONDES", "3600"))
+
+class CompteursCache:
+    """
+    Cache LRU borné (avec expiration) de compteurs entiers, indexé par id. Les incréments de ce
+    processus y écrivent directement la valeur retournée par la base ; le TTL borne l'obsolescence
+    quand un autre worker a incrémenté le même compteur.
+    """
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    @property
+    def generation(self) -> int:
+        return self._generation
+    
+    def get(self, cle: str) -> Optional[int]:
+        entry = self._entries.get(cle)
+        if entry is None or entry[1] <= time.monotonic():
+            self._entries.pop(cle, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(cle)
+        self.hits += 1
+        return entry[0]
+    
+    def _stocker(self, cle: str, valeur: int):
+        if self.max_size <= 0:
+            return
+        self._entries[cle] = (valeur, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(cle)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def set(self, cle: str, valeur: int, generation: int):
+        # Un incrément survenu pendant la lecture en base rend la valeur lue obsolète
+        if generation == self._generation:
+            self._stocker(cle, valeur)
+    
+    def ecrire(self, cle: str, valeur: int):
+        """Valeur qui fait autorité (retournée par un incrément atomique)"""
+        self._generation += 1
+        self._stocker(cle, valeur)
+    
+    def invalidate(self, cle: str):
+        self._generation += 1
+        self.invalidations += 1
+        self._entries.pop(cle, None)
+    
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "taille": len(self._entries),
+            "taille_max": self.max_size,
+            "ttl_secondes": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "taux_hit": round(self.hits / total, 4) if total else 0.0
+        }
+
+non_lues_cache = CompteursCache(COMPTEURS_CACHE_MAX_SIZE, COMPTEURS_CACHE_TTL_SECONDS)
+
+async def compter_non_lues(user_id: str) -> int:
+    return await db.notifications.count_documents({"destinataire_id": user_id, "statut": "non_lu"})
+
+async def initialiser_compteur_non_lues(user_id: str) -> Tuple[int, bool]:
+    """
+    Crée le compteur d'un utilisateur qui n'en a pas encore (données antérieures au registre)
+    à partir du nombre réel ; retourne (nombre, créé). Non créé : un autre écrivain l'a devancé.
+    """
+    non_lues = await compter_non_lues(user_id)
+    try:
+        result = await db.compteurs_notifications.update_one(
+            {"user_id": user_id},
+            {"$setOnInsert": {"non_lues": non_lues}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return non_lues, False
+    return non_lues, result.upserted_id is not None
+
+async def incrementer_non_lues(user_id: str, delta: int):
+    """Incrément atomique du compteur ; la nouvelle valeur alimente le cache et les flux connectés"""
+    if not delta:
+        return
+    incrementer = dict(
+        filter={"user_id": user_id},
+        update={"$inc": {"non_lues": delta}},
+        projection={"_id": 0, "non_lues": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    compteur = await db.compteurs_notifications.find_one_and_update(**incrementer)
+    if compteur is None:
+        # Pas de compteur : le recompter, la modification est déjà en base et comptée
+        non_lues, cree = await initialiser_compteur_non_lues(user_id)
+        compteur = {"non_lues": non_lues} if cree else await db.compteurs_notifications.find_one_and_update(**incrementer)
+    non_lues = max(0, compteur["non_lues"])
+    non_lues_cache.ecrire(user_id, non_lues)
+    diffusion.publier("non_lues", {"count": non_lues}, [user_id])
+
+async def lire_non_lues(user_id: str) -> int:
+    """Nombre de notifications non lues : cache mémoire, sinon lecture du compteur par clé"""
+    non_lues = non_lues_cache.get(user_id)
+    if non_lues is not None:
+        return non_lues
+    
+    generation = non_lues_cache.generation
+    compteur = await db.compteurs_notifications.find_one({"user_id": user_id}, {"_id": 0, "non_lues": 1})
+    if compteur is not None:
+        non_lues = max(0, compteur["non_lues"])
+    else:
+        non_lues, _ = await initialiser_compteur_non_lues(user_id)
+    non_lues_cache.set(user_id, non_lues, generation)
+    return non_lues
+
+class ReconciliationNotifications(WorkerArrierePlan):
+    """
+    Recompte les notifications non lues (une agrégation) et corrige les compteurs qui ont dérivé
+    (écriture interrompue entre une notification et son compteur, modification directe en base).
+    Une correction ne s'applique que si le compteur n'a pas bougé pendant le recomptage : un
+    incrément concurrent l'emporte et l'écart éventuel est repris à la passe suivante.
+    """
+    nom = "worker de réconciliation des notifications"
+    
+    def __init__(self):
+        super().__init__(RECONCILIATION_NOTIFICATIONS_SECONDES)
+        self.corrections = 0
+    
+    async def traiter(self) -> int:
+        compteurs = {
+            c["user_id"]: c["non_lues"]
+            for c in await db.compteurs_notifications.find({}, {"_id": 0, "user_id": 1, "non_lues": 1}).to_list(None)
+        }
+        reels = {
+            g["_id"]: g["nombre"]
+            for g in await db.notifications.aggregate([
+                {"$match": {"statut": "non_lu"}},
+                {"$group": {"_id": "$destinataire_id", "nombre": {"$sum": 1}}}
+            ], allowDiskUse=True).to_list(None)
+        }
+        
+        corrections = {}
+        for user_id in compteurs.keys() | reels.keys():
+            reel = reels.get(user_id, 0)
+            if user_id not in compteurs:
+                corrections[user_id] = UpdateOne({"user_id": user_id}, {"$setOnInsert": {"non_lues": reel}}, upsert=True)
+            elif compteurs[user_id] != reel:
+                corrections[user_id] = UpdateOne({"user_id": user_id, "non_lues": compteurs[user_id]}, {"$set": {"non_lues": reel}})
+        if not corrections:
+            return 0
+        
+        try:
+            await db.compteurs_notifications.bulk_write(list(corrections.values()), ordered=False)
+        except BulkWriteError as e:
+            # Compteur créé entre-temps par un incrément : il sera vérifié à la passe suivante
+            if any(erreur.get("code") != 11000 for erreur in e.details.get("writeErrors", [])):
+                raise
+        for user_id in corrections:
+            non_lues_cache.invalidate(user_id)
+        self.corrections += len(corrections)
+        logger.info(f"Compteurs de notifications réconciliés: {len(corrections)} corrigé(s)")
+        return len(corrections)
+
+reconciliation_notifications = ReconciliationNotifications()
+
+@api_router.post("/notifications/compteurs/reconcilier")
+async def reconcilier_compteurs_notifications(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    corrections = await reconciliation_notifications.traiter()
+    return {"message": "Compteurs de notifications réconciliés", "corrections": corrections}
+
 # ==================== NOTIFICATIONS ====================
 
 @api_router.get("/notifications", response_model=List[Notification])
@@ -3010,11 +6520,7 @@ async def get_notifications(current_user: User = Depends(get_current_user)):
 @api_router.get("/notifications/non-lues/count")
 async def get_unread_count(current_user: User = Depends(get_current_user)):
     """Compte le nombre de notifications non lues"""
-    count = await db.notifications.count_documents({
-        "destinataire_id": current_user.id,
-        "statut": "non_lu"
-    })
-    return {"count": count}
+    return {"count": await lire_non_lues(current_user.id)}
 
 @api_router.put("/notifications/{notification_id}/marquer-lu")
 async def marquer_notification_lue(notification_id: str, current_user: User = Depends(get_current_user)):
@@ -3027,13 +6533,15 @@ async def marquer_notification_lue(notification_id: str, current_user: User = De
     if not notification:
         raise HTTPException(status_code=404, detail="Notification non trouvée")
     
-    await db.notifications.update_one(
-        {"id": notification_id},
+    # Seule la transition non_lu → lu décrémente le compteur : une double lecture ne compte qu'une fois
+    result = await db.notifications.update_one(
+        {"id": notification_id, "destinataire_id": current_user.id, "statut": "non_lu"},
         {"$set": {
             "statut": "lu",
             "date_lecture": datetime.now(timezone.utc).isoformat()
         }}
     )
+    await incrementer_non_lues(current_user.id, -result.modified_count)
     
     return {"message": "Notification marquée comme lue"}
 
@@ -3050,6 +6558,7 @@ async def marquer_toutes_lues(current_user: User = Depends(get_current_user)):
             "date_lecture": datetime.now(timezone.utc).isoformat()
         }}
     )
+    await incrementer_non_lues(current_user.id, -result.modified_count)
     
     return {"message": f"{result.modified_count} notification(s) marquée(s) comme lue(s)"}
 
@@ -3072,6 +6581,8 @@ async def creer_notification(
         data=data or {}
     )
     await db.notifications.insert_one(notification.dict())
+    diffusion.publier("notification", jsonable_encoder(notification), [destinataire_id])
+    await incrementer_non_lues(destinataire_id, 1)
     return notification
 
 # ==================== PARAMÈTRES REMPLACEMENTS ====================
@@ -3328,6 +6839,212 @@ async def get_epi_alerts(current_user: User = Depends(get_current_user)):
     
     return alerts
 
+# ==================== INDEX MONGODB ====================
+
+# Index requis par les requêtes des endpoints, par collection
+INDEX_UNICITE_ASSIGNATIONS = "user_id_1_date_1_type_garde_id_1"
+
+MONGO_INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("statut", ASCENDING), ("type_emploi", ASCENDING)]),
+        IndexModel([("role", ASCENDING)]),
+        IndexModel([("formations", ASCENDING)]),
+        IndexModel([("nom", ASCENDING), ("prenom", ASCENDING), ("id", ASCENDING)]),
+    ],
+    "types_garde": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "assignations": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("date", ASCENDING), ("type_garde_id", ASCENDING)]),
+        # Une seule assignation par employé, date et type de garde (sert aussi les requêtes user_id + date)
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING), ("type_garde_id", ASCENDING)], unique=True, name=INDEX_UNICITE_ASSIGNATIONS),
+        IndexModel([("type_garde_id", ASCENDING)]),
+        IndexModel([("run_id", ASCENDING)]),
+    ],
+    "disponibilites": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING), ("statut", ASCENDING), ("type_garde_id", ASCENDING)]),
+        IndexModel([("date", ASCENDING)]),
+    ],
+    "notifications": [
+        IndexModel([("id", ASCENDING)]),
+        IndexModel([("destinataire_id", ASCENDING), ("date_creation", DESCENDING)]),
+        IndexModel([("destinataire_id", ASCENDING), ("statut", ASCENDING)]),
+        IndexModel([("statut", ASCENDING), ("destinataire_id", ASCENDING)]),
+    ],
+    "compteurs_notifications": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "epi_employes": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("employe_id", ASCENDING), ("type_epi", ASCENDING)]),
+    ],
+    "formations": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "sessions_formation": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("statut", ASCENDING)]),
+    ],
+    "inscriptions_formation": [
+        IndexModel([("session_id", ASCENDING), ("user_id", ASCENDING)]),
+    ],
+    "demandes_remplacement": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("demandeur_id", ASCENDING)]),
+        IndexModel([("remplacant_id", ASCENDING)]),
+        IndexModel([("statut", ASCENDING)]),
+    ],
+    "demandes_conge": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("demandeur_id", ASCENDING)]),
+    ],
+    "planning": [
+        IndexModel([("semaine_debut", ASCENDING)]),
+    ],
+    "emails_sortants": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("statut", ASCENDING), ("prochaine_tentative", ASCENDING)]),
+        IndexModel([("statut", ASCENDING), ("verrou_jusqu_a", ASCENDING)]),
+        IndexModel([("statut", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("statut", ASCENDING), ("abandonne_le", ASCENDING)]),
+    ],
+    "heures_mensuelles": [
+        IndexModel([("user_id", ASCENDING), ("mois", ASCENDING), ("type_garde_id", ASCENDING)], unique=True),
+        IndexModel([("mois", ASCENDING)]),
+        IndexModel([("type_garde_id", ASCENDING)]),
+    ],
+    "taches_suppression": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("statut", ASCENDING), ("verrou_jusqu_a", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "versions_planning": [
+        IndexModel([("semaine", ASCENDING)], unique=True),
+    ],
+    "baux_planning": [
+        IndexModel([("semaine", ASCENDING)], unique=True),
+    ],
+    "cles_idempotence": [
+        IndexModel([("cle", ASCENDING)], unique=True),
+        IndexModel([("expire_le", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "taches_attribution": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("statut", ASCENDING), ("verrou_jusqu_a", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "rapports_attribution": [
+        IndexModel([("tache_id", ASCENDING), ("semaine_debut", ASCENDING)], unique=True),
+    ],
+}
+
+# Requêtes réelles des endpoints (collection, filtre, tri) vérifiées par explain()
+MONGO_QUERY_PLANS: List[tuple] = [
+    ("users", {"id": "x"}, None),
+    ("users", {"email": "x"}, None),
+    ("users", {"statut": "Actif"}, None),
+    ("users", {"type_emploi": "temps_partiel", "statut": "Actif"}, None),
+    ("users", {"role": {"$in": ["superviseur", "admin"]}}, None),
+    ("users", {"formations": "x"}, None),
+    ("users", {}, USERS_TRI),
+    ("users", {"role": "employe"}, USERS_TRI),
+    ("types_garde", {"id": "x"}, None),
+    ("assignations", {"id": "x"}, None),
+    ("assignations", {"date": {"$gte": "2025-01-06", "$lte": "2025-01-12"}}, None),
+    ("assignations", {"date": "2025-01-06", "type_garde_id": "x"}, None),
+    ("assignations", {"user_id": "x", "date": {"$gte": "2025-01-01", "$lte": "2025-01-31"}}, None),
+    ("assignations", {"user_id": "x", "type_garde_id": "x", "date": "2025-01-06"}, None),
+    ("assignations", {"user_id": "x"}, None),
+    ("assignations", {"type_garde_id": "x"}, None),
+    ("assignations", {"run_id": "x"}, None),
+    ("disponibilites", {"id": "x"}, None),
+    ("disponibilites", {"user_id": "x"}, None),
+    ("disponibilites", {"user_id": "x", "date": "2025-01-06", "statut": "disponible"}, None),
+    ("disponibilites", {"user_id": "x", "date": "2025-01-06", "type_garde_id": "x", "statut": "disponible"}, None),
+    ("disponibilites", {"date": {"$gte": "2025-01-06", "$lte": "2025-01-12"}}, None),
+    ("notifications", {"destinataire_id": "x"}, [("date_creation", DESCENDING)]),
+    ("notifications", {"destinataire_id": "x", "statut": "non_lu"}, None),
+    ("notifications", {"id": "x", "destinataire_id": "x"}, None),
+    ("notifications", {"statut": "non_lu"}, None),
+    ("compteurs_notifications", {"user_id": "x"}, None),
+    ("epi_employes", {"id": "x"}, None),
+    ("epi_employes", {"employe_id": "x"}, None),
+    ("epi_employes", {"employe_id": "x", "type_epi": "casque"}, None),
+    ("formations", {"id": "x"}, None),
+    ("sessions_formation", {"id": "x"}, None),
+    ("sessions_formation", {"statut": "planifie"}, None),
+    ("inscriptions_formation", {"session_id": "x", "user_id": "x"}, None),
+    ("demandes_remplacement", {"id": "x"}, None),
+    ("demandes_remplacement", {"demandeur_id": "x"}, None),
+    ("demandes_remplacement", {"remplacant_id": "x"}, None),
+    ("demandes_remplacement", {"statut": "approuve"}, None),
+    ("demandes_conge", {"id": "x"}, None),
+    ("demandes_conge", {"demandeur_id": "x"}, None),
+    ("planning", {"semaine_debut": "2025-01-06"}, None),
+    ("emails_sortants", {"id": "x"}, None),
+    ("emails_sortants", {"statut": "en_attente", "prochaine_tentative": {"$lte": datetime(2025, 1, 1)}}, [("prochaine_tentative", ASCENDING)]),
+    ("emails_sortants", {"statut": "abandonne"}, [("created_at", DESCENDING)]),
+    ("emails_sortants", {"statut": "abandonne", "abandonne_le": {"$lte": datetime(2025, 1, 1)}}, None),
+    ("taches_suppression", {"statut": {"$in": ["en_attente", "en_cours"]}, "verrou_jusqu_a": {"$lte": datetime(2025, 1, 1)}}, [("created_at", ASCENDING)]),
+    ("taches_suppression", {}, [("created_at", DESCENDING)]),
+    ("baux_planning", {"semaine": "x"}, None),
+    ("versions_planning", {"semaine": {"$in": ["*", "2025-01-06"]}}, None),
+    ("cles_idempotence", {"cle": "x"}, None),
+    ("taches_attribution", {"id": "x"}, None),
+    ("taches_attribution", {"statut": {"$in": ["en_attente", "en_cours"]}, "verrou_jusqu_a": {"$lte": datetime(2025, 1, 1)}}, [("created_at", ASCENDING)]),
+    ("rapports_attribution", {"tache_id": "x"}, [("semaine_debut", ASCENDING)]),
+    ("heures_mensuelles", {"mois": "2025-01"}, None),
+    ("heures_mensuelles", {"mois": "2025-01", "user_id": "x"}, None),
+    ("heures_mensuelles", {"type_garde_id": "x"}, None),
+]
+
+async def ensure_indexes():
+    """
+    Crée les index déclarés dans MONGO_INDEXES (idempotent).
+    Un index en échec (ex: doublons existants pour un index unique) est journalisé
+    sans empêcher le démarrage de l'API.
+    """
+    for collection_name, indexes in MONGO_INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection_name].create_indexes([index])
+            except OperationFailure as e:
+                logger.error(f"Index {collection_name}.{index.document['name']} non créé: {e}")
+
+def _plan_contains_collscan(plan: Any) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_plan_contains_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_plan_contains_collscan(item) for item in plan)
+    return False
+
+async def verify_query_plans() -> List[Dict[str, Any]]:
+    """
+    Exécute explain() sur chaque requête de MONGO_QUERY_PLANS et retourne celles
+    dont le plan gagnant contient un parcours complet de collection (COLLSCAN)
+    """
+    violations = []
+    for collection_name, filtre, tri in MONGO_QUERY_PLANS:
+        cursor = db[collection_name].find(filtre)
+        if tri:
+            cursor = cursor.sort(tri)
+        explanation = await cursor.explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        if _plan_contains_collscan(winning_plan):
+            violations.append({
+                "collection": collection_name,
+                "filtre": filtre,
+                "tri": tri,
+                "plan": winning_plan
+            })
+    return violations
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -3337,8 +7054,12 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Disposition", "X-Next-Cursor", "ETag"],
 )
 
+# Ajouté en dernier : englobe tous les autres middlewares
+app.add_middleware(MiddlewareMetriques)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -3346,6 +7067,62 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_indexes():
+    # Index unique des assignations : retirer d'abord les doublons existants
+    try:
+        if INDEX_UNICITE_ASSIGNATIONS not in await db.assignations.index_information():
+            supprimees = await dedoublonner_assignations()
+            if supprimees:
+                logger.warning(f"{supprimees} assignation(s) en double supprimée(s) avant la création de l'index unique")
+    except Exception as e:
+        logger.error(f"Dédoublonnage des assignations impossible: {str(e)}")
+    
+    await ensure_indexes()
+    
+    # Mode test : échouer au démarrage si une requête connue fait un COLLSCAN
+    if os.environ.get("MONGO_VERIFY_QUERY_PLANS", "false").lower() == "true":
+        violations = await verify_query_plans()
+        for violation in violations:
+            logger.error(f"COLLSCAN sur {violation['collection']} pour le filtre {violation['filtre']}")
+        if violations:
+            raise RuntimeError(f"{len(violations)} requête(s) sans index (COLLSCAN)")
+        logger.info(f"Plans de requêtes vérifiés: {len(MONGO_QUERY_PLANS)} requêtes indexées")
+
+@app.on_event("startup")
+async def startup_heures_mensuelles():
+    # Première mise en service du registre : le construire à partir des assignations existantes
+    try:
+        if not await db.heures_mensuelles.find_one() and await db.assignations.find_one():
+            lignes = await reconstruire_heures_mensuelles()
+            logger.info(f"Registre des heures mensuelles construit: {lignes} lignes")
+    except Exception as e:
+        logger.error(f"Construction du registre des heures mensuelles impossible: {str(e)}")
+
+@app.on_event("startup")
+async def startup_file_emails():
+    file_emails.demarrer()
+
+@app.on_event("startup")
+async def startup_taches_suppression():
+    # Reprend aussi les suppressions interrompues par un arrêt
+    taches_suppression.demarrer()
+
+@app.on_event("startup")
+async def startup_taches_attribution():
+    taches_attribution.demarrer()
+
+@app.on_event("startup")
+async def startup_reconciliation_notifications():
+    # La première passe crée les compteurs des utilisateurs qui ont déjà des notifications
+    reconciliation_notifications.demarrer()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await file_emails.arreter()
+    await reconciliation_notifications.arreter()
+    await taches_suppression.arreter()
+    await taches_attribution.arreter()
+    client.close()
+    if _executeur_rapports is not None:
+        _executeur_rapports.shutdown(wait=False, cancel_futures=True)
\ No newline at end of file
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+ProFireManager Backend Benchmark Suite
+Mesure les performances des algorithmes du backend sur des données synthétiques.
+
+Usage:
+    python backend_benchmark.py solveur [--users 300] [--types 20] [--repetitions 3]
+    python backend_benchmark.py statistiques-avancees [--tailles 1000 10000 100000]
+    python backend_benchmark.py peupler [--users 1000] [--types 12] [--semaines 4]
+    python backend_benchmark.py suite [--tailles 100 1000 10000] [--sortie resultats.json] [--comparer ancien.json]
+
+Les benchmarks MongoDB utilisent MONGO_URL / DB_NAME (par défaut la base
+profiremanager_benchmark, vidée à chaque exécution).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "profiremanager_benchmark")
+
+import server  # noqa: E402
+
+JOURS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+GRADES = ["Pompier"] * 8 + ["Lieutenant", "Capitaine"]
+SEMAINE_DEBUT = "2025-01-06"  # Un lundi
+
+def generer_users(nb_users, rng, proportion_temps_partiel=0.8):
+    """Génère des pompiers synthétiques (documents au format de la collection users)"""
+    users = []
+    for i in range(nb_users):
+        grade = rng.choice(GRADES)
+        temps_partiel = rng.random() < proportion_temps_partiel
+        users.append({
+            "id": f"user-{i:06d}",
+            "nom": f"Nom{i}",
+            "prenom": f"Prenom{i}",
+            "email": f"pompier{i}@benchmark.local",
+            "telephone": "",
+            "contact_urgence": "",
+            "grade": grade,
+            "fonction_superieur": grade == "Pompier" and rng.random() < 0.15,
+            "type_emploi": "temps_partiel" if temps_partiel else "temps_plein",
+            "heures_max_semaine": rng.choice([20, 24, 28, 32, 36]) if temps_partiel else 40,
+            "role": "employe",
+            "statut": "Actif",
+            "numero_employe": f"BEN{i:06d}",
+            "date_embauche": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2000, 2024)}",
+            "formations": [],
+            "mot_de_passe_hash": "",
+        })
+    return users
+
+def generer_types_garde(nb_types, rng):
+    """Génère des types de garde synthétiques (jour, soir, nuit, 24h) répartis sur la semaine"""
+    horaires = [("06:00", "18:00", 12), ("18:00", "06:00", 12), ("08:00", "16:00", 8), ("00:00", "23:59", 24)]
+    types_garde = []
+    for i in range(nb_types):
+        heure_debut, heure_fin, duree = rng.choice(horaires)
+        jours = JOURS[:5] if i % 3 == 0 else JOURS[5:] if i % 3 == 1 else JOURS
+        types_garde.append({
+            "id": f"type-{i:04d}",
+            "nom": f"Garde {i}",
+            "heure_debut": heure_debut,
+            "heure_fin": heure_fin,
+            "personnel_requis": rng.randint(1, 4),
+            "duree_heures": duree,
+            "couleur": "#10B981",
+            "jours_application": jours,
+            "officier_obligatoire": rng.random() < 0.5,
+        })
+    return types_garde
+
+def generer_disponibilites(users, types_garde, dates, rng, jours_par_semaine=4):
+    """Disponibilités des temps partiel : quelques jours par semaine, génériques ou par type de garde"""
+    disponibilites = []
+    for user in users:
+        if user["type_emploi"] != "temps_partiel":
+            continue
+        for date in rng.sample(dates, min(jours_par_semaine, len(dates))):
+            if rng.random() < 0.5:
+                types = [None]
+            else:
+                types = [t["id"] for t in rng.sample(types_garde, max(1, len(types_garde) // 3))]
+            for type_garde_id in types:
+                disponibilites.append({
+                    "id": f"dispo-{len(disponibilites):08d}",
+                    "user_id": user["id"],
+                    "date": date,
+                    "type_garde_id": type_garde_id,
+                    "heure_debut": "00:00",
+                    "heure_fin": "23:59",
+                    "statut": "disponible",
+                })
+    return disponibilites
+
+def generer_assignations(users, types_garde, nb_assignations, rng, dates):
+    """Assignations aléatoires réparties sur les dates (au plus une par utilisateur, type et jour)"""
+    assignations = []
+    vues = set()
+    while len(assignations) < nb_assignations:
+        user = rng.choice(users)
+        type_garde = rng.choice(types_garde)
+        date = rng.choice(dates)
+        if (user["id"], type_garde["id"], date) in vues:
+            continue
+        vues.add((user["id"], type_garde["id"], date))
+        assignations.append({
+            "id": f"assign-{len(assignations):08d}",
+            "user_id": user["id"],
+            "type_garde_id": type_garde["id"],
+            "date": date,
+            "statut": "planifie",
+            "assignation_type": "auto",
+            "run_id": None,
+        })
+    return assignations
+
+def dates_mois(jour):
+    debut = jour.replace(day=1)
+    fin = (debut + timedelta(days=32)).replace(day=1)
+    return [(debut + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((fin - debut).days)]
+
+def dates_semaine(semaine_debut):
+    debut = datetime.strptime(semaine_debut, "%Y-%m-%d")
+    return [(debut + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
+
+def construire_contexte(nb_users, nb_types, seed=42):
+    rng = random.Random(seed)
+    users = generer_users(nb_users, rng)
+    types_garde = generer_types_garde(nb_types, rng)
+    disponibilites = generer_disponibilites(users, types_garde, dates_semaine(SEMAINE_DEBUT), rng)
+    heures_mensuelles = {}
+    for _ in range(nb_users * 2):
+        user_id = rng.choice(users)["id"]
+        heures_mensuelles[user_id] = heures_mensuelles.get(user_id, 0) + rng.choice(types_garde)["duree_heures"]
+    semaine_fin = dates_semaine(SEMAINE_DEBUT)[-1]
+    return server.ContexteSemaine(SEMAINE_DEBUT, semaine_fin, users, types_garde, disponibilites, [], heures_mensuelles)
+
+def bench_solveur(nb_users, nb_types, repetitions, seed=42):
+    """Temps de résolution d'une semaine complète par le solveur d'attribution (en mémoire)"""
+    durees = []
+    for repetition in range(repetitions):
+        contexte = construire_contexte(nb_users, nb_types, seed + repetition)
+        heures = server.calculer_heures_mensuelles(contexte)
+        debut = time.perf_counter()
+        plan = server.planifier_attribution(contexte, heures)
+        durees.append(time.perf_counter() - debut)
+        temps_partiel = [u["id"] for u in contexte.users if u["type_emploi"] == "temps_partiel"]
+        metriques = server.calculer_metriques_plan(contexte, plan, heures, temps_partiel)
+
+    return {
+        "benchmark": "solveur_attribution",
+        "users": nb_users,
+        "types_garde": nb_types,
+        "repetitions": repetitions,
+        "secondes_min": round(min(durees), 4),
+        "secondes_max": round(max(durees), 4),
+        "assignations_proposees": len(plan),
+        "taux_couverture": metriques["couverture"]["taux_couverture"],
+        "ecart_heures": metriques["equite"]["ecart_heures"],
+    }
+
+# ==================== BENCHMARKS MONGODB ====================
+
+COLLECTIONS_BENCHMARK = [
+    "users", "types_garde", "assignations", "disponibilites", "heures_mensuelles",
+    "epi_employes", "demandes_remplacement", "notifications",
+    "baux_planning", "cles_idempotence", "versions_planning", "compteurs_notifications",
+]
+
+def verifier_base_benchmark(forcer):
+    """Les benchmarks MongoDB vident la base : refuser une base qui ne semble pas dédiée"""
+    nom = server.db.name
+    if not forcer and "benchmark" not in nom:
+        print(f"❌ La base '{nom}' va être vidée : utilisez une base *benchmark* ou --forcer")
+        sys.exit(2)
+
+async def inserer_par_lots(collection, documents, taille_lot=10000):
+    for debut in range(0, len(documents), taille_lot):
+        await collection.insert_many(documents[debut:debut + taille_lot], ordered=False)
+
+async def peupler_base(nb_assignations, seed=42, nb_types=12):
+    """
+    Vide puis remplit la base de benchmark : utilisateurs, types de garde, disponibilités et
+    assignations du mois courant, proportionnels au nombre d'assignations demandé.
+    """
+    rng = random.Random(seed)
+    for nom in COLLECTIONS_BENCHMARK:
+        await server.db[nom].delete_many({})
+    await server.ensure_indexes()
+    
+    dates = dates_mois(datetime.now())
+    users = generer_users(max(50, nb_assignations // 50), rng)
+    types_garde = generer_types_garde(nb_types, rng)
+    disponibilites = generer_disponibilites(users, types_garde, dates, rng)
+    assignations = generer_assignations(users, types_garde, nb_assignations, rng, dates)
+    
+    await inserer_par_lots(server.db.users, users)
+    await inserer_par_lots(server.db.types_garde, types_garde)
+    await inserer_par_lots(server.db.disponibilites, disponibilites)
+    await inserer_par_lots(server.db.assignations, assignations)
+    return {"users": len(users), "disponibilites": len(disponibilites), "assignations": len(assignations)}
+
+def utilisateur_admin():
+    return server.User(
+        id="admin-benchmark", email="admin@benchmark.local", nom="Admin", prenom="Benchmark",
+        grade="Directeur", type_emploi="temps_plein", role="admin", numero_employe="BEN-ADMIN",
+        date_embauche="01/01/2000"
+    )
+
+async def chronometrer(coroutine_factory, repetitions):
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        await coroutine_factory()
+        durees.append(time.perf_counter() - debut)
+    return min(durees)
+
+async def bench_statistiques_avancees(tailles, repetitions):
+    """Temps de /rapports/statistiques-avancees (et de la reconstruction du registre) par taille de base"""
+    admin = utilisateur_admin()
+    mesures = []
+    for taille in tailles:
+        volumes = await peupler_base(taille)
+        reconstruction = await chronometrer(server.reconstruire_heures_mensuelles, 1)
+        endpoint = await chronometrer(lambda: server.get_statistiques_avancees(current_user=admin), repetitions)
+        mesures.append({
+            **volumes,
+            "secondes_reconstruction_registre": round(reconstruction, 4),
+            "secondes_endpoint": round(endpoint, 4),
+            "microsecondes_par_assignation": round(endpoint / taille * 1e6, 3),
+        })
+    
+    # Croissance linéaire : le temps par assignation ne doit pas augmenter avec la taille
+    premiere, derniere = mesures[0], mesures[-1]
+    facteur = (derniere["secondes_endpoint"] / max(premiere["secondes_endpoint"], 1e-6)) / (derniere["assignations"] / premiere["assignations"])
+    return {
+        "benchmark": "statistiques_avancees",
+        "repetitions": repetitions,
+        "mesures": mesures,
+        "facteur_croissance": round(facteur, 3),
+    }
+
+# ==================== JEU DE DONNÉES SYNTHÉTIQUE ====================
+
+TYPES_EPI = ["casque", "bottes", "veste_bunker", "pantalon_bunker", "gants", "masque_scba"]
+
+def lundi_courant():
+    aujourd_hui = datetime.now().date()
+    return (aujourd_hui - timedelta(days=aujourd_hui.weekday())).strftime("%Y-%m-%d")
+
+def dates_semaines(semaine_debut, nb_semaines):
+    debut = datetime.strptime(semaine_debut, "%Y-%m-%d")
+    return [(debut + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7 * nb_semaines)]
+
+def generer_epis(users, rng, par_user=2):
+    """EPI des pompiers : expirations et inspections réparties autour d'aujourd'hui (une partie en alerte)"""
+    maintenant = datetime.now(timezone.utc)
+    epis = []
+    for user in users:
+        for type_epi in rng.sample(TYPES_EPI, par_user):
+            epis.append({
+                "id": f"epi-{len(epis):08d}",
+                "employe_id": user["id"],
+                "type_epi": type_epi,
+                "taille": rng.choice(["S", "M", "L", "XL"]),
+                "date_attribution": (maintenant - timedelta(days=rng.randint(30, 2000))).isoformat(),
+                "etat": rng.choice(["Neuf", "Bon", "Bon", "À remplacer"]),
+                "date_expiration": (maintenant + timedelta(days=rng.randint(-15, 720))).isoformat(),
+                "date_prochaine_inspection": (maintenant + timedelta(days=rng.randint(-5, 180))).isoformat(),
+                "historique_inspections": [],
+                "notes": None,
+                "created_at": maintenant.isoformat(),
+                "updated_at": maintenant.isoformat(),
+            })
+    return epis
+
+def generer_demandes_remplacement(users, types_garde, dates, nb_demandes, rng):
+    return [
+        {
+            "id": f"demande-{i:06d}",
+            "demandeur_id": rng.choice(users)["id"],
+            "type_garde_id": rng.choice(types_garde)["id"],
+            "date": rng.choice(dates),
+            "raison": "Benchmark",
+            "statut": "en_cours",
+            "remplacant_id": None,
+            "created_at": datetime.now(timezone.utc),
+        }
+        for i in range(nb_demandes)
+    ]
+
+async def peupler_donnees(nb_users, nb_types=12, nb_semaines=4, seed=42):
+    """
+    Vide puis remplit la base de benchmark à l'échelle demandée, par insert_many en lots :
+    N pompiers, M types de garde, K semaines de disponibilités (à partir de la semaine courante)
+    et K semaines d'historique d'assignations (une garde par pompier et par semaine en moyenne),
+    EPI et demandes de remplacement ; le registre des heures est reconstruit.
+    """
+    rng = random.Random(seed)
+    for nom in COLLECTIONS_BENCHMARK:
+        await server.db[nom].delete_many({})
+    await server.ensure_indexes()
+    
+    semaine = lundi_courant()
+    debut_historique = (datetime.strptime(semaine, "%Y-%m-%d") - timedelta(weeks=nb_semaines)).strftime("%Y-%m-%d")
+    dates_futures = dates_semaines(semaine, nb_semaines)
+    users = generer_users(nb_users, rng)
+    types_garde = generer_types_garde(nb_types, rng)
+    disponibilites = generer_disponibilites(users, types_garde, dates_futures, rng, jours_par_semaine=4 * nb_semaines)
+    assignations = generer_assignations(users, types_garde, nb_users * nb_semaines, rng, dates_semaines(debut_historique, nb_semaines))
+    epis = generer_epis(users, rng)
+    demandes = generer_demandes_remplacement(users, types_garde, dates_futures[:7], max(10, nb_users // 100), rng)
+    
+    debut = time.perf_counter()
+    await inserer_par_lots(server.db.users, users)
+    await inserer_par_lots(server.db.types_garde, types_garde)
+    await inserer_par_lots(server.db.disponibilites, disponibilites)
+    await inserer_par_lots(server.db.assignations, assignations)
+    await inserer_par_lots(server.db.epi_employes, epis)
+    await inserer_par_lots(server.db.demandes_remplacement, demandes)
+    await server.reconstruire_heures_mensuelles()
+    
+    return {
+        "users": len(users),
+        "types_garde": len(types_garde),
+        "semaines": nb_semaines,
+        "disponibilites": len(disponibilites),
+        "assignations": len(assignations),
+        "epi": len(epis),
+        "demandes_remplacement": len(demandes),
+        "semaine_attribution": semaine,
+        "secondes_chargement": round(time.perf_counter() - debut, 3),
+    }
+
+# ==================== SUITE DE BENCHMARKS ====================
+
+async def mesurer(nom, coroutine_factory, repetitions, avant=None):
+    """Temps (mur) et requêtes MongoDB d'un endpoint, comptées par l'instrumentation du serveur"""
+    durees = []
+    for _ in range(repetitions):
+        if avant:
+            avant()
+        mesures = server.MesuresRequete()
+        jeton = server.requete_courante.set(mesures)
+        debut = time.perf_counter()
+        try:
+            await coroutine_factory()
+        finally:
+            durees.append(time.perf_counter() - debut)
+            server.requete_courante.reset(jeton)
+    return {
+        "endpoint": nom,
+        "secondes_min": round(min(durees), 4),
+        "secondes_mediane": round(statistics.median(durees), 4),
+        "requetes_db": mesures.allers_retours,
+        "documents_lus": mesures.documents,
+        "secondes_db": round(mesures.duree_db, 4),
+    }
+
+def version_code():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "inconnue"
+
+async def bench_suite(tailles, nb_types, nb_semaines, repetitions):
+    """Endpoints critiques mesurés à chaque taille de base (attribution en prévisualisation : sans écriture)"""
+    admin = utilisateur_admin()
+    resultats = []
+    for taille in tailles:
+        volumes = await peupler_donnees(taille, nb_types, nb_semaines)
+        semaine = volumes["semaine_attribution"]
+        demande = await server.db.demandes_remplacement.find_one({}, {"_id": 0, "id": 1})
+        
+        endpoints = [
+            await mesurer(
+                "POST /planning/attribution-auto?dry_run=true",
+                lambda: server.attribution_automatique(semaine_debut=semaine, dry_run=True, idempotency_key=None, current_user=admin),
+                repetitions
+            ),
+            await mesurer(
+                "POST /remplacements/{id}/recherche-automatique",
+                lambda: server.recherche_remplacants_automatique(demande["id"], current_user=admin),
+                repetitions
+            ),
+            # Sans le cache partagé : on mesure le calcul
+            await mesurer(
+                "GET /statistiques",
+                lambda: server.get_statistiques(current_user=admin),
+                repetitions,
+                avant=server.statistiques_cache.invalidate
+            ),
+            await mesurer(
+                "GET /rapports/statistiques-avancees",
+                lambda: server.get_statistiques_avancees(current_user=admin),
+                repetitions
+            ),
+            await mesurer(
+                "GET /epi/alertes/all",
+                lambda: server.get_epi_alerts(current_user=admin),
+                repetitions
+            ),
+        ]
+        resultats.append({"volumes": volumes, "endpoints": endpoints})
+        for mesure in endpoints:
+            print(f"  {taille:>6} users  {mesure['endpoint']:<48} {mesure['secondes_min']:>8.4f}s  {mesure['requetes_db']:>6} requêtes")
+    
+    return {
+        "benchmark": "suite_endpoints",
+        "version": version_code(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "repetitions": repetitions,
+        "resultats": resultats,
+    }
+
+def comparer_resultats(ancien, nouveau):
+    """Rapports nouveau / ancien (temps minimal et requêtes) pour chaque taille et endpoint communs"""
+    anciens = {
+        (r["volumes"]["users"], m["endpoint"]): m
+        for r in ancien["resultats"] for m in r["endpoints"]
+    }
+    comparaisons = []
+    for r in nouveau["resultats"]:
+        for m in r["endpoints"]:
+            reference = anciens.get((r["volumes"]["users"], m["endpoint"]))
+            if reference is None:
+                continue
+            comparaisons.append({
+                "users": r["volumes"]["users"],
+                "endpoint": m["endpoint"],
+                "facteur_temps": round(m["secondes_min"] / max(reference["secondes_min"], 1e-6), 3),
+                "requetes_db": [reference["requetes_db"], m["requetes_db"]],
+            })
+    return {"version_reference": ancien.get("version"), "version": nouveau.get("version"), "comparaisons": comparaisons}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks du backend ProFireManager")
+    sous_commandes = parser.add_subparsers(dest="commande", required=True)
+
+    solveur = sous_commandes.add_parser("solveur", help="Solveur d'attribution hebdomadaire (en mémoire)")
+    solveur.add_argument("--users", type=int, default=300)
+    solveur.add_argument("--types", type=int, default=20)
+    solveur.add_argument("--repetitions", type=int, default=3)
+    solveur.add_argument("--seuil-secondes", type=float, default=1.0)
+
+    statistiques = sous_commandes.add_parser("statistiques-avancees", help="/rapports/statistiques-avancees sur MongoDB")
+    statistiques.add_argument("--tailles", type=int, nargs="+", default=[1000, 10000, 100000])
+    statistiques.add_argument("--repetitions", type=int, default=3)
+    statistiques.add_argument("--facteur-max", type=float, default=1.5, help="Croissance tolérée au-delà du linéaire")
+    statistiques.add_argument("--forcer", action="store_true", help="Autoriser une base dont le nom ne contient pas 'benchmark'")
+    
+    peupler = sous_commandes.add_parser("peupler", help="Charge un jeu de données synthétique dans MongoDB")
+    peupler.add_argument("--users", type=int, default=1000)
+    peupler.add_argument("--types", type=int, default=12)
+    peupler.add_argument("--semaines", type=int, default=4, help="Semaines de disponibilités et d'historique")
+    peupler.add_argument("--seed", type=int, default=42)
+    peupler.add_argument("--forcer", action="store_true", help="Autoriser une base dont le nom ne contient pas 'benchmark'")
+
+    suite = sous_commandes.add_parser("suite", help="Endpoints critiques à plusieurs tailles, résultats en JSON")
+    suite.add_argument("--tailles", type=int, nargs="+", default=[100, 1000, 10000], help="Nombres de pompiers")
+    suite.add_argument("--types", type=int, default=12)
+    suite.add_argument("--semaines", type=int, default=4)
+    suite.add_argument("--repetitions", type=int, default=3)
+    suite.add_argument("--sortie", default="benchmark_resultats.json")
+    suite.add_argument("--comparer", help="Résultats JSON d'une version précédente")
+    suite.add_argument("--facteur-max", type=float, default=1.5, help="Ralentissement toléré par rapport à --comparer")
+    suite.add_argument("--forcer", action="store_true", help="Autoriser une base dont le nom ne contient pas 'benchmark'")
+    
+    args = parser.parse_args()
+
+    if args.commande == "solveur":
+        resultat = bench_solveur(args.users, args.types, args.repetitions)
+        print(json.dumps(resultat, indent=2, ensure_ascii=False))
+        if resultat["secondes_max"] > args.seuil_secondes:
+            print(f"❌ FAIL - Résolution en {resultat['secondes_max']}s (seuil {args.seuil_secondes}s)")
+            sys.exit(1)
+        print(f"✅ PASS - Résolution en {resultat['secondes_max']}s (seuil {args.seuil_secondes}s)")
+    
+    elif args.commande == "statistiques-avancees":
+        verifier_base_benchmark(args.forcer)
+        resultat = asyncio.run(bench_statistiques_avancees(sorted(args.tailles), args.repetitions))
+        print(json.dumps(resultat, indent=2, ensure_ascii=False))
+        if resultat["facteur_croissance"] > args.facteur_max:
+            print(f"❌ FAIL - Croissance {resultat['facteur_croissance']}x au-delà du linéaire (max {args.facteur_max}x)")
+            sys.exit(1)
+        print(f"✅ PASS - Croissance {resultat['facteur_croissance']}x du linéaire (max {args.facteur_max}x)")
+    
+    elif args.commande == "peupler":
+        verifier_base_benchmark(args.forcer)
+        volumes = asyncio.run(peupler_donnees(args.users, args.types, args.semaines, args.seed))
+        print(json.dumps(volumes, indent=2, ensure_ascii=False))
+    
+    elif args.commande == "suite":
+        verifier_base_benchmark(args.forcer)
+        resultat = asyncio.run(bench_suite(args.tailles, args.types, args.semaines, args.repetitions))
+        Path(args.sortie).write_text(json.dumps(resultat, indent=2, ensure_ascii=False, default=str), encoding="utf-8")
+        print(f"Résultats écrits dans {args.sortie}")
+        if args.comparer:
+            comparaison = comparer_resultats(json.loads(Path(args.comparer).read_text(encoding="utf-8")), resultat)
+            print(json.dumps(comparaison, indent=2, ensure_ascii=False))
+            lents = [c for c in comparaison["comparaisons"] if c["facteur_temps"] > args.facteur_max]
+            if lents:
+                for c in lents:
+                    print(f"❌ FAIL - {c['endpoint']} ({c['users']} users) {c['facteur_temps']}x plus lent (max {args.facteur_max}x)")
+                sys.exit(1)
+            print(f"✅ PASS - Aucun endpoint plus de {args.facteur_max}x plus lent que {comparaison['version_reference']}")
+
+if __name__ == "__main__":
+    main()
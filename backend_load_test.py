@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+ProFireManager Backend Load Test
+Charge l'application FastAPI dans le processus (transport ASGI httpx, sans réseau) contre
+un mongod local, avec de nombreux utilisateurs virtuels concurrents, et rapporte la latence
+p50/p95/p99 et le débit par endpoint.
+
+Usage:
+    python backend_load_test.py [--scenario mixte] [--utilisateurs 200] [--duree 60] [--users 1000]
+
+Scénarios:
+    releve         tempête de tableaux de bord à la relève de garde (tous en même temps)
+    notifications  interrogation périodique du compteur de notifications
+    edition        modifications du planning par les superviseurs
+    mixte          70 % notifications, 20 % relève, 10 % édition
+
+Utilise MONGO_URL / DB_NAME comme backend_benchmark.py (base *benchmark* vidée puis peuplée,
+sauf --sans-peuplement). Le client tourne dans la même boucle que le serveur : les latences
+incluent le coût du client, mais pas celui du réseau.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+import backend_benchmark
+from backend_benchmark import server
+
+MIXTE = [("notifications", 0.7), ("releve", 0.2), ("edition", 0.1)]
+
+# Une ligne de log par requête fausserait les mesures
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+class Statistiques:
+    """Latences et codes de statut par endpoint (nom de route, sans les identifiants)"""
+    def __init__(self):
+        self.latences = {}
+        self.statuts = {}
+        self.exceptions = {}
+
+    def observer(self, endpoint, duree, statut):
+        self.latences.setdefault(endpoint, []).append(duree)
+        statuts = self.statuts.setdefault(endpoint, {})
+        statuts[statut] = statuts.get(statut, 0) + 1
+
+    def exception(self, endpoint, erreur):
+        cle = f"{endpoint}: {type(erreur).__name__}"
+        self.exceptions[cle] = self.exceptions.get(cle, 0) + 1
+
+def centile(valeurs_triees, p):
+    if not valeurs_triees:
+        return 0.0
+    return valeurs_triees[max(0, math.ceil(p / 100 * len(valeurs_triees)) - 1)]
+
+def rapport(stats, duree):
+    endpoints = []
+    toutes = []
+    for endpoint, latences in sorted(stats.latences.items()):
+        latences = sorted(latences)
+        toutes.extend(latences)
+        endpoints.append({
+            "endpoint": endpoint,
+            "requetes": len(latences),
+            "par_seconde": round(len(latences) / duree, 2),
+            "p50_ms": round(centile(latences, 50) * 1000, 1),
+            "p95_ms": round(centile(latences, 95) * 1000, 1),
+            "p99_ms": round(centile(latences, 99) * 1000, 1),
+            "max_ms": round(latences[-1] * 1000, 1),
+            "statuts": {str(statut): n for statut, n in sorted(stats.statuts[endpoint].items())},
+        })
+    toutes.sort()
+    return {
+        "total": {
+            "requetes": len(toutes),
+            "par_seconde": round(len(toutes) / duree, 2),
+            "p50_ms": round(centile(toutes, 50) * 1000, 1),
+            "p95_ms": round(centile(toutes, 95) * 1000, 1),
+            "p99_ms": round(centile(toutes, 99) * 1000, 1),
+        },
+        "endpoints": endpoints,
+        "exceptions": stats.exceptions,
+    }
+
+class UtilisateurVirtuel:
+    def __init__(self, client, stats, user, jeton, semaine, rng):
+        self.client = client
+        self.stats = stats
+        self.user = user
+        self.entetes = {"Authorization": f"Bearer {jeton}"}
+        self.semaine = semaine
+        self.rng = rng
+        self.etag_grille = None
+        self.derniere_grille = None
+
+    async def appel(self, methode, endpoint, url, **kwargs):
+        entetes = {**self.entetes, **kwargs.pop("headers", {})}
+        debut = time.perf_counter()
+        try:
+            reponse = await self.client.request(methode, url, headers=entetes, **kwargs)
+        except Exception as e:
+            self.stats.exception(endpoint, e)
+            return None
+        self.stats.observer(endpoint, time.perf_counter() - debut, reponse.status_code)
+        return reponse
+
+    async def grille(self):
+        """Grille de la semaine, revalidée par ETag comme le ferait le navigateur"""
+        entetes = {"If-None-Match": self.etag_grille} if self.etag_grille else {}
+        reponse = await self.appel("GET", "GET /planning/grille/{semaine}", f"/api/planning/grille/{self.semaine}", headers=entetes)
+        if reponse is not None and reponse.status_code == 200:
+            self.etag_grille = reponse.headers.get("etag")
+            self.derniere_grille = reponse.json()
+        return self.derniere_grille
+
+# ==================== SCÉNARIOS ====================
+# Une itération par appel ; la pause entre deux itérations imite le rythme d'un vrai utilisateur.
+
+async def releve(vu):
+    """Ouverture de l'application à la relève : profil, tableau de bord, planning, notifications"""
+    await vu.appel("GET", "GET /auth/me", "/api/auth/me")
+    await vu.appel("GET", "GET /statistiques", "/api/statistiques")
+    await vu.grille()
+    await vu.appel("GET", "GET /notifications/non-lues/count", "/api/notifications/non-lues/count")
+    await vu.appel("GET", "GET /notifications", "/api/notifications")
+    return vu.rng.uniform(2, 5)
+
+async def notifications(vu):
+    """Interrogation du compteur, lecture de la liste de temps en temps"""
+    reponse = await vu.appel("GET", "GET /notifications/non-lues/count", "/api/notifications/non-lues/count")
+    if reponse is not None and reponse.status_code == 200 and reponse.json()["count"] and vu.rng.random() < 0.2:
+        liste = await vu.appel("GET", "GET /notifications", "/api/notifications")
+        if liste is not None and liste.status_code == 200 and liste.json():
+            notification = vu.rng.choice(liste.json())
+            await vu.appel("PUT", "PUT /notifications/{id}/marquer-lu", f"/api/notifications/{notification['id']}/marquer-lu")
+    return vu.rng.uniform(1, 3)
+
+async def edition(vu):
+    """Superviseur : consulte la grille, assigne un pompier, retire parfois une assignation"""
+    grille = await vu.grille() or {}
+    jours = [jour for jour in grille.get("jours", []) if jour["gardes"]]
+    if jours:
+        jour = vu.rng.choice(jours)
+        garde = vu.rng.choice(jour["gardes"])
+        await vu.appel("POST", "POST /planning/assignation", "/api/planning/assignation", json={
+            "user_id": vu.rng.choice(vu.user["collegues"]),
+            "type_garde_id": garde["type_garde_id"],
+            "date": jour["date"],
+            "assignation_type": "manuel",
+        })
+        assignes = [a for j in jours for g in j["gardes"] for a in g["assignes"]]
+        if assignes and vu.rng.random() < 0.3:
+            assignation = vu.rng.choice(assignes)
+            await vu.appel("DELETE", "DELETE /planning/assignation/{id}", f"/api/planning/assignation/{assignation['assignation_id']}")
+    return vu.rng.uniform(0.5, 2)
+
+SCENARIOS = {"releve": releve, "notifications": notifications, "edition": edition}
+
+async def executer_vu(vu, scenario, horloge, depart):
+    await depart.wait()
+    fin = horloge["fin"]
+    while time.perf_counter() < fin:
+        pause = await scenario(vu)
+        await asyncio.sleep(min(pause, max(0.0, fin - time.perf_counter())))
+
+# ==================== PRÉPARATION ====================
+
+async def preparer_donnees(nb_users, nb_semaines, peupler, seed):
+    """Jeu de données synthétique, superviseurs et notifications non lues"""
+    if peupler:
+        volumes = await backend_benchmark.peupler_donnees(nb_users, nb_semaines=nb_semaines, seed=seed)
+        print(f"Base peuplée: {json.dumps(volumes, ensure_ascii=False)}")
+
+    rng = random.Random(seed)
+    users = await server.db.users.find({"statut": "Actif"}, {"_id": 0, "id": 1, "role": 1}).to_list(None)
+    if not users:
+        print("❌ Aucun utilisateur actif en base (relancer sans --sans-peuplement)")
+        sys.exit(2)
+    superviseurs = [u["id"] for u in users[:max(1, len(users) // 50)]]
+    await server.db.users.update_many({"id": {"$in": superviseurs}}, {"$set": {"role": "superviseur"}})
+    server.user_cache.clear()
+
+    if peupler:
+        maintenant = datetime.now(timezone.utc)
+        notifications = [
+            server.Notification(
+                destinataire_id=user["id"],
+                type="planning_assigne",
+                titre="Nouveau quart assigné",
+                message="Notification de charge",
+                statut="non_lu" if rng.random() < 0.5 else "lu",
+                date_creation=(maintenant - timedelta(minutes=rng.randint(0, 60 * 24 * 30))).isoformat()
+            ).dict()
+            for user in users for _ in range(rng.randint(0, 8))
+        ]
+        await backend_benchmark.inserer_par_lots(server.db.notifications, notifications)
+        await server.reconciliation_notifications.traiter()
+
+    ids = [u["id"] for u in users]
+    return [
+        {"id": u["id"], "superviseur": u["id"] in superviseurs, "collegues": ids}
+        for u in users
+    ]
+
+def repartir_scenarios(scenario, nb_utilisateurs):
+    if scenario != "mixte":
+        return [scenario] * nb_utilisateurs
+    repartition = []
+    for nom, part in MIXTE:
+        repartition += [nom] * round(part * nb_utilisateurs)
+    return (repartition + ["notifications"] * nb_utilisateurs)[:nb_utilisateurs]
+
+async def charge(args):
+    users = await preparer_donnees(args.users, args.semaines, not args.sans_peuplement, args.seed)
+    superviseurs = [u for u in users if u["superviseur"]]
+    employes = [u for u in users if not u["superviseur"]] or users
+    semaine = backend_benchmark.lundi_courant()
+    rng = random.Random(args.seed)
+
+    await server.app.router.startup()
+    stats = Statistiques()
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        limites = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(transport=transport, base_url="http://charge.local", limits=limites, timeout=60) as client:
+            depart = asyncio.Event()
+            horloge = {}
+            taches = []
+            for i, nom in enumerate(repartir_scenarios(args.scenario, args.utilisateurs)):
+                user = rng.choice(superviseurs if nom == "edition" else employes)
+                jeton = server.create_access_token(data={"sub": user["id"]})
+                vu = UtilisateurVirtuel(client, stats, user, jeton, semaine, random.Random(args.seed + i))
+                taches.append(asyncio.create_task(executer_vu(vu, SCENARIOS[nom], horloge, depart)))
+            # Signal de départ commun : tous les utilisateurs commencent en même temps
+            debut = time.perf_counter()
+            horloge["fin"] = debut + args.duree
+            depart.set()
+            await asyncio.gather(*taches)
+            duree = time.perf_counter() - debut
+    finally:
+        await server.app.router.shutdown()
+
+    return {
+        "scenario": args.scenario,
+        "utilisateurs_virtuels": args.utilisateurs,
+        "duree_secondes": round(duree, 1),
+        "version": backend_benchmark.version_code(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        **rapport(stats, duree),
+    }
+
+def afficher(resultat):
+    total = resultat["total"]
+    print(f"\n{resultat['scenario']} : {resultat['utilisateurs_virtuels']} utilisateurs virtuels, {resultat['duree_secondes']}s")
+    print(f"{'endpoint':<44} {'req':>7} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}  statuts")
+    for e in resultat["endpoints"]:
+        print(f"{e['endpoint']:<44} {e['requetes']:>7} {e['par_seconde']:>8} {e['p50_ms']:>7}ms {e['p95_ms']:>7}ms {e['p99_ms']:>7}ms  {e['statuts']}")
+    print(f"{'TOTAL':<44} {total['requetes']:>7} {total['par_seconde']:>8} {total['p50_ms']:>7}ms {total['p95_ms']:>7}ms {total['p99_ms']:>7}ms")
+    for exception, nombre in resultat["exceptions"].items():
+        print(f"⚠️  {nombre} x {exception}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge en processus du backend ProFireManager")
+    parser.add_argument("--scenario", choices=["mixte", *SCENARIOS], default="mixte")
+    parser.add_argument("--utilisateurs", type=int, default=200, help="Utilisateurs virtuels concurrents")
+    parser.add_argument("--duree", type=float, default=60, help="Durée de la charge en secondes")
+    parser.add_argument("--users", type=int, default=1000, help="Pompiers du jeu de données synthétique")
+    parser.add_argument("--semaines", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sans-peuplement", action="store_true", help="Réutiliser les données déjà en base")
+    parser.add_argument("--sortie", help="Écrire le rapport JSON dans ce fichier")
+    parser.add_argument("--p95-max-ms", type=float, help="Échouer si le p95 global dépasse ce seuil")
+    parser.add_argument("--forcer", action="store_true", help="Autoriser une base dont le nom ne contient pas 'benchmark'")
+    args = parser.parse_args()
+
+    backend_benchmark.verifier_base_benchmark(args.forcer)
+    resultat = asyncio.run(charge(args))
+    afficher(resultat)
+    if args.sortie:
+        Path(args.sortie).write_text(json.dumps(resultat, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"Rapport écrit dans {args.sortie}")
+
+    if args.p95_max_ms is not None:
+        if resultat["total"]["p95_ms"] > args.p95_max_ms:
+            print(f"❌ FAIL - p95 {resultat['total']['p95_ms']}ms (seuil {args.p95_max_ms}ms)")
+            sys.exit(1)
+        print(f"✅ PASS - p95 {resultat['total']['p95_ms']}ms (seuil {args.p95_max_ms}ms)")
+
+if __name__ == "__main__":
+    main()
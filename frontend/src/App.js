@@ -1,4 +1,4 @@
-import React, { useState, useEffect, Suspense, lazy } from "react";
+import React, { useState, useEffect, useRef, Suspense, lazy } from "react";
 import { BrowserRouter, Routes, Route, Navigate } from "react-router-dom";
 import axios from "axios";
 import { Button } from "./components/ui/button";
@@ -180,6 +180,87 @@ const Login = () => {
   );
 };
 
+// Flux d'événements serveur (SSE) : une seule connexion EventSource partagée par les composants abonnés.
+// Le flux s'ouvre avec un ticket de courte durée (jamais le jeton de session dans l'URL) ; après une
+// erreur, la connexion est fermée et rouverte avec un nouveau ticket. L'événement local `_etat`
+// ({ connecte }) permet aux composants d'interroger l'API tant que le flux est coupé.
+const FLUX_RECONNEXION_MS = 5000;
+const fluxEvenements = { source: null, handlers: {}, abonnes: 0, ouverture: false, reconnexion: null, connecte: false };
+
+const diffuserEvenement = (type, data) => {
+  (fluxEvenements.handlers[type] || new Set()).forEach(handler => handler(data));
+};
+
+const changerEtatFlux = (connecte) => {
+  if (fluxEvenements.connecte === connecte) return;
+  fluxEvenements.connecte = connecte;
+  diffuserEvenement('_etat', { connecte });
+};
+
+const ecouterEvenement = (source, type) => {
+  if (type !== '_etat') source.addEventListener(type, (event) => diffuserEvenement(type, JSON.parse(event.data)));
+};
+
+const fermerFluxEvenements = () => {
+  clearTimeout(fluxEvenements.reconnexion);
+  fluxEvenements.reconnexion = null;
+  if (fluxEvenements.source) fluxEvenements.source.close();
+  fluxEvenements.source = null;
+  changerEtatFlux(false);
+};
+
+const ouvrirFluxEvenements = async () => {
+  fermerFluxEvenements();
+  if (!localStorage.getItem('token') || fluxEvenements.abonnes === 0) return;
+  const reessayer = () => {
+    if (fluxEvenements.abonnes > 0 && !fluxEvenements.reconnexion) {
+      fluxEvenements.reconnexion = setTimeout(ouvrirFluxEvenements, FLUX_RECONNEXION_MS);
+    }
+  };
+  fluxEvenements.ouverture = true;
+  try {
+    const { data } = await axios.post(`${API}/evenements/ticket`);
+    if (fluxEvenements.abonnes === 0 || fluxEvenements.source || fluxEvenements.reconnexion) return;
+    const source = new EventSource(`${API}/evenements?ticket=${encodeURIComponent(data.ticket)}`);
+    fluxEvenements.source = source;
+    Object.keys(fluxEvenements.handlers).forEach(type => ecouterEvenement(source, type));
+    source.onopen = () => changerEtatFlux(true);
+    source.onerror = () => {
+      // Le ticket a pu expirer : ne pas laisser EventSource réessayer avec l'ancien
+      if (fluxEvenements.source !== source) return;
+      fermerFluxEvenements();
+      reessayer();
+    };
+  } catch (error) {
+    console.error('Erreur ouverture du flux d\'événements:', error);
+    reessayer();
+  } finally {
+    fluxEvenements.ouverture = false;
+  }
+};
+
+const useEvenementServeur = (type, handler) => {
+  const handlerRef = useRef(handler);
+  handlerRef.current = handler;
+
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return;
+    const listener = (data) => handlerRef.current(data);
+    if (!fluxEvenements.handlers[type]) {
+      fluxEvenements.handlers[type] = new Set();
+      if (fluxEvenements.source) ecouterEvenement(fluxEvenements.source, type);
+    }
+    fluxEvenements.handlers[type].add(listener);
+    fluxEvenements.abonnes += 1;
+    if (!fluxEvenements.source && !fluxEvenements.reconnexion && !fluxEvenements.ouverture) ouvrirFluxEvenements();
+    return () => {
+      fluxEvenements.handlers[type].delete(listener);
+      fluxEvenements.abonnes -= 1;
+      if (fluxEvenements.abonnes === 0) fermerFluxEvenements();
+    };
+  }, [type]);
+};
+
 // Sidebar Navigation avec menu hamburger mobile
 const Sidebar = ({ currentPage, setCurrentPage }) => {
   const { user, logout } = useAuth();
@@ -187,6 +268,7 @@ const Sidebar = ({ currentPage, setCurrentPage }) => {
   const [showNotifications, setShowNotifications] = useState(false);
   const [notifications, setNotifications] = useState([]);
   const [unreadCount, setUnreadCount] = useState(0);
+  const [fluxConnecte, setFluxConnecte] = useState(fluxEvenements.connecte);
 
   // Charger les notifications
   const loadNotifications = async () => {
@@ -201,14 +283,28 @@ const Sidebar = ({ currentPage, setCurrentPage }) => {
     }
   };
 
-  // Charger au montage et toutes les 30 secondes
+  // Charger au montage ; les mises à jour arrivent ensuite par le flux d'événements
+  // (interrogation toutes les 30 secondes tant que le flux n'est pas connecté)
   useEffect(() => {
-    if (user) {
-      loadNotifications();
+    if (user) loadNotifications();
+  }, [user]);
+
+  useEffect(() => {
+    if (user && !fluxConnecte) {
       const interval = setInterval(loadNotifications, 30000); // 30 secondes
       return () => clearInterval(interval);
     }
-  }, [user]);
+  }, [user, fluxConnecte]);
+
+  useEvenementServeur('_etat', (data) => setFluxConnecte(data.connecte));
+
+  // (Re)connexion ou file saturée côté serveur : rechargement complet
+  useEvenementServeur('connecte', () => { if (user) loadNotifications(); });
+  useEvenementServeur('resynchroniser', () => loadNotifications());
+  useEvenementServeur('notification', (notification) => {
+    setNotifications(prev => [notification, ...prev.filter(n => n.id !== notification.id)].slice(0, 50));
+  });
+  useEvenementServeur('non_lues', (data) => setUnreadCount(data.count));
 
   // Jouer un son quand il y a de nouvelles notifications
   useEffect(() => {
@@ -223,7 +319,8 @@ const Sidebar = ({ currentPage, setCurrentPage }) => {
   const marquerCommeLue = async (notifId) => {
     try {
       await axios.put(`${API}/notifications/${notifId}/marquer-lu`);
-      loadNotifications();
+      setNotifications(prev => prev.map(n => n.id === notifId ? { ...n, statut: 'lu' } : n));
+      if (!fluxConnecte) loadNotifications();
     } catch (error) {
       console.error('Erreur marquage notification:', error);
     }
@@ -232,7 +329,8 @@ const Sidebar = ({ currentPage, setCurrentPage }) => {
   const marquerToutesLues = async () => {
     try {
       await axios.put(`${API}/notifications/marquer-toutes-lues`);
-      loadNotifications();
+      setNotifications(prev => prev.map(n => ({ ...n, statut: 'lu' })));
+      if (!fluxConnecte) loadNotifications();
     } catch (error) {
       console.error('Erreur marquage toutes notifications:', error);
     }
@@ -827,10 +925,13 @@ const Dashboard = () => {
   useEffect(() => {
     const fetchDashboardData = async () => {
       try {
-        const [statsResponse, rapportsResponse, usersResponse] = await Promise.all([
+        const [statsResponse, rapportsResponse, usersResponse, nouveauxResponse] = await Promise.all([
           axios.get(`${API}/statistiques`),
           user.role === 'admin' ? axios.get(`${API}/rapports/statistiques-avancees`) : Promise.resolve({ data: null }),
-          axios.get(`${API}/users`)
+          axios.get(`${API}/users/identites`),
+          axios.get(`${API}/users/identites`, {
+            params: { cree_depuis: new Date(Date.now() - 24 * 60 * 60 * 1000).toISOString() }
+          })
         ]);
         
         setStats(statsResponse.data);
@@ -850,13 +951,8 @@ const Dashboard = () => {
           });
         }
         
-        // Nouveau personnel (si créé récemment)
-        const nouveauPersonnel = users.filter(u => {
-          const creation = new Date(u.created_at);
-          const maintenant = new Date();
-          const diffHeures = (maintenant - creation) / (1000 * 60 * 60);
-          return diffHeures < 24; // Créé dans les 24h
-        });
+        // Nouveau personnel (créé dans les 24h)
+        const nouveauPersonnel = nouveauxResponse.data;
         
         if (nouveauPersonnel.length > 0) {
           activiteItems.push({
@@ -1052,8 +1148,12 @@ const Dashboard = () => {
 };
 
 // Personnel Component complet
+const USERS_PAGE_SIZE = 100;
+
 const Personnel = () => {
   const [users, setUsers] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [formations, setFormations] = useState([]);
   const [loading, setLoading] = useState(true);
   const [showCreateModal, setShowCreateModal] = useState(false);
@@ -1094,14 +1194,27 @@ const Personnel = () => {
 
   const grades = ['Directeur', 'Capitaine', 'Lieutenant', 'Pompier'];
 
+  // Charge une page du personnel ; sans curseur, repart de la première page
+  const loadUsers = async (cursor = null) => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/users`, {
+        params: { limite: USERS_PAGE_SIZE, ...(cursor ? { curseur: cursor } : {}) }
+      });
+      setUsers(previous => cursor ? [...previous, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     const fetchData = async () => {
       try {
-        const [usersResponse, formationsResponse] = await Promise.all([
-          axios.get(`${API}/users`),
+        const [, formationsResponse] = await Promise.all([
+          loadUsers(),
           axios.get(`${API}/formations`)
         ]);
-        setUsers(usersResponse.data);
         setFormations(formationsResponse.data);
       } catch (error) {
         console.error('Erreur lors du chargement des données:', error);
@@ -1141,8 +1254,7 @@ const Personnel = () => {
       setShowCreateModal(false);
       resetNewUser();
       
-      const response = await axios.get(`${API}/users`);
-      setUsers(response.data);
+      await loadUsers();
     } catch (error) {
       toast({
         title: "Erreur",
@@ -1169,7 +1281,24 @@ const Personnel = () => {
     });
   };
 
-  const handleViewUser = async (user) => {
+  // La liste ne porte que les colonnes affichées : fiche complète chargée à l'ouverture
+  const chargerFicheUser = async (user) => {
+    try {
+      const response = await axios.get(`${API}/users/${user.id}`);
+      return response.data;
+    } catch (error) {
+      toast({
+        title: "Erreur",
+        description: "Impossible de charger la fiche du pompier",
+        variant: "destructive"
+      });
+      return null;
+    }
+  };
+
+  const handleViewUser = async (userResume) => {
+    const user = await chargerFicheUser(userResume);
+    if (!user) return;
     setSelectedUser(user);
     // Charger les EPI de l'utilisateur
     try {
@@ -1182,7 +1311,9 @@ const Personnel = () => {
     setShowViewModal(true);
   };
 
-  const handleEditUser = (user) => {
+  const handleEditUser = async (userResume) => {
+    const user = await chargerFicheUser(userResume);
+    if (!user) return;
     setSelectedUser(user);
     setNewUser({
       nom: user.nom,
@@ -1228,8 +1359,7 @@ const Personnel = () => {
       setShowEditModal(false);
       
       // Reload users list
-      const response = await axios.get(`${API}/users`);
-      setUsers(response.data);
+      await loadUsers();
     } catch (error) {
       console.error('Error updating user:', error);
       toast({
@@ -1250,8 +1380,7 @@ const Personnel = () => {
         description: "Le pompier a été supprimé avec succès",
         variant: "success"
       });
-      const response = await axios.get(`${API}/users`);
-      setUsers(response.data);
+      await loadUsers();
     } catch (error) {
       toast({
         title: "Erreur",
@@ -1491,7 +1620,7 @@ const Personnel = () => {
       <div className="personnel-header">
         <div>
           <h1 data-testid="personnel-title">Gestion du personnel</h1>
-          <p>{users.length} pompier(s) enregistré(s)</p>
+          <p>{users.length}{nextCursor ? '+' : ''} pompier(s) enregistré(s)</p>
         </div>
         <Button 
           className="add-btn" 
@@ -1707,6 +1836,14 @@ const Personnel = () => {
             </div>
           ))}
         </div>
+
+        {nextCursor && (
+          <div className="load-more-container">
+            <Button variant="outline" onClick={() => loadUsers(nextCursor)} disabled={loadingMore} data-testid="load-more-users-btn">
+              {loadingMore ? 'Chargement...' : 'Charger plus'}
+            </Button>
+          </div>
+        )}
       </div>
 
       {/* Create User Modal - Version optimisée */}
@@ -2564,6 +2701,7 @@ const Planning = () => {
   const [typesGarde, setTypesGarde] = useState([]);
   const [assignations, setAssignations] = useState([]);
   const [users, setUsers] = useState([]);
+  const [rosterUsers, setRosterUsers] = useState({});
   const [loading, setLoading] = useState(true);
   const [showAssignModal, setShowAssignModal] = useState(false);
   const [showGardeDetailsModal, setShowGardeDetailsModal] = useState(false);
@@ -2609,17 +2747,75 @@ const Planning = () => {
     fetchPlanningData();
   }, [currentWeek, currentMonth, viewMode]);
 
-  const fetchPlanningData = async () => {
-    setLoading(true);
+  // Modification du planning par un autre utilisateur : recharger si la période affichée est touchée
+  // (semaines = lundis modifiés, null = tout le planning)
+  const periodeAffecteePar = (semaines) => {
+    if (!semaines) return true;
+    if (viewMode === 'semaine') return semaines.includes(currentWeek);
+    const [year, month] = currentMonth.split('-').map(Number);
+    const premierJour = `${currentMonth}-01`;
+    const dernierJour = new Date(Date.UTC(year, month, 0)).toISOString().split('T')[0];
+    return semaines.some(lundi => {
+      const dimanche = new Date(`${lundi}T00:00:00Z`);
+      dimanche.setUTCDate(dimanche.getUTCDate() + 6);
+      return lundi <= dernierJour && dimanche.toISOString().split('T')[0] >= premierJour;
+    });
+  };
+  useEvenementServeur('planning', (data) => {
+    if (periodeAffecteePar(data.semaines)) fetchPlanningData({ silencieux: true });
+  });
+  useEvenementServeur('resynchroniser', () => fetchPlanningData({ silencieux: true }));
+  // Flux rétabli après une coupure : des modifications ont pu être manquées
+  const fluxCoupe = useRef(false);
+  useEvenementServeur('_etat', ({ connecte }) => {
+    if (!connecte) fluxCoupe.current = true;
+    else if (fluxCoupe.current) {
+      fluxCoupe.current = false;
+      fetchPlanningData({ silencieux: true });
+    }
+  });
+
+  const fetchPlanningData = async ({ silencieux = false } = {}) => {
+    if (!silencieux) setLoading(true);
     try {
       const dateRange = viewMode === 'mois' ? 
         `${currentMonth}-01` : // Premier jour du mois
         currentWeek;
         
+      const usersRequest = user.role !== 'employe' ? axios.get(`${API}/users/identites`) : Promise.resolve({ data: [] });
+      
+      if (viewMode === 'semaine') {
+        // Grille de la semaine : types, assignations et noms du personnel en une requête
+        const [grilleRes, usersRes] = await Promise.all([
+          axios.get(`${API}/planning/grille/${currentWeek}`),
+          usersRequest
+        ]);
+        const grille = grilleRes.data;
+        const roster = {};
+        const weekAssignations = [];
+        grille.jours.forEach(jour => jour.gardes.forEach(garde => garde.assignes.forEach(assigne => {
+          roster[assigne.user_id] = { id: assigne.user_id, nom: assigne.nom, prenom: assigne.prenom, grade: assigne.grade };
+          weekAssignations.push({
+            id: assigne.assignation_id,
+            user_id: assigne.user_id,
+            type_garde_id: garde.type_garde_id,
+            date: jour.date,
+            statut: assigne.statut,
+            assignation_type: assigne.assignation_type
+          });
+        })));
+        
+        setTypesGarde(grille.types_garde);
+        setAssignations(weekAssignations);
+        setUsers(usersRes.data);
+        setRosterUsers(roster);
+        return;
+      }
+      
       const [typesRes, assignationsRes, usersRes] = await Promise.all([
         axios.get(`${API}/types-garde`),
         axios.get(`${API}/planning/assignations/${dateRange}`),
-        user.role !== 'employe' ? axios.get(`${API}/users`) : Promise.resolve({ data: [] })
+        usersRequest
       ]);
       
       setTypesGarde(typesRes.data);
@@ -2882,7 +3078,7 @@ const Planning = () => {
   };
 
   const getUserById = (userId) => {
-    return users.find(u => u.id === userId);
+    return users.find(u => u.id === userId) || rosterUsers[userId];
   };
 
   const shouldShowTypeGardeForDay = (typeGarde, dayIndex) => {
@@ -3593,7 +3789,7 @@ const Remplacements = () => {
       ];
       
       if (user.role !== 'employe') {
-        promises.push(axios.get(`${API}/users`));
+        promises.push(axios.get(`${API}/users/identites`));
       }
 
       const responses = await Promise.all(promises);
@@ -6458,25 +6654,24 @@ const Rapports = () => {
     return noms[typeEpi] || typeEpi;
   };
 
+  const getDownloadFilename = (response, fallback) => {
+    const disposition = response.headers['content-disposition'] || '';
+    const match = disposition.match(/filename="?([^";]+)"?/);
+    return match ? match[1] : fallback;
+  };
+
   const handleExportPDF = async (typeRapport = "general", userId = null) => {
     try {
       const params = new URLSearchParams({ type_rapport: typeRapport });
       if (userId) params.append('user_id', userId);
       
-      const response = await axios.get(`${API}/rapports/export-pdf?${params}`);
+      const response = await axios.get(`${API}/rapports/export-pdf?${params}`, { responseType: 'blob' });
       
-      // Décoder le base64 et créer le téléchargement
-      const binaryString = atob(response.data.data);
-      const bytes = new Uint8Array(binaryString.length);
-      for (let i = 0; i < binaryString.length; i++) {
-        bytes[i] = binaryString.charCodeAt(i);
-      }
-      
-      const blob = new Blob([bytes], { type: 'application/pdf' });
-      const url = window.URL.createObjectURL(blob);
+      // Le fichier binaire est diffusé tel quel : créer le téléchargement
+      const url = window.URL.createObjectURL(response.data);
       const link = document.createElement('a');
       link.href = url;
-      link.download = response.data.filename;
+      link.download = getDownloadFilename(response, `rapport_${typeRapport}.pdf`);
       link.click();
       window.URL.revokeObjectURL(url);
       
@@ -6496,20 +6691,13 @@ const Rapports = () => {
 
   const handleExportExcel = async (typeRapport = "general") => {
     try {
-      const response = await axios.get(`${API}/rapports/export-excel?type_rapport=${typeRapport}`);
-      
-      // Décoder le base64 et créer le téléchargement
-      const binaryString = atob(response.data.data);
-      const bytes = new Uint8Array(binaryString.length);
-      for (let i = 0; i < binaryString.length; i++) {
-        bytes[i] = binaryString.charCodeAt(i);
-      }
+      const response = await axios.get(`${API}/rapports/export-excel?type_rapport=${typeRapport}`, { responseType: 'blob' });
       
-      const blob = new Blob([bytes], { type: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' });
-      const url = window.URL.createObjectURL(blob);
+      // Le classeur binaire est diffusé tel quel : créer le téléchargement
+      const url = window.URL.createObjectURL(response.data);
       const link = document.createElement('a');
       link.href = url;
-      link.download = response.data.filename;
+      link.download = getDownloadFilename(response, `rapport_${typeRapport}.xlsx`);
       link.click();
       window.URL.revokeObjectURL(url);
       